@@ -17,30 +17,98 @@
 # along with GWSumm.  If not, see <http://www.gnu.org/licenses/>.
 
 """This module handles HDF archiving of data.
+
+Archives are written in the 'v2' layout, with one resizable, chunked,
+and compressed dataset per channel, extended in place on each run:
+
+- ``/``: attribute ``version = 2``
+- ``/timeseries/<key>``, ``/statevector/<key>``, ``/spectrogram/<key>``:
+  a group with a ``data`` dataset holding all samples for that key in
+  the order they were written, and a ``fragments`` dataset with one
+  ``(gps start, sample offset, number of samples)`` row per contiguous
+  fragment, plus the metadata as attributes
+- ``/segments/<flag>``: a group with ``known`` and ``active``
+  ``(start, end)`` datasets
+
+Min/mean/max trends of each `TimeSeries` are archived alongside the
+data, under keys of the form ``<channel>,<statistic>,<level>s``, see
+:func:`gwsumm.data.add_pyramids`.
+
+Archives written in the original (v1) layout, with one dataset per
+fragment, can still be read.
+
+By default, data in v2 archives are read lazily: the segments for each
+channel are registered with the relevant `~gwsumm.datastore.DataStore`,
+and the arrays are only read from disk when some span of that channel is
+requested.
 """
 
+import os
+import json
 import tempfile
 import shutil
 import warnings
 import re
 
-from gwpy.timeseries import (StateVector, TimeSeries)
-from gwpy.spectrogram import Spectrogram
-from gwpy.segments import DataQualityFlag
+import numpy
+
+from astropy import units
+
+from gwpy.timeseries import (StateVector, TimeSeries, TimeSeriesList)
+try:
+    from gwpy.timeseries import StateVectorList
+except ImportError:
+    StateVectorList = TimeSeriesList
+from gwpy.spectrogram import (Spectrogram, SpectrogramList)
+from gwpy.segments import (DataQualityFlag, Segment, SegmentList)
 
 from . import (globalv, mode, version)
-from .data import (get_channel, add_timeseries, add_spectrogram)
+from .data import (get_channel, add_timeseries, add_spectrogram,
+                   add_pyramids)
 
 __author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
 __version__ = version.version
 
-re_rate = re.compile('_EVENT_RATE_')
+re_trend = re.compile('\.(rms|min|mean|max|n)\Z')
+
+ARCHIVE_VERSION = 2
+CHUNK_SIZE = 2 ** 20  # bytes
+COMPRESSION = 'gzip'
+
+LIST_CLASSES = {
+    'timeseries': TimeSeriesList,
+    'statevector': StateVectorList,
+    'spectrogram': SpectrogramList,
+}
+
+
+def get_archive_version(h5file):
+    """Return the layout version of an open HDF5 archive
+    """
+    return int(h5file.attrs.get('version', 1))
+
+
+def _escape(key):
+    """Format a data key as a valid HDF5 object name
+    """
+    return str(key).replace('/', '%2F')
+
 
+# -----------------------------------------------------------------------------
+# write
 
 def write_data_archive(outfile, timeseries=True, spectrogram=True,
-                       segments=True):
+                       segments=True, pyramids=True):
     """Build and save an HDF archive of data processed in this job.
 
+    If the archive already exists in the v2 format, only those data not
+    already stored are appended. An archive in the old v1 format is
+    replaced by a new v2 archive.
+
+    All data are written to a temporary copy of the archive, in the same
+    directory, which replaces the original only once complete, so that
+    the original is left intact if writing fails.
+
     Parameters
     ----------
     outfile : `str`
@@ -49,132 +117,532 @@ def write_data_archive(outfile, timeseries=True, spectrogram=True,
         include `TimeSeries` data in archive
     spectrogram : `bool`, default: `True`
         include `Spectrogram` data in archive
+    segments : `bool`, default: `True`
+        include `DataQualityFlag` data in archive
+    pyramids : `bool`, default: `True`
+        include multi-resolution min/mean/max trends of `TimeSeries` data
     """
     from h5py import File
 
-    backup = backup_existing_archive(outfile)
+    # calculate trends before opening the archive for writing, reading
+    # any data they need from the archive now
+    if timeseries and pyramids:
+        add_pyramids()
+
+    # append to a copy of a current-format archive, old-format archives
+    # are replaced entirely
+    tmpfile = tempfile.mktemp(
+        suffix='.hdf', prefix='.%s.' % os.path.basename(outfile),
+        dir=os.path.dirname(os.path.abspath(outfile)))
+    if os.path.isfile(outfile):
+        with File(outfile, 'r') as h5file:
+            oldversion = get_archive_version(h5file)
+        if oldversion == ARCHIVE_VERSION:
+            shutil.copy2(outfile, tmpfile)
 
     try:
-        with File(outfile, 'w') as h5file:
+        with File(tmpfile, 'a') as h5file:
+            h5file.attrs['version'] = ARCHIVE_VERSION
             # record all time-series data
             if timeseries:
-                tgroup = h5file.create_group('timeseries')
-                sgroup = h5file.create_group('statevector')
+                tgroup = h5file.require_group('timeseries')
+                sgroup = h5file.require_group('statevector')
                 # loop over channels
-                for c, tslist in globalv.DATA.iteritems():
-                    # ignore trigger rate TimeSeries
-                    if re_rate.search(str(c)):
+                for c in globalv.DATA.keys():
+                    # data not yet read from this archive are already in it
+                    globalv.DATA.resolve(c, exclude=os.path.abspath(outfile))
+                    tslist = globalv.DATA.get_loaded(c)
+                    # ignore fast channels who weren't used
+                    # for a timeseries:
+                    tslist = [ts for ts in tslist if
+                              isinstance(ts, StateVector) or
+                              ts.sample_rate.value <= 16.01 or
+                              getattr(c, '_timeseries', False)]
+                    if not tslist:
                         continue
-                    # loop over time-series
-                    for ts in tslist:
-                        # ignore fast channels who weren't used
-                        # for a timeseries:
-                        if (not isinstance(ts, StateVector) and
-                                ts.sample_rate.value > 16.01 and
-                               (not hasattr(c, '_timeseries') or
-                                not c._timeseries)):
-                            continue
-                        try:
-                            name = '%s,%s,%s' % (ts.name, ts.channel.ndsname,
-                                                 ts.epoch.gps)
-                        except AttributeError:
-                            name = '%s,%s' % (ts.name, ts.epoch.gps)
-                        try:
-                            if isinstance(ts, StateVector):
-                                ts.write(sgroup, name=name, format='hdf')
-                            else:
-                                ts.write(tgroup, name=name, format='hdf')
-                        except ValueError as e:
-                            warnings.warn(str(e))
+                    if isinstance(tslist[0], StateVector):
+                        group = sgroup
+                    else:
+                        group = tgroup
+                    try:
+                        write_series(group, c, tslist)
+                    except ValueError as e:
+                        warnings.warn(str(e))
 
             # record all spectrogram data
             if spectrogram:
-                group = h5file.create_group('spectrogram')
+                group = h5file.require_group('spectrogram')
                 # loop over channels
-                for key, speclist in globalv.SPECTROGRAMS.iteritems():
-                    # loop over time-series
-                    for spec in speclist:
-                        name = '%s,%s' % (key, spec.epoch.gps)
-                        try:
-                            spec.write(group, name=name, format='hdf')
-                        except ValueError:
-                            continue
+                for key in globalv.SPECTROGRAMS.keys():
+                    globalv.SPECTROGRAMS.resolve(key, exclude=os.path.abspath(outfile))
+                    speclist = globalv.SPECTROGRAMS.get_loaded(key)
+                    if not len(speclist):
+                        continue
+                    try:
+                        write_series(group, key, speclist)
+                    except ValueError as e:
+                        warnings.warn(str(e))
 
             # record all segment data
             if segments:
-                group = h5file.create_group('segments')
+                group = h5file.require_group('segments')
                 # loop over channels
                 for name, dqflag in globalv.SEGMENTS.iteritems():
-                    dqflag.write(group, name=name, format='hdf')
+                    write_flag(group, name, dqflag)
     except:
-        if backup:
-            restore_backup(backup, outfile)
+        if os.path.isfile(tmpfile):
+            os.remove(tmpfile)
         raise
+    else:
+        os.rename(tmpfile, outfile)
+
+
+def _resizable_dataset(group, name, shape, dtype, compression=COMPRESSION):
+    """Create an empty, resizable, chunked dataset with the given row shape
+    """
+    rowsize = max(numpy.prod(shape, dtype=int), 1) * numpy.dtype(dtype).itemsize
+    chunks = (max(CHUNK_SIZE // rowsize, 1),) + tuple(shape)
+    return group.create_dataset(name, shape=(0,) + tuple(shape),
+                                maxshape=(None,) + tuple(shape),
+                                dtype=dtype, chunks=chunks,
+                                compression=compression,
+                                shuffle=compression is not None)
+
+
+def _append_rows(dataset, rows):
+    """Append rows to a resizable dataset, returning the offset of the first
+    """
+    n = dataset.shape[0]
+    dataset.resize(n + rows.shape[0], axis=0)
+    dataset[n:] = rows
+    return n
+
+
+def get_stored_segments(group):
+    """Return the `SegmentList` of data stored in a v2 archive group
+    """
+    dt = group.attrs['dt']
+    return SegmentList(Segment(start, start + length * dt) for
+                       (start, _, length) in group['fragments'][:]).coalesce()
 
 
-def read_data_archive(sourcefile):
+def write_series(parent, key, serieslist):
+    """Append the new samples for a key to a v2 archive.
+
+    Only those samples not already stored are written, data that are
+    contiguous with the last stored fragment extend that fragment.
+
+    Parameters
+    ----------
+    parent : `h5py.Group`
+        the group to write into, e.g. ``/timeseries``
+    key : `str`
+        the name of the data set
+    serieslist : `list`
+        the list of `TimeSeries`, `StateVector`, or `Spectrogram` objects
+        to write
+    """
+    first = serieslist[0]
+    dt = float(first.dt.value)
+    name = _escape(key)
+    # create new group
+    if name not in parent:
+        group = parent.create_group(name)
+        group.attrs['key'] = str(key)
+        group.attrs['dt'] = dt
+        group.attrs['unit'] = str(first.unit)
+        group.attrs['name'] = str(first.name)
+        if first.channel is not None:
+            group.attrs['channel'] = str(first.channel.ndsname)
+        if isinstance(first, Spectrogram):
+            group.attrs['f0'] = float(first.f0.value)
+            group.attrs['df'] = float(first.df.value)
+        _resizable_dataset(group, 'data', first.shape[1:], first.dtype)
+        _resizable_dataset(group, 'fragments', (3,), float, compression=None)
+        stored = SegmentList()
+    else:
+        group = parent[name]
+        if abs(group.attrs['dt'] - dt) > 1e-9:
+            raise ValueError("Cannot archive %s: sample spacing %s does not "
+                             "match archived data" % (key, dt))
+        stored = get_stored_segments(group)
+    data = group['data']
+    fragments = group['fragments']
+
+    for series in serieslist:
+        _check_rows(group, key, series)
+        x0 = float(series.span[0])
+        for seg in SegmentList([Segment(*map(float, series.span))]) - stored:
+            i0 = int(round((seg[0] - x0) / dt))
+            i1 = min(int(round((seg[1] - x0) / dt)), series.shape[0])
+            if i1 <= i0:
+                continue
+            start = x0 + i0 * dt
+            offset = _append_rows(data,
+                                  series.value[i0:i1].astype(data.dtype))
+            # extend the last fragment if contiguous in time and on disk
+            if fragments.shape[0]:
+                lstart, loffset, llength = fragments[-1]
+                if (loffset + llength == offset and
+                        abs(lstart + llength * dt - start) < dt / 2.):
+                    fragments[-1] = (lstart, loffset, llength + i1 - i0)
+                    continue
+            _append_rows(fragments, numpy.array([[start, offset, i1 - i0]]))
+        stored = (stored | SegmentList([Segment(*map(float,
+                                                     series.span))])).coalesce()
+
+
+def _check_rows(group, key, series):
+    """Check that the rows of a `Series` match those of an archive group
+
+    Raises
+    ------
+    ValueError
+        if the row shape, or the frequency axis of a `Spectrogram`, does
+        not match the archived data
+    """
+    if series.shape[1:] != group['data'].shape[1:]:
+        raise ValueError("Cannot archive %s: row shape %s does not match "
+                         "archived data %s" % (key, series.shape[1:],
+                                               group['data'].shape[1:]))
+    if isinstance(series, Spectrogram):
+        for attr in ['f0', 'df']:
+            value = float(getattr(series, attr).value)
+            if abs(group.attrs[attr] - value) > 1e-9:
+                raise ValueError("Cannot archive %s: %s %s does not match "
+                                 "archived data" % (key, attr, value))
+
+
+def _segments_array(segmentlist):
+    return numpy.array([(float(s[0]), float(s[1])) for s in segmentlist],
+                       dtype=float).reshape(-1, 2)
+
+
+def write_flag(parent, name, flag):
+    """Write a `DataQualityFlag` to a v2 archive, replacing any old version
+    """
+    group = parent.require_group(_escape(name))
+    group.attrs['name'] = str(name)
+    for attr in ['known', 'active']:
+        segs = _segments_array(getattr(flag, attr))
+        if attr not in group:
+            _resizable_dataset(group, attr, (2,), float, compression=None)
+        group[attr].resize(segs.shape[0], axis=0)
+        group[attr][:] = segs
+
+
+# -----------------------------------------------------------------------------
+# read
+
+def read_data_archive(sourcefile, lazy=True):
     """Read archived data from an HDF5 archive source.
 
     Parameters
     ----------
     sourcefile : `str`
         path to source HDF5 file
+    lazy : `bool`, default: `True`
+        register the data segments only, deferring reading the data
+        themselves until they are requested, v1 archives are always
+        read in full
     """
     from h5py import File
 
     with File(sourcefile, 'r') as h5file:
-        # read all time-series data
-        try:
-            group = h5file['timeseries']
-        except KeyError:
-            group = dict()
-        for dataset in group.itervalues():
-            ts = TimeSeries.read(dataset, format='hdf')
-            if (re.search('\.(rms|min|mean|max|n)\Z', ts.channel.name) and
-                    ts.sample_rate.value == 1.0):
-                ts.channel.type = 's-trend'
-            elif re.search('\.(rms|min|mean|max|n)\Z', ts.channel.name):
-                ts.channel.type = 'm-trend'
-            ts.channel = get_channel(ts.channel)
-            try:
-                add_timeseries(ts, key=ts.channel.ndsname)
-            except ValueError:
-                if mode.get_mode() == mode.SUMMARY_MODE_DAY:
-                    raise
-                warnings.warn('Caught ValueError in combining daily archives')
-                # get end time
-                globalv.DATA[ts.channel.ndsname].pop(-1)
-                t = globalv.DATA[ts.channel.ndsname][-1].span[-1]
-                add_timeseries(ts.crop(start=t), key=ts.channel.ndsname)
-
-        # read all state-vector data
-        try:
-            group = h5file['statevector']
-        except KeyError:
-            group = dict()
-        for dataset in group.itervalues():
-            sv = StateVector.read(dataset, format='hdf')
-            sv.channel = get_channel(sv.channel)
-            add_timeseries(sv, key=sv.channel.ndsname)
-
-        # read all spectrogram data
-        try:
-            group = h5file['spectrogram']
-        except KeyError:
-            group = dict()
-        for key, dataset in group.iteritems():
-            key = key.rsplit(',', 1)[0]
-            spec = Spectrogram.read(dataset, format='hdf')
-            spec.channel = get_channel(spec.channel)
-            add_spectrogram(spec, key=key)
-
-        try:
-            group = h5file['segments']
-        except KeyError:
-            group = dict()
-        for name, dataset in group.iteritems():
-            dqflag = DataQualityFlag.read(dataset, format='hdf')
-            globalv.SEGMENTS += {name: dqflag}
+        if get_archive_version(h5file) == 1:
+            _read_data_archive_v1(h5file)
+        else:
+            _read_data_archive_v2(h5file, lazy=lazy)
+
+
+def _add_archived_timeseries(ts, key):
+    """Add archived data to memory, allowing for overlaps between archives
+    """
+    try:
+        add_timeseries(ts, key=key)
+    except ValueError:
+        if mode.get_mode() == mode.SUMMARY_MODE_DAY:
+            raise
+        warnings.warn('Caught ValueError in combining daily archives')
+        # get end time of data already held
+        overlap = globalv.DATA.search(key, ts.span)
+        if not overlap:
+            raise
+        t = overlap[-1].span[-1]
+        if t < ts.span[-1]:
+            add_timeseries(ts.crop(start=t), key=key)
+
+
+def _get_archived_channel(name, sample_rate):
+    """Format the `Channel` for some archived data
+    """
+    channel = get_channel(name)
+    if re_trend.search(channel.name) and channel.type is None:
+        if sample_rate == 1.0:
+            channel.type = 's-trend'
+        else:
+            channel.type = 'm-trend'
+    return channel
+
+
+def read_series(group, segment=None):
+    """Read data from a v2 archive group.
+
+    Parameters
+    ----------
+    group : `h5py.Group`
+        the archive group for one channel
+    segment : `~gwpy.segments.Segment`, optional
+        GPS ``[start, end)`` span to read, defaults to all data
+
+    Returns
+    -------
+    serieslist : `list`
+        the list of `TimeSeries`, `StateVector`, or `Spectrogram` fragments
+        stored in the group, in the order they were written
+
+    Notes
+    -----
+    Only the requested samples are read from disk.
+    """
+    attrs = dict(group.attrs)
+    dt = float(attrs['dt'])
+    groupname = group.parent.name.strip('/')
+    out = []
+    data = group['data']
+    for start, offset, length in group['fragments'][:]:
+        offset = int(offset)
+        i0, i1 = 0, int(length)
+        if segment is not None:
+            i0 = max(int(round((float(segment[0]) - start) / dt)), i0)
+            i1 = min(int(round((float(segment[1]) - start) / dt)), i1)
+            if i1 <= i0:
+                continue
+        out.append(_build_series(groupname, attrs, start + i0 * dt,
+                                 data[offset+i0:offset+i1]))
+    return out
+
+
+def _build_series(groupname, attrs, start, values):
+    """Build a new `Series` from archived values and metadata
+    """
+    dt = float(attrs['dt'])
+    try:
+        channel = _get_archived_channel(attrs['channel'], 1/dt)
+    except KeyError:
+        channel = None
+    kwargs = dict(epoch=start, name=attrs['name'], channel=channel,
+                  unit=units.Unit(attrs['unit'], parse_strict='silent'))
+    if groupname == 'spectrogram':
+        return Spectrogram(values, dt=dt, f0=attrs['f0'], df=attrs['df'],
+                           **kwargs)
+    elif groupname == 'statevector':
+        series = StateVector(values, sample_rate=1/dt, **kwargs)
+        if hasattr(channel, 'bits'):
+            series.bits = channel.bits
+        return series
+    else:
+        return TimeSeries(values, sample_rate=1/dt, **kwargs)
+
+
+def _archive_loader(filename, path):
+    """Return a method to read data for a segment from an archive group
+    """
+    def load(segment):
+        from h5py import File
+        with File(filename, 'r') as h5file:
+            return read_series(h5file[path], segment=segment)
+    return load
+
+
+def _read_data_archive_v2(h5file, lazy=True):
+    """Read all data from an open v2 archive
+    """
+    filename = os.path.abspath(h5file.filename)
+    for groupname in ['timeseries', 'statevector', 'spectrogram']:
+        if groupname == 'spectrogram':
+            store = globalv.SPECTROGRAMS
+        else:
+            store = globalv.DATA
+        for group in h5file.get(groupname, {}).itervalues():
+            key = group.attrs['key']
+            if lazy:
+                store.add_lazy(key, get_stored_segments(group),
+                               _archive_loader(filename, group.name),
+                               listclass=LIST_CLASSES[groupname],
+                               source=filename)
+            elif groupname == 'spectrogram':
+                for spec in read_series(group):
+                    add_spectrogram(spec, key=key)
+            else:
+                for ts in read_series(group):
+                    _add_archived_timeseries(ts, key)
+
+    for group in h5file.get('segments', {}).itervalues():
+        name = group.attrs['name']
+        dqflag = DataQualityFlag(
+            name, known=SegmentList(map(Segment, group['known'][:])),
+            active=SegmentList(map(Segment, group['active'][:])))
+        globalv.SEGMENTS += {name: dqflag}
+
+
+def read_data_archives(sourcefiles, nproc=1):
+    """Read data from a number of HDF5 archives
+
+    Data in v2 archives are registered lazily, one source per archive,
+    so that each file is only read for the times that are requested,
+    using the metadata stored in that file. Data already held in memory,
+    or registered from an earlier archive in the list, take precedence
+    over archived data for the same times.
+
+    When data for a key are requested, all of the archives holding data
+    for those times are read in parallel, and their fragments are merged
+    with a single copy into one pre-allocated array per contiguous
+    block, see :func:`~gwsumm.datastore.merge_series`.
+
+    Parameters
+    ----------
+    sourcefiles : `list` of `str`
+        paths of source HDF5 files
+    nproc : `int`, optional
+        number of archives to read in parallel for each key
+    """
+    for store in (globalv.DATA, globalv.SPECTROGRAMS):
+        store.lazy_threads = max(nproc or 1, 1)
+    for sourcefile in sourcefiles:
+        read_data_archive(sourcefile, lazy=True)
+
+
+def _read_data_archive_v1(h5file):
+    """Read all data from an open archive in the original (v1) format
+    """
+    # read all time-series data
+    try:
+        group = h5file['timeseries']
+    except KeyError:
+        group = dict()
+    for dataset in group.itervalues():
+        ts = TimeSeries.read(dataset, format='hdf')
+        if (re_trend.search(ts.channel.name) and
+                ts.sample_rate.value == 1.0):
+            ts.channel.type = 's-trend'
+        elif re_trend.search(ts.channel.name):
+            ts.channel.type = 'm-trend'
+        ts.channel = get_channel(ts.channel)
+        _add_archived_timeseries(ts, ts.channel.ndsname)
+
+    # read all state-vector data
+    try:
+        group = h5file['statevector']
+    except KeyError:
+        group = dict()
+    for dataset in group.itervalues():
+        sv = StateVector.read(dataset, format='hdf')
+        sv.channel = get_channel(sv.channel)
+        add_timeseries(sv, key=sv.channel.ndsname)
+
+    # read all spectrogram data
+    try:
+        group = h5file['spectrogram']
+    except KeyError:
+        group = dict()
+    for key, dataset in group.iteritems():
+        key = key.rsplit(',', 1)[0]
+        spec = Spectrogram.read(dataset, format='hdf')
+        spec.channel = get_channel(spec.channel)
+        add_spectrogram(spec, key=key)
+
+    try:
+        group = h5file['segments']
+    except KeyError:
+        group = dict()
+    for name, dataset in group.iteritems():
+        dqflag = DataQualityFlag.read(dataset, format='hdf')
+        globalv.SEGMENTS += {name: dqflag}
+
+
+def get_high_water_mark_file(archivefile):
+    """Return the path of the file recording high-water marks for an archive
+    """
+    return '%s.json' % os.path.splitext(archivefile)[0]
+
+
+def read_high_water_marks(archivefile):
+    """Read the GPS times up to which each tab has been processed.
+
+    Parameters
+    ----------
+    archivefile : `str`
+        path to HDF5 archive whose high-water marks to read
+
+    Returns
+    -------
+    marks : `dict`
+        `dict` of (tab name, GPS time) pairs, empty if no marks have been
+        recorded
+    """
+    try:
+        with open(get_high_water_mark_file(archivefile), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def get_high_water_mark(tab, end=None):
+    """Return the GPS time up to which data for a tab are held in memory.
+
+    The mark is the earliest of the times at which the stored data end,
+    for each of the tab's channels and data-quality flags, and the known
+    segments of each of its states, so that any data not yet available
+    when the tab was processed are requested again on the next run.
+    Channels and flags with no data stored at all are ignored.
+
+    Parameters
+    ----------
+    tab : `~gwsumm.tabs.DataTab`
+        the tab of interest
+    end : `float`, optional
+        the latest possible mark, defaults to the earlier of the current
+        time and the end of the tab
+
+    Returns
+    -------
+    mark : `int`
+        the GPS time up to which data for this tab were stored
+    """
+    if end is None:
+        end = min(globalv.NOW, tab.end)
+    span = SegmentList([Segment(tab.start, end)])
+    coverage = []
+    for channel in tab.get_channels(all_types=True, new=False):
+        for store in (globalv.DATA, globalv.SPECTROGRAMS):
+            if channel.ndsname in store:
+                coverage.append(store.coverage(channel.ndsname, span))
+    for flag in tab.get_flags('segments', new=False):
+        if flag in globalv.SEGMENTS:
+            coverage.append(globalv.SEGMENTS[flag].known & span)
+    for state in tab.states:
+        if state.definition:
+            coverage.append(SegmentList(state.known) & span)
+    mark = end
+    for segments in coverage:
+        if segments:
+            mark = min(mark, segments[-1][1])
+    return int(mark)
+
+
+def write_high_water_marks(archivefile, marks):
+    """Record the GPS times up to which each tab has been processed.
+
+    Parameters
+    ----------
+    archivefile : `str`
+        path to HDF5 archive to which these marks refer
+    marks : `dict`
+        `dict` of (tab name, GPS time) pairs
+    """
+    with open(get_high_water_mark_file(archivefile), 'w') as f:
+        json.dump(marks, f, indent=0, sort_keys=True)
 
 
 def backup_existing_archive(filename, suffix='.hdf',
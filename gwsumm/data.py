@@ -25,8 +25,11 @@ import operator
 import re
 import os
 import urllib2
+from httplib import HTTPException
 from math import (floor, ceil, pi, sqrt)
 from time import sleep
+from threading import (local, Lock)
+from multiprocessing.pool import ThreadPool
 try:
     from configparser import (ConfigParser, NoSectionError, NoOptionError)
 except ImportError:
@@ -66,6 +69,7 @@ from . import (globalv, version)
 from .mode import *
 from .utils import *
 from .channels import get_channel
+from .framecache import get_frame_cache
 
 OPERATOR = {
     '*': operator.mul,
@@ -77,6 +81,12 @@ OPERATOR = {
 __author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
 __version__ = version.version
 
+# pool of datafind server connections, one set per thread
+_DATAFIND_CONNECTIONS = local()
+
+# lock on NDS access, frametype groups may be read in multiple threads
+_NDS_LOCK = Lock()
+
 
 # -----------------------------------------------------------------------------
 # data access
@@ -145,46 +155,104 @@ def find_frames(ifo, frametype, gpsstart, gpsend, config=ConfigParser(),
     if gpsend <= gpsstart:
         return Cache()
 
-    def _query():
-        if cert is not None:
-            dfconn = datafind.GWDataFindHTTPSConnection(
-                host=host, port=port, cert_file=cert, key_file=key)
-        else:
-            dfconn = datafind.GWDataFindHTTPConnection(host=host, port=port)
-        return dfconn.find_frame_urls(ifo[0].upper(), frametype, gpsstart,
-                                      gpsend, urltype=urltype, on_gaps=gaps)
+    def _query(start, end, frametype=frametype):
+        dfconn = get_datafind_connection(host, port, cert, key)
+        try:
+            return dfconn.find_frame_urls(ifo, frametype, start, end,
+                                          urltype=urltype, on_gaps=gaps)
+        # retry once on a new connection
+        except (RuntimeError, HTTPException):
+            sleep(1)
+            dfconn = get_datafind_connection(host, port, cert, key,
+                                             reconnect=True)
+            return dfconn.find_frame_urls(ifo, frametype, start, end,
+                                          urltype=urltype, on_gaps=gaps)
+
+    # use persistent cache of query results if configured
     try:
-        cache = _query()
-    except RuntimeError as e:
-        sleep(1)
+        cachefile = config.get('datafind', 'cache-file')
+    except (NoOptionError, NoSectionError):
+        framecache = None
+    else:
         try:
-            cache = _query()
-        except RuntimeError:
-            if 'Invalid GPS times' in str(e):
-                e.args = ('%s: %d ... %s' % (str(e), gpsstart, gpsend),)
-            if onerror in ['ignore', None]:
-                pass
-            elif onerror in ['warn']:
-                warnings.warn('Caught %s: %s'
-                              % (type(e).__name__, str(e)))
-            else:
-                raise
-            cache = Cache()
+            recent = config.getfloat('datafind', 'cache-recent-window')
+        except (NoOptionError, NoSectionError):
+            recent = 3600
+        framecache = get_frame_cache(cachefile, recent=recent)
+
+    try:
+        if framecache is None:
+            cache, _ = _query(gpsstart, gpsend).checkfilesexist()
+        else:
+            cache = framecache.find(ifo, frametype, urltype, gpsstart, gpsend,
+                                    _query, globalv.NOW)
+    except (RuntimeError, HTTPException) as e:
+        if 'Invalid GPS times' in str(e):
+            e.args = ('%s: %d ... %s' % (str(e), gpsstart, gpsend),)
+        if onerror in ['ignore', None]:
+            pass
+        elif onerror in ['warn']:
+            warnings.warn('Caught %s: %s'
+                          % (type(e).__name__, str(e)))
+        else:
+            raise
+        cache = Cache()
 
     # XXX: if querying for day of LLO frame type change, do both
-    if (ifo[0].upper() == 'L' and frametype in ['C', 'R', 'M', 'T'] and
+    if (ifo == 'L' and frametype in ['C', 'R', 'M', 'T'] and
             gpsstart < LLOCHANGE < gpsend):
         start = len(cache) and cache[-1].segment[1] or gpsstart
         if start < gpsend:
-            cache.extend(dfconn.find_frame_urls(ifo[0].upper(),
-                                                'L1_%s' % frametype, start,
-                                                gpsend, urltype=urltype,
-                                                on_gaps=gaps)[1:])
-    cache, _ = cache.checkfilesexist()
+            llocache, _ = _query(start, gpsend, frametype='L1_%s' % frametype
+                                 ).checkfilesexist()
+            cache.extend(llocache[1:])
     vprint(' %d found.\n' % len(cache))
     return cache
 
 
+def get_datafind_connection(host, port, cert=None, key=None,
+                            reconnect=False):
+    """Return a connection to the given datafind server
+
+    Connections are pooled, with one connection to each server held
+    per thread, and re-used for all queries.
+
+    Parameters
+    ----------
+    host : `str`
+        name of datafind server
+    port : `int`
+        port number on server
+    cert : `str`, optional
+        path to X509 certificate file, for authenticated connections
+    key : `str`, optional
+        path to X509 key file, for authenticated connections
+    reconnect : `bool`, default: `False`
+        open a new connection, replacing any pooled one
+
+    Returns
+    -------
+    connection : :class:`~glue.datafind.GWDataFindHTTPConnection`
+        a connection to the datafind server
+    """
+    try:
+        pool = _DATAFIND_CONNECTIONS.pool
+    except AttributeError:
+        pool = _DATAFIND_CONNECTIONS.pool = {}
+    try:
+        if reconnect:
+            pool.pop((host, port)).close()
+        return pool[(host, port)]
+    except KeyError:
+        if cert is not None:
+            pool[(host, port)] = datafind.GWDataFindHTTPSConnection(
+                host=host, port=port, cert_file=cert, key_file=key)
+        else:
+            pool[(host, port)] = datafind.GWDataFindHTTPConnection(
+                host=host, port=port)
+        return pool[(host, port)]
+
+
 def find_cache_segments(*caches):
     """Construct a :class:`~gwpy.segments.segments.SegmentList` describing
     the validity of a given :class:`~glue.lal.Cache`, or list of them.
@@ -258,10 +326,12 @@ def get_timeseries_dict(channels, segments, config=ConfigParser(),
                         datafind_error='raise', **ioargs):
     """Retrieve the data for a set of channels
     """
-    # separate channels by type
+    # separate channels by type, resolving all channels here, before
+    # any threads are started, so that each thread only reads from
+    # globalv.CHANNELS
     if query:
         if frametype is not None:
-            frametypes = {(None, frametype): channels}
+            frametypes = {(None, frametype): map(get_channel, channels)}
         else:
             frametypes = dict()
             allchannels = set([
@@ -278,12 +348,38 @@ def get_timeseries_dict(channels, segments, config=ConfigParser(),
                     frametypes[id_].append(channel)
                 else:
                     frametypes[id_] = [channel]
-        for ftype, channellist in frametypes.iteritems():
+        # share the worker budget between frametype groups, reading
+        # multiple groups at the same time if possible
+        if multiprocess is True:
+            nproc = count_free_cores()
+        elif multiprocess is False:
+            nproc = 1
+        else:
+            nproc = multiprocess
+        ngroups = max(min(len(frametypes), nproc), 1)
+        groupproc = max(nproc // ngroups, 1)
+        if groupproc == 1 and (ngroups > 1 or multiprocess is False):
+            groupproc = False
+
+        def _read_group(item):
+            ftype, channellist = item
             _get_timeseries_dict(channellist, segments, config=config,
                                  cache=cache, query=query, nds=nds,
-                                 multiprocess=multiprocess, frametype=ftype[1],
+                                 multiprocess=groupproc, frametype=ftype[1],
                                  statevector=statevector, return_=False,
                                  datafind_error=datafind_error, **ioargs)
+
+        if ngroups > 1:
+            vprint("    Reading %d frametype groups in parallel\n"
+                   % len(frametypes))
+            pool = ThreadPool(ngroups)
+            try:
+                pool.map(_read_group, frametypes.items())
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            map(_read_group, frametypes.items())
     if not return_:
         return
     else:
@@ -317,7 +413,7 @@ def get_timeseries_dict(channels, segments, config=ConfigParser(),
                 datasegs = reduce(operator.and_,
                                   [tsl.segments for tsl in tslist])
                 # build meta-timeseries for all interseceted segments
-                meta = type(globalv.DATA[chans[0].ndsname])()
+                meta = type(globalv.DATA.get_loaded(chans[0].ndsname))()
                 operators = [channel.name[m.span()[1]] for m in
                              list(re_channel.finditer(channel.ndsname))[:-1]]
                 for seg in datasegs:
@@ -361,11 +457,9 @@ def _get_timeseries_dict(channels, segments, config=ConfigParser(),
         DictClass = TimeSeriesDict
 
     # read segments from global memory
-    havesegs = reduce(operator.and_,
-                      (globalv.DATA.get(channel.ndsname,
-                                        ListClass()).segments
-                       for channel in channels))
-    new = segments - havesegs
+    new = reduce(operator.or_,
+                 (globalv.DATA.missing(channel.ndsname, segments)
+                  for channel in channels)).coalesce()
 
     # get processes
     if multiprocess is True:
@@ -413,15 +507,16 @@ def _get_timeseries_dict(channels, segments, config=ConfigParser(),
         if nds and config.has_option('nds', 'host'):
             host = config.get('nds', 'host')
             port = config.getint('nds', 'port')
-            try:
-                ndsconnection = nds2.connection(host, port)
-            except RuntimeError as e:
-                if 'SASL authentication' in str(e):
-                    from gwpy.io.nds import kinit
-                    kinit()
+            with _NDS_LOCK:
+                try:
                     ndsconnection = nds2.connection(host, port)
-                else:
-                    raise
+                except RuntimeError as e:
+                    if 'SASL authentication' in str(e):
+                        from gwpy.io.nds import kinit
+                        kinit()
+                        ndsconnection = nds2.connection(host, port)
+                    else:
+                        raise
             frametype = source = 'nds'
             ndstype = channels[0].type
         elif nds:
@@ -469,9 +564,7 @@ def _get_timeseries_dict(channels, segments, config=ConfigParser(),
         qresample = {}
         qdtype = {}
         for channel in channels:
-            oldsegs = globalv.DATA.get(channel.ndsname,
-                                       ListClass()).segments
-            if abs(new - oldsegs) != 0:
+            if abs(globalv.DATA.missing(channel.ndsname, new)) != 0:
                 qchannels.append(channel)
                 if channel in resample:
                     qresample[channel] = resample[channel]
@@ -502,9 +595,10 @@ def _get_timeseries_dict(channels, segments, config=ConfigParser(),
             if abs(segment) < 1:
                 continue
             if nds:
-                tsd = DictClass.fetch(qchannels, segment[0], segment[1],
-                                      connection=ndsconnection, type=ndstype,
-                                      **ioargs)
+                with _NDS_LOCK:
+                    tsd = DictClass.fetch(qchannels, segment[0], segment[1],
+                                          connection=ndsconnection,
+                                          type=ndstype, **ioargs)
             else:
                 # pad resampling
                 if segment[1] == cachesegments[-1][1] and qresample:
@@ -544,15 +638,13 @@ def _get_timeseries_dict(channels, segments, config=ConfigParser(),
                     if c.ndsname in filter_:
                         c.filter = filter_[c.ndsname]
             for (channel, data) in tsd.iteritems():
-                if (channel.ndsname in globalv.DATA and
-                    data.span in globalv.DATA[channel.ndsname].segments):
+                if globalv.DATA.covers(channel.ndsname, data.span):
                     continue
                 if data.unit is None:
                     data.unit = 'undef'
-                for seg in globalv.DATA[channel.ndsname].segments:
-                    if seg.intersects(data.span):
-                        data = data.crop(*(data.span - seg))
-                        break
+                overlap = globalv.DATA.search(channel.ndsname, data.span)
+                if overlap:
+                    data = data.crop(*(data.span - overlap[0].span))
                 try:
                     filt = filter_[channel.ndsname]
                 except KeyError:
@@ -586,11 +678,11 @@ def _get_timeseries_dict(channels, segments, config=ConfigParser(),
                 elif data.unit is None:
                     data._unit = channel.unit
                 # XXX: HACK for failing unit check
-                if len(globalv.DATA[channel.ndsname]):
-                    data._unit = globalv.DATA[channel.ndsname][-1].unit
+                loaded = globalv.DATA.get_loaded(channel.ndsname)
+                if len(loaded):
+                    data._unit = loaded[-1].unit
                 # append and coalesce
-                globalv.DATA[channel.ndsname].append(data)
-                globalv.DATA[channel.ndsname].coalesce()
+                globalv.DATA.append(channel.ndsname, data)
             vprint('.')
         if len(new):
             vprint("\n")
@@ -601,20 +693,11 @@ def _get_timeseries_dict(channels, segments, config=ConfigParser(),
     # return correct data
     out = OrderedDict()
     for channel in channels:
-        data = ListClass()
         if channel.ndsname not in globalv.DATA:
             out[channel.ndsname] = ListClass()
         else:
-            for ts in globalv.DATA[channel.ndsname]:
-                for seg in segments:
-                    if abs(seg) == 0 or abs(seg) < ts.dt.value:
-                        continue
-                    if ts.span.intersects(seg):
-                        common = map(float, ts.span & seg)
-                        cropped = ts.crop(*common, copy=False)
-                        if cropped.size:
-                            data.append(cropped)
-        out[channel.ndsname] = data.coalesce()
+            out[channel.ndsname] = globalv.DATA.crop(channel.ndsname, segments,
+                                                     listclass=ListClass)
     return out
 
 
@@ -708,9 +791,7 @@ def _get_spectrogram(channel, segments, config=ConfigParser(), cache=None,
         method = format
     key = '%s,%s' % (channel.ndsname, method)
     # read segments from global memory
-    havesegs = globalv.SPECTROGRAMS.get(key,
-                                        SpectrogramList()).segments
-    new = segments - havesegs
+    new = globalv.SPECTROGRAMS.missing(key, segments)
 
     # get processes
     if multiprocess is True:
@@ -796,10 +877,9 @@ def _get_spectrogram(channel, segments, config=ConfigParser(), cache=None,
                 specgram = (specgram ** (1/2.)).filter(*filter_, inplace=True) ** 2
             if specgram.unit is None:
                 specgram._unit = channel.unit
-            elif len(globalv.SPECTROGRAMS[key]):
-                specgram._unit = globalv.SPECTROGRAMS[key][-1].unit
-            globalv.SPECTROGRAMS[key].append(specgram)
-            globalv.SPECTROGRAMS[key].coalesce()
+            elif len(globalv.SPECTROGRAMS.get_loaded(key)):
+                specgram._unit = globalv.SPECTROGRAMS.get_loaded(key)[-1].unit
+            globalv.SPECTROGRAMS.append(key, specgram)
             vprint('.')
         if len(timeserieslist):
             vprint('\n')
@@ -809,22 +889,21 @@ def _get_spectrogram(channel, segments, config=ConfigParser(), cache=None,
 
     # return correct data
     out = SpectrogramList()
-    for specgram in globalv.SPECTROGRAMS[key]:
-        for seg in segments:
+    for seg in segments:
+        for specgram in globalv.SPECTROGRAMS.search(key, seg):
             if abs(seg) < specgram.dt.value:
                 continue
-            if specgram.span.intersects(seg):
-                common = specgram.span & type(seg)(seg[0],
-                                                   seg[1] + specgram.dt.value)
-                s = specgram.crop(*common)
-                if format in ['amplitude', 'asd']:
-                    s = s**(1/2.)
-                elif format in ['rayleigh']:
-                    # XXX FIXME: this corrects the bias offset in Rayleigh
-                    med = numpy.median(s.value)
-                    s /= med
-                if s.shape[0]:
-                    out.append(s)
+            common = specgram.span & type(seg)(seg[0],
+                                               seg[1] + specgram.dt.value)
+            s = specgram.crop(*common)
+            if format in ['amplitude', 'asd']:
+                s = s**(1/2.)
+            elif format in ['rayleigh']:
+                # XXX FIXME: this corrects the bias offset in Rayleigh
+                med = numpy.median(s.value)
+                s /= med
+            if s.shape[0]:
+                out.append(s)
     return out.coalesce()
 
 
@@ -887,13 +966,7 @@ def add_timeseries(timeseries, key=None, coalesce=True):
     """
     if key is None:
         key = timeseries.name or timeseries.channel.ndsname
-    if isinstance(timeseries, StateVector):
-        globalv.DATA.setdefault(key, StateVectorList())
-    else:
-        globalv.DATA.setdefault(key, TimeSeriesList())
-    globalv.DATA[key].append(timeseries)
-    if coalesce:
-        globalv.DATA[key].coalesce()
+    globalv.DATA.append(key, timeseries, coalesce=coalesce)
 
 
 def add_spectrogram(specgram, key=None, coalesce=True):
@@ -901,10 +974,7 @@ def add_spectrogram(specgram, key=None, coalesce=True):
     """
     if key is None:
         key = specgram.name or str(specgram.channel)
-    globalv.SPECTROGRAMS.setdefault(key, SpectrogramList())
-    globalv.SPECTROGRAMS[key].append(specgram)
-    if coalesce:
-        globalv.SPECTROGRAMS[key].coalesce()
+    globalv.SPECTROGRAMS.append(key, specgram, coalesce=coalesce)
 
 
 @use_segmentlist
@@ -926,9 +996,8 @@ def get_spectrograms(channels, segments, config=ConfigParser(), cache=None,
         else:
             method_ = method
         keys = ['%s,%s' % (channel.ndsname, method_) for channel in qchannels]
-        havesegs = reduce(operator.and_, (globalv.SPECTROGRAMS.get(
-            key, SpectrogramList()).segments for key in keys))
-        new = segments - havesegs
+        new = reduce(operator.or_, (globalv.SPECTROGRAMS.missing(key, segments)
+                                    for key in keys)).coalesce()
         strides = set([getattr(c, 'stride', 0) for c in qchannels])
         if len(strides) == 1:
             stride = strides.pop()
@@ -962,29 +1031,159 @@ def get_range_channel(channel, **rangekwargs):
     return '%s_%s' % (channel.ndsname, rkey)
 
 
-@use_segmentlist
-def get_range(channel, segments, config=ConfigParser(), cache=None,
-              query=True, nds='guess', return_=True, multiprocess=True,
-              datafind_error='raise', frametype=None,
-              stride=None, fftlength=None, overlap=None,
-              method=None, **rangekwargs):
-    """Calculate the sensitive distance for a given strain channel
+# cache of frequency-domain weights for range integrals
+_RANGE_WEIGHTS = {}
+
+
+def get_range_weights(f0, df, size, **rangekwargs):
+    """Return the weights with which to integrate a PSD to get range
+
+    The sensitive distance is calculated as an integral over frequency
+    of a weighting function multiplied by a power of the PSD; the
+    weights, including the trapezoid-rule coefficients and any
+    normalisation, depend only on the frequency axis and the source
+    parameters, so are calculated once and cached.
+
+    Parameters
+    ----------
+    f0 : `float`
+        lowest frequency of PSD
+    df : `float`
+        frequency spacing of PSD
+    size : `int`
+        number of frequency bins in PSD
+    **rangekwargs
+        source parameters, as for :func:`get_range`
+
+    Returns
+    -------
+    index : `numpy.ndarray`
+        indices of the frequency bins that contribute to the integral
+    weights : `numpy.ndarray`
+        the integration weight for each of those bins
     """
     if not rangekwargs:
         rangekwargs = {'mass1': 1.4, 'mass2': 1.4}
-    rangetype = 'energy' in rangekwargs and 'burst' or 'inspiral'
-    if rangetype == 'burst':
-        range_func = astro.burst_range
+    key = (float(f0), float(df), int(size),
+           tuple(sorted(rangekwargs.items())))
+    try:
+        return _RANGE_WEIGHTS[key]
+    except KeyError:
+        pass
+    freqs = f0 + df * numpy.arange(size)
+    unitpsd = Spectrum(numpy.ones(size), f0=f0, df=df)
+    # calculate range integrand for a unit PSD
+    if 'energy' in rangekwargs:
+        fmin = rangekwargs.get('fmin', 100) or freqs.min()
+        fmax = rangekwargs.get('fmax', 500) or freqs.max()
+        mask = (freqs >= fmin) & (freqs < fmax)
+        spec = astro.burst_range_spectrum(
+            unitpsd, snr=rangekwargs.get('snr', 8),
+            energy=rangekwargs['energy']).value ** 3
+        norm = 1 / (fmax - fmin)
     else:
-        range_func = astro.inspiral_range
+        kwargs = dict((k, rangekwargs[k]) for
+                      k in ['snr', 'mass1', 'mass2', 'horizon'] if
+                      k in rangekwargs)
+        # integrand is only returned below the ISCO frequency
+        isco = astro.inspiral_range_psd(unitpsd, **kwargs).value
+        spec = numpy.zeros(size)
+        spec[:isco.size] = isco
+        fmin = rangekwargs.get('fmin', 0)
+        mask = freqs >= fmin
+        mask[isco.size:] = False
+        if rangekwargs.get('fmax', None):
+            mask &= freqs < rangekwargs['fmax']
+        if fmin == 0 and mask.any() and freqs[mask.argmax()] == 0:
+            spec[mask.argmax()] = 0
+        norm = 1.
+    # combine with trapezoid rule coefficients
+    x = freqs[mask]
+    coeffs = numpy.zeros(x.size)
+    if x.size > 1:
+        dx = numpy.diff(x) / 2.
+        coeffs[:-1] += dx
+        coeffs[1:] += dx
+    weights = spec[mask] * coeffs * norm
+    index = numpy.nonzero(mask)[0]
+    keep = weights != 0
+    _RANGE_WEIGHTS[key] = (index[keep], weights[keep])
+    return _RANGE_WEIGHTS[key]
+
+
+def get_spectrogram_ranges(specgram, rangekwargs):
+    """Calculate the sensitive distance for each PSD in a spectrogram
+
+    All sources of the same type are calculated together, as a single
+    matrix product of the (inverse) PSDs with the integration weights.
+
+    Parameters
+    ----------
+    specgram : `~gwpy.spectrogram.Spectrogram`
+        the PSD spectrogram
+    rangekwargs : `list` of `dict`
+        the source parameters for each range to calculate, as for
+        :func:`get_range`
+
+    Returns
+    -------
+    ranges : `list` of `numpy.ndarray`
+        the range (Mpc) at each time, for each set of source parameters
+    """
+    psd = numpy.asarray(specgram.value, dtype=float)
+    f0 = float(specgram.f0.value)
+    df = float(specgram.df.value)
+    groups = {}
+    for i, kwargs in enumerate(rangekwargs):
+        groups.setdefault('energy' in kwargs, []).append(
+            (i, get_range_weights(f0, df, psd.shape[1], **kwargs)))
+    out = [None] * len(rangekwargs)
+    for burst, items in groups.iteritems():
+        index = numpy.unique(numpy.concatenate(
+            [idx for (_, (idx, _)) in items]))
+        matrix = numpy.zeros((index.size, len(items)))
+        for j, (_, (idx, weights)) in enumerate(items):
+            matrix[index.searchsorted(idx), j] = weights
+        if burst:
+            result = numpy.dot(psd[:, index] ** -1.5, matrix) ** (1/3.)
+        else:
+            result = numpy.dot(1 / psd[:, index], matrix) ** (1/2.)
+        for j, (i, _) in enumerate(items):
+            out[i] = result[:, j]
+    return out
+
+
+@use_segmentlist
+def get_ranges(channel, segments, rangekwargs=None, config=ConfigParser(),
+               cache=None, query=True, nds='guess', return_=True,
+               multiprocess=True, datafind_error='raise', frametype=None,
+               stride=None, fftlength=None, overlap=None, method=None):
+    """Calculate the sensitive distance for a number of sources
+
+    The PSD spectrogram for the channel is read once, and the range for
+    each set of source parameters is calculated from it in one pass.
+
+    Parameters
+    ----------
+    rangekwargs : `list` of `dict`, optional
+        the source parameters for each range, as for :func:`get_range`,
+        defaults to a single 1.4-1.4 solar mass inspiral
+
+    Returns
+    -------
+    ranges : `OrderedDict`
+        a (key, `~gwpy.timeseries.TimeSeriesList`) pair for each set of
+        source parameters, if ``return_=True``
+    """
+    if not rangekwargs:
+        rangekwargs = [{'mass1': 1.4, 'mass2': 1.4}]
     channel = get_channel(channel)
-    key = get_range_channel(channel, **rangekwargs)
+    keys = [get_range_channel(channel, **kwargs) for kwargs in rangekwargs]
     # get old segments
-    havesegs = globalv.DATA.get(key, TimeSeriesList()).segments
-    new = segments - havesegs
+    new = reduce(operator.or_, (globalv.DATA.missing(key, segments) for
+                                key in keys)).coalesce()
     query &= abs(new) != 0
     # calculate new range
-    out = TimeSeriesList()
     if query:
         # get spectrograms
         spectrograms = get_spectrogram(channel, new, config=config,
@@ -993,15 +1192,254 @@ def get_range(channel, segments, config=ConfigParser(), cache=None,
                                        datafind_error=datafind_error, nds=nds,
                                        stride=stride, fftlength=fftlength,
                                        overlap=overlap, method=method)
-        # calculate range for each PSD in each spectrogram
+        # calculate all ranges for all PSDs in each spectrogram
         for sg in spectrograms:
-            ts = TimeSeries(numpy.zeros(sg.shape[0],), unit='Mpc',
-                            epoch=sg.epoch, dx=sg.dx, channel=key)
-            for i in range(sg.shape[0]):
-                psd = sg[i]
-                psd = Spectrum(psd.value, f0=psd.x0, df=psd.dx)
-                ts[i] = range_func(psd, **rangekwargs)
-            add_timeseries(ts, key=key)
+            ranges = get_spectrogram_ranges(sg, rangekwargs)
+            for key, values in zip(keys, ranges):
+                ts = TimeSeries(values, unit='Mpc', epoch=sg.epoch, dx=sg.dx,
+                                channel=key)
+                missing = globalv.DATA.missing(key, [ts.span])
+                if abs(missing) == abs(ts.span):
+                    add_timeseries(ts, key=key)
+                    continue
+                for seg in missing:
+                    add_timeseries(ts.crop(*map(float, seg)), key=key)
+
+    if return_:
+        return OrderedDict((key, get_timeseries(key, segments, query=False))
+                           for key in keys)
+
 
+@use_segmentlist
+def get_range(channel, segments, config=ConfigParser(), cache=None,
+              query=True, nds='guess', return_=True, multiprocess=True,
+              datafind_error='raise', frametype=None,
+              stride=None, fftlength=None, overlap=None,
+              method=None, **rangekwargs):
+    """Calculate the sensitive distance for a given strain channel
+    """
+    if not rangekwargs:
+        rangekwargs = {'mass1': 1.4, 'mass2': 1.4}
+    out = get_ranges(channel, segments, rangekwargs=[rangekwargs],
+                     config=config, cache=cache, query=query, nds=nds,
+                     return_=return_, multiprocess=multiprocess,
+                     datafind_error=datafind_error, frametype=frametype,
+                     stride=stride, fftlength=fftlength, overlap=overlap,
+                     method=method)
     if return_:
-        return get_timeseries(key, segments, query=False)
+        return out.values()[0]
+
+
+# -----------------------------------------------------------------------------
+# multi-resolution trends
+
+PYRAMID_LEVELS = [60, 600, 3600]
+PYRAMID_STATISTICS = OrderedDict([
+    ('min', numpy.min),
+    ('mean', numpy.mean),
+    ('max', numpy.max),
+])
+re_pyramid = re.compile(',(%s),(\d+)s\Z' % '|'.join(PYRAMID_STATISTICS))
+
+
+def get_pyramid_key(key, statistic, level):
+    """Return the data key for a trend of the given data key
+    """
+    return '%s,%s,%ds' % (key, statistic, level)
+
+
+def get_pyramid_statistic(channel):
+    """Return the trend statistic best representing the given channel
+
+    Returns `None` for a channel that is not itself a trend, which is
+    best represented by the envelope of its min and max trends.
+    """
+    name = get_channel(channel).name
+    for stat in ['min', 'mean', 'max']:
+        if name.endswith('.%s' % stat):
+            return stat
+    if name.endswith('.rms'):
+        return 'mean'
+    return None
+
+
+def _interleave_trends(min_, max_):
+    """Combine min and max trends into one envelope `TimeSeries`
+
+    The output holds the min and max of each bin in turn, at twice
+    the sample rate of the trends.
+    """
+    values = numpy.empty(min_.size * 2, dtype=float)
+    values[0::2] = min_.value
+    values[1::2] = max_.value
+    return TimeSeries(values, epoch=min_.x0.value,
+                      sample_rate=2 * min_.sample_rate.value, unit=min_.unit,
+                      name=min_.name, channel=min_.channel)
+
+
+def decimate_timeseries(timeseries, level):
+    """Calculate trends of a `TimeSeries` over fixed bins
+
+    Only those bins, aligned to multiples of ``level`` in GPS time, that
+    are fully covered by the input data are returned.
+
+    Parameters
+    ----------
+    timeseries : `~gwpy.timeseries.TimeSeries`
+        input data
+    level : `int`
+        length (seconds) of each bin
+
+    Returns
+    -------
+    trends : `dict`
+        a (`str`, `~gwpy.timeseries.TimeSeries`) pair for each of the
+        ``PYRAMID_STATISTICS``, or an empty `dict` if no bins are complete
+    """
+    dt = timeseries.dt.value
+    nsamp = int(round(level / dt))
+    if nsamp < 2 or abs(nsamp * dt - level) > dt * 1e-6:
+        return {}
+    x0 = float(timeseries.span[0])
+    first = ceil(x0 / level) * level
+    i0 = int(round((first - x0) / dt))
+    nbins = (timeseries.size - i0) // nsamp
+    if nbins < 1:
+        return {}
+    values = timeseries.value[i0:i0 + nbins * nsamp].reshape(nbins, nsamp)
+    out = {}
+    for stat, func in PYRAMID_STATISTICS.iteritems():
+        out[stat] = TimeSeries(func(values, axis=1), epoch=first,
+                               sample_rate=1/level, unit=timeseries.unit,
+                               name=timeseries.name,
+                               channel=timeseries.channel)
+    return out
+
+
+def add_pyramids(keys=None, levels=PYRAMID_LEVELS):
+    """Calculate min/mean/max trends for time-series data held in memory
+
+    Trends are only calculated for those complete bins not already
+    covered, so this method can be run repeatedly as new data arrive.
+
+    Parameters
+    ----------
+    keys : `list` of `str`, optional
+        data keys to trend, defaults to all `TimeSeries` data
+    levels : `list` of `int`, optional
+        bin lengths (seconds) at which to trend the data
+    """
+    if keys is None:
+        keys = globalv.DATA.keys()
+    for key in keys:
+        if (re_pyramid.search(str(key)) or
+                type(globalv.DATA.get_loaded(key)) is not TimeSeriesList):
+            continue
+        segs = globalv.DATA.segments(key)
+        for level in levels:
+            todo = SegmentList()
+            for seg in segs:
+                start = ceil(float(seg[0]) / level) * level
+                end = floor(float(seg[1]) / level) * level
+                if end > start:
+                    todo.append(Segment(start, end))
+            todo -= globalv.DATA.segments(get_pyramid_key(key, 'mean', level))
+            for ts in globalv.DATA.crop(key, todo):
+                for stat, trend in decimate_timeseries(ts, level).iteritems():
+                    add_timeseries(trend,
+                                   key=get_pyramid_key(key, stat, level))
+
+
+def find_pyramid_keys(channel, segments, resolution, levels=PYRAMID_LEVELS):
+    """Find the keys of the trend data best representing a channel
+
+    Parameters
+    ----------
+    channel : `str`, `~gwpy.detector.Channel`
+        channel of interest
+    segments : `~gwpy.segments.SegmentList`
+        segments of interest
+    resolution : `float`
+        the required time resolution (seconds), only levels finer than
+        this are considered
+    levels : `list` of `int`, optional
+        bin lengths (seconds) of available trends
+
+    Returns
+    -------
+    keys : `list` of `str`, `None`
+        the data key of the trend at the coarsest adequate level, or the
+        keys of the min and max trends for channels that are not trends
+        themselves, or `None` if no trend at an adequate resolution
+        covers the given segments
+    """
+    channel = get_channel(channel)
+    stat = get_pyramid_statistic(channel)
+    segments = SegmentList(segments).coalesce()
+    if not segments:
+        return None
+    for level in sorted(levels, reverse=True):
+        if level >= resolution:
+            continue
+        key = get_pyramid_key(channel.ndsname, stat or 'min', level)
+        if key not in globalv.DATA:
+            continue
+        # allow for incomplete bins at the edges of each contiguous run
+        # of trend data, but not at the edges of every segment, so that a
+        # state of many short segments falls back to finer data
+        runs = globalv.DATA.coverage(key, [segments.extent()])
+        allowed = 2 * level * max(len(runs), 1)
+        missing = abs(globalv.DATA.missing(key, segments))
+        if not (missing < abs(segments) and missing <= allowed):
+            continue
+        if stat is not None:
+            return [key]
+        # draw raw channels as the envelope of their min and max trends
+        maxkey = get_pyramid_key(channel.ndsname, 'max', level)
+        if (globalv.DATA.coverage(key, segments) !=
+                globalv.DATA.coverage(maxkey, segments)):
+            continue
+        return [key, maxkey]
+
+
+def get_timeseries_pyramid(channel, segments, resolution,
+                           levels=PYRAMID_LEVELS):
+    """Return trend data for a channel at the coarsest adequate level
+
+    Parameters
+    ----------
+    channel : `str`, `~gwpy.detector.Channel`
+        channel of interest
+    segments : `~gwpy.segments.SegmentList`
+        segments of interest
+    resolution : `float`
+        the required time resolution (seconds), only levels finer than
+        this are considered
+    levels : `list` of `int`, optional
+        bin lengths (seconds) of available trends
+
+    Returns
+    -------
+    data : `~gwpy.timeseries.TimeSeriesList`, `None`
+        the trend data for the given segments, or `None` if no
+        trend at an adequate resolution covers those segments; for
+        channels that are not trends themselves, each `TimeSeries` holds
+        the min and max trends of each bin in turn, so that no extremes
+        of the data are lost
+
+    See Also
+    --------
+    find_pyramid_keys
+        for details of how the trend level is chosen
+    """
+    keys = find_pyramid_keys(channel, segments, resolution, levels=levels)
+    if keys is None:
+        return None
+    data = [globalv.DATA.crop(key, segments, listclass=TimeSeriesList) for
+            key in keys]
+    if len(data) == 1:
+        return data[0]
+    out = TimeSeriesList()
+    out.extend(_interleave_trends(min_, max_) for
+               (min_, max_) in zip(*data))
+    return out
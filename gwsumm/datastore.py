@@ -0,0 +1,966 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Duncan Macleod (2013)
+#
+# This file is part of GWSumm.
+#
+# GWSumm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GWSumm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GWSumm.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Interval-indexed in-memory storage for time-domain data
+"""
+
+import os
+import re
+import atexit
+import hashlib
+import shutil
+import tempfile
+import threading
+from functools import wraps
+from multiprocessing.pool import ThreadPool
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import numpy
+
+from gwpy.segments import (Segment, SegmentList)
+try:
+    from gwpy.timeseries import (StateVector, TimeSeriesList,
+                                 StateVectorList)
+except ImportError:
+    from gwpy.timeseries import (StateVector, TimeSeriesList)
+    StateVectorList = TimeSeriesList
+from gwpy.spectrogram import (Spectrogram, SpectrogramList)
+
+from . import version
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+__version__ = version.version
+
+re_memory_size = re.compile('\A\s*(?P<value>[0-9.]+)\s*'
+                            '(?P<unit>[KMGT]?)(?:i?B)?\s*\Z', re.I)
+MEMORY_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3,
+                'T': 1024 ** 4}
+
+# lock shared by all stores, data may be read in multiple threads
+_LOCK = threading.RLock()
+
+# directory holding data shared with other processes
+_SHAREDIR = None
+
+
+def synchronized(func):
+    """Decorate a method to hold the data-store lock while it runs
+    """
+    @wraps(func)
+    def locked(*args, **kwargs):
+        with _LOCK:
+            return func(*args, **kwargs)
+    return locked
+
+
+def parse_memory_size(size):
+    """Parse a human-readable memory size into a number of bytes
+
+    Parameters
+    ----------
+    size : `str`, `int`
+        memory size, e.g. ``'16G'``, ``'512MB'``, or a number of bytes
+
+    Returns
+    -------
+    nbytes : `int`
+        the number of bytes represented by ``size``
+    """
+    if isinstance(size, (int, long, float)):
+        return int(size)
+    match = re_memory_size.match(size)
+    if match is None:
+        raise ValueError("Cannot parse memory size %r" % size)
+    return int(float(match.group('value')) *
+               MEMORY_UNITS[match.group('unit').upper()])
+
+
+def _sizeof(value):
+    """Return the number of bytes held by arrays in a store value
+    """
+    if isinstance(value, list):
+        return sum(getattr(v, 'nbytes', 0) for v in value)
+    return getattr(value, 'nbytes', 0)
+
+
+class SpilledData(object):
+    """Placeholder for a `DataStore` value that has been written to disk
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            value = pickle.load(f)
+        self.remove()
+        return value
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class SharedSeries(object):
+    """Descriptor of a `Series` whose data are held in a shared file
+
+    The data array is copied once into a memory-mapped file (in
+    ``/dev/shm`` where available), so that the `Series` can be sent to
+    another process by pickling only this descriptor. The receiving
+    process calls :meth:`SharedSeries.load` to map the file, sharing
+    the same pages of memory as every other process using the data.
+
+    The file is removed when the descriptor held by the process that
+    created it is deleted; any process still mapping the file keeps
+    its data until the mapping is released.
+
+    Parameters
+    ----------
+    series : `~gwpy.data.Series`
+        the data to share
+    directory : `str`, optional
+        directory in which to write the file, see
+        :func:`get_share_directory`
+    """
+    def __init__(self, series, directory=None):
+        if directory is None:
+            directory = get_share_directory()
+        fd, self.path = tempfile.mkstemp(suffix='.dat', dir=directory)
+        os.close(fd)
+        self.seriesclass = type(series)
+        self.dtype = series.dtype.str
+        self.shape = series.shape
+        self.metadata = dict(series.__dict__)
+        buffer_ = numpy.memmap(self.path, dtype=self.dtype, mode='w+',
+                               shape=self.shape)
+        buffer_[...] = series.view(numpy.ndarray)
+        buffer_.flush()
+        del buffer_
+        self._owner = True
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_owner', None)
+        return state
+
+    def load(self, mode='c'):
+        """Return a `Series` viewing the shared data
+
+        Parameters
+        ----------
+        mode : `str`, optional
+            mode with which to map the file, see `numpy.memmap`; by
+            default the data are mapped copy-on-write, so that modifying
+            the returned `Series` does not affect the shared array
+        """
+        data = numpy.memmap(self.path, dtype=self.dtype, mode=mode,
+                            shape=self.shape)
+        series = data.view(self.seriesclass)
+        series.__dict__.update(self.metadata)
+        return series
+
+    def __del__(self):
+        if getattr(self, '_owner', False):
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def get_share_directory():
+    """Return the directory in which to write shared data files
+
+    A new directory is created in ``/dev/shm``, if available, otherwise
+    in the system temporary directory, and is removed at exit.
+    """
+    global _SHAREDIR
+    if _SHAREDIR is None:
+        if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+            base = '/dev/shm'
+        else:
+            base = None
+        _SHAREDIR = tempfile.mkdtemp(prefix='gwsumm-shared-', dir=base)
+        atexit.register(shutil.rmtree, _SHAREDIR, True)
+    return _SHAREDIR
+
+
+def merge_series(serieslist):
+    """Merge `Series` fragments into contiguous blocks
+
+    The fragments in each contiguous run (with matching type, sample
+    spacing, unit, and row shape) are copied once into a new array of
+    the full size of the run, rather than being appended one after the
+    other. Samples overlapping an earlier fragment are dropped.
+
+    Parameters
+    ----------
+    serieslist : `list` of `~gwpy.data.Series`
+        the fragments to merge, in any order
+
+    Returns
+    -------
+    merged : `list` of `~gwpy.data.Series`
+        one `Series` per contiguous run, in time order
+    """
+    runs = []
+    end = None
+    for series in sorted(serieslist, key=lambda s: float(s.span[0])):
+        dt = float(series.dt.value)
+        start = float(series.span[0])
+        if runs:
+            first = runs[-1][0]
+            match = (type(series) is type(first) and
+                     float(first.dt.value) == dt and
+                     series.unit == first.unit and
+                     series.shape[1:] == first.shape[1:])
+        else:
+            match = False
+        if match and start < end - dt / 2.:
+            skip = int(round((end - start) / dt))
+            if skip >= series.shape[0]:
+                continue
+            series = series[skip:]
+            start = end
+        if not match or abs(start - end) >= dt / 2.:
+            runs.append([])
+        runs[-1].append(series)
+        end = start + series.shape[0] * dt
+    out = []
+    for run in runs:
+        if len(run) == 1:
+            out.append(run[0])
+            continue
+        first = run[0]
+        values = numpy.empty((sum(s.shape[0] for s in run),) +
+                             first.shape[1:], dtype=first.dtype)
+        i = 0
+        for series in run:
+            values[i:i+series.shape[0]] = series.view(numpy.ndarray)
+            i += series.shape[0]
+        merged = values.view(type(first))
+        merged.__dict__.update(first.__dict__)
+        # drop the cached index of the first fragment
+        merged.__dict__.pop('_xindex', None)
+        out.append(merged)
+    return out
+
+
+class LazySource(object):
+    """Record of data for a `DataStore` key that have not yet been read
+
+    Parameters
+    ----------
+    segments : `~gwpy.segments.SegmentList`
+        GPS segments for which data can be read from this source
+    loader : `callable`
+        method to read data, taking a single `~gwpy.segments.Segment`
+        and returning a `list` of `Series`
+    source : `str`, optional
+        name of this source, e.g. a file path
+    """
+    def __init__(self, segments, loader, source=None):
+        self.segments = segments
+        self.loader = loader
+        self.source = source
+
+
+class MemoryManager(object):
+    """Memory budget shared between a set of `DataStore` objects
+
+    When the total size of data held in memory by the registered stores
+    exceeds the ``limit``, the least-recently-used arrays are removed,
+    starting with those that no remaining consumer has declared a need for.
+    Arrays that are still needed are spilled to disk and reloaded
+    transparently the next time they are accessed.
+
+    Parameters
+    ----------
+    limit : `int`, optional
+        memory limit (bytes), default: no limit
+    directory : `str`, optional
+        directory in which to spill data, defaults to the system
+        temporary directory
+    discard : `bool`, default: `True`
+        remove unneeded data entirely, rather than spilling to disk, set
+        this to `False` if all data are required at the end of the process
+    """
+    def __init__(self, limit=None, directory=None, discard=True):
+        self.limit = limit
+        self.directory = directory
+        self.discard = discard
+        self.stores = []
+        self.references = {}
+        self._tick = 0
+        self._spilldir = None
+
+    def register(self, store):
+        """Include a `DataStore` in this memory budget
+        """
+        self.stores.append(store)
+
+    @synchronized
+    def require(self, names):
+        """Record that the given channels will be needed later
+        """
+        for name in names:
+            name = str(name)
+            self.references[name] = self.references.get(name, 0) + 1
+
+    @synchronized
+    def release(self, names):
+        """Record that the given channels are no longer needed by a consumer
+        """
+        for name in names:
+            name = str(name)
+            if self.references.get(name, 0) > 0:
+                self.references[name] -= 1
+        self.trim()
+
+    def touch(self, store, key):
+        self._tick += 1
+        store._access[key] = self._tick
+
+    def is_needed(self, key):
+        """Returns `True` if the data for this key might be needed later
+
+        Data whose channel has never been registered via
+        :meth:`MemoryManager.require` are always considered needed.
+        """
+        root = str(key).split(',', 1)[0]
+        registered = False
+        for name, count in self.references.iteritems():
+            if root == name or root.startswith('%s_' % name):
+                if count > 0:
+                    return True
+                registered = True
+        return not registered
+
+    @property
+    def nbytes(self):
+        """Total number of bytes held in memory by all registered stores
+        """
+        return sum(store.nbytes for store in self.stores)
+
+    def get_spill_directory(self):
+        if self._spilldir is None:
+            self._spilldir = tempfile.mkdtemp(prefix='gwsumm-spill-',
+                                              dir=self.directory)
+            atexit.register(shutil.rmtree, self._spilldir, True)
+        return self._spilldir
+
+    @synchronized
+    def trim(self):
+        """Evict or spill least-recently-used data until within the limit
+        """
+        if self.limit is None:
+            return
+        total = self.nbytes
+        if total <= self.limit:
+            return
+        candidates = []
+        for store in self.stores:
+            for key in store.loaded_keys():
+                candidates.append((self.is_needed(key),
+                                   store._access.get(key, 0), store, key))
+        candidates.sort(key=lambda x: x[1])
+        # never remove the most recently used array
+        candidates = candidates[:-1]
+        candidates.sort(key=lambda x: x[0])
+        for needed, _, store, key in candidates:
+            if total <= self.limit:
+                break
+            total -= store._nbytes.get(key, 0)
+            if needed or not self.discard:
+                store.spill(key, self.get_spill_directory())
+            else:
+                store.evict(key)
+
+
+class DataStore(dict):
+    """`dict` of data fragments with a sorted interval index per key
+
+    Each value is a list of `Series` fragments (e.g. a
+    `~gwpy.timeseries.TimeSeriesList`) kept sorted by start time. A
+    parallel index of fragment boundaries is held for each key, so that
+    coverage, missing-segment and overlap queries are answered by binary
+    search, rather than by walking every fragment in the list.
+
+    Values should be added using :meth:`DataStore.append`; lists
+    modified directly are re-indexed the next time they are queried.
+
+    Data may also be registered without reading them, using
+    :meth:`DataStore.add_lazy`; those data count towards the coverage
+    of a key, but are only read when a query asks for the data themselves.
+
+    If a `MemoryManager` is given, the store reports its memory usage to
+    that manager, which may spill values to disk or remove them entirely;
+    spilled values are reloaded when next accessed.
+    """
+    # minimum size (bytes) of data to share via files, see share()
+    share_threshold = 1024 ** 2
+    # number of threads with which to read lazy sources for one key
+    lazy_threads = 1
+
+    def __init__(self, *args, **kwargs):
+        self.memory = kwargs.pop('memory', None)
+        super(DataStore, self).__init__(*args, **kwargs)
+        self._index = {}
+        self._nbytes = {}
+        self._dirty = set(self.keys())
+        self._access = {}
+        self._lazy = {}
+        self._shared = {}
+        self._checksums = {}
+        if self.memory is not None:
+            self.memory.register(self)
+
+    # -------------------------------------------------------------------------
+    # dict overrides
+
+    @synchronized
+    def __getitem__(self, key):
+        self._resolve(key)
+        value = self._load(key)
+        # the caller may modify the value in place
+        self._dirty.add(key)
+        return value
+
+    @synchronized
+    def __setitem__(self, key, value):
+        self._discard(key)
+        super(DataStore, self).__setitem__(key, value)
+        self._updated(key)
+
+    @synchronized
+    def __delitem__(self, key):
+        self._discard(key)
+        super(DataStore, self).__delitem__(key)
+
+    @synchronized
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    @synchronized
+    def setdefault(self, key, default=None):
+        # return the held list without reading any lazy sources
+        if dict.__contains__(self, key):
+            value = self._load(key)
+            # the caller may modify the value in place
+            self._dirty.add(key)
+            return value
+        self[key] = default
+        return default
+
+    @synchronized
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return super(DataStore, self).pop(key, *default)
+
+    @synchronized
+    def clear(self):
+        for key in self.keys():
+            self._discard(key)
+        super(DataStore, self).clear()
+
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def itervalues(self):
+        for key in self.keys():
+            yield self[key]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
+
+    # -------------------------------------------------------------------------
+    # memory management
+
+    @property
+    @synchronized
+    def nbytes(self):
+        """Number of bytes held in memory by this store
+        """
+        for key in self._dirty:
+            value = dict.get(self, key)
+            if not isinstance(value, SpilledData):
+                self._nbytes[key] = _sizeof(value)
+        self._dirty.clear()
+        return sum(self._nbytes.values())
+
+    def loaded_keys(self):
+        """Return the list of keys whose data are held in memory
+        """
+        return [key for key, value in dict.iteritems(self) if
+                not isinstance(value, SpilledData)]
+
+    def _load(self, key):
+        """Return the value for a key, reloading it from disk if needed
+        """
+        value = dict.__getitem__(self, key)
+        if self.memory is not None:
+            self.memory.touch(self, key)
+        if isinstance(value, SpilledData):
+            value = value.load()
+            dict.__setitem__(self, key, value)
+            self._updated(key)
+        return value
+
+    @synchronized
+    def get_loaded(self, key):
+        """Return the data for a key without reading any lazy sources
+        """
+        return self._load(key)
+
+    def _updated(self, key):
+        self._dirty.add(key)
+        self._shared.pop(key, None)
+        self._checksums.pop(key, None)
+        if self.memory is not None:
+            self.memory.touch(self, key)
+            self.memory.trim()
+
+    def _discard(self, key):
+        value = dict.get(self, key)
+        if isinstance(value, SpilledData):
+            value.remove()
+        self._index.pop(key, None)
+        self._lazy.pop(key, None)
+        self._nbytes.pop(key, None)
+        self._dirty.discard(key)
+        self._access.pop(key, None)
+        self._shared.pop(key, None)
+        self._checksums.pop(key, None)
+
+    @synchronized
+    def spill(self, key, directory):
+        """Write the data for a key to disk, and release it from memory
+        """
+        value = dict.__getitem__(self, key)
+        if isinstance(value, SpilledData):
+            return
+        if isinstance(value, list):  # make sure the index is current
+            self._get_index(key)
+        fd, path = tempfile.mkstemp(suffix='.pickle', dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        dict.__setitem__(self, key, SpilledData(path))
+        self._nbytes[key] = 0
+        self._dirty.discard(key)
+        self._shared.pop(key, None)
+
+    def evict(self, key):
+        """Remove the data for a key from the store entirely
+        """
+        del self[key]
+
+    # -------------------------------------------------------------------------
+    # lazy loading
+
+    @synchronized
+    def add_lazy(self, key, segments, loader, listclass=TimeSeriesList,
+                 source=None):
+        """Register data for a key to be read only when first requested
+
+        Segments already covered for the given key are ignored.
+
+        Parameters
+        ----------
+        key : `str`
+            name under which to store the data
+        segments : `~gwpy.segments.SegmentList`
+            GPS segments for which data are available
+        loader : `callable`
+            method to read data, taking a single `~gwpy.segments.Segment`
+            and returning a `list` of `Series`
+        listclass : `type`, optional
+            type of list in which to store the data when read
+        source : `str`, optional
+            name of the data source, e.g. a file path
+        """
+        if not dict.__contains__(self, key):
+            self[key] = listclass()
+        segments = SegmentList(segments).coalesce() - self.segments(key)
+        if abs(segments):
+            self._lazy.setdefault(key, []).append(
+                LazySource(segments, loader, source=source))
+
+    @synchronized
+    def resolve(self, key, segments=None, exclude=None):
+        """Read lazily-registered data for a key into memory
+
+        Parameters
+        ----------
+        key : `str`
+            name of data set to read
+        segments : `~gwpy.segments.SegmentList`, optional
+            segments for which to read data, defaults to all data
+        exclude : `str`, optional
+            name of a source to leave unread
+        """
+        self._resolve(key, segments=segments, exclude=exclude)
+
+    def _resolve(self, key, segments=None, exclude=None):
+        # pop the sources while reading, so that appending the new data
+        # doesn't recurse into reading them again
+        sources = self._lazy.pop(key, [])
+        if not sources:
+            return
+        if segments is not None:
+            segments = SegmentList(segments).coalesce()
+        try:
+            requests = []
+            for src in sources:
+                if exclude is not None and src.source == exclude:
+                    continue
+                if segments is None:
+                    todo = src.segments
+                else:
+                    todo = src.segments & segments
+                src.segments = src.segments - todo
+                requests.extend((src.loader, seg) for seg in todo)
+            for series in merge_series(self._read_lazy(requests)):
+                self.append(key, series)
+        finally:
+            remaining = [src for src in sources if abs(src.segments)]
+            if remaining and dict.__contains__(self, key):
+                self._lazy.setdefault(key, []).extend(remaining)
+
+    def _read_lazy(self, requests):
+        """Read data for a list of ``(loader, segment)`` requests
+
+        The requests are read in up to :attr:`DataStore.lazy_threads`
+        parallel threads.
+        """
+        def _read(request):
+            loader, segment = request
+            return loader(segment)
+
+        nthreads = min(self.lazy_threads, len(requests))
+        if nthreads > 1:
+            pool = ThreadPool(nthreads)
+            try:
+                results = pool.map(_read, requests)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(_read, requests)
+        return [series for result in results for series in result]
+
+    def _lazy_segments(self, key):
+        """Return the segments registered, but not yet read, for a key
+        """
+        out = SegmentList()
+        for src in self._lazy.get(key, []):
+            out.extend(src.segments)
+        return out.coalesce()
+
+    # -------------------------------------------------------------------------
+    # indexing
+
+    @staticmethod
+    def list_class(series):
+        """Return the list type used to hold the given `Series`
+        """
+        if isinstance(series, StateVector):
+            return StateVectorList
+        elif isinstance(series, Spectrogram):
+            return SpectrogramList
+        else:
+            return TimeSeriesList
+
+    def _get_index(self, key):
+        """Return the ``(starts, ends, maxends)`` index arrays for a key
+        """
+        fragments = dict.__getitem__(self, key)
+        index = self._index.get(key)
+        if isinstance(fragments, SpilledData):
+            if index is not None:
+                return index
+            fragments = self._load(key)
+        if index is None or index[0].size != len(fragments):
+            # the list was modified directly
+            index = self._index[key] = self._build_index(fragments)
+            self._shared.pop(key, None)
+            self._checksums.pop(key, None)
+        return index
+
+    @staticmethod
+    def _build_index(fragments):
+        starts = numpy.array([float(s.span[0]) for s in fragments],
+                             dtype=float)
+        if starts.size > 1 and (numpy.diff(starts) < 0).any():
+            fragments.sort(key=lambda s: float(s.span[0]))
+            starts = numpy.array([float(s.span[0]) for s in fragments],
+                                 dtype=float)
+        ends = numpy.array([float(s.span[1]) for s in fragments], dtype=float)
+        return starts, ends, numpy.maximum.accumulate(ends)
+
+    def _splice(self, key, i0, i1, fragments):
+        """Replace the fragments ``[i0:i1]`` for a key, updating the index
+        """
+        starts, ends = self._get_index(key)[:2]
+        self._load(key)[i0:i1] = list(fragments)
+        starts = numpy.concatenate(
+            (starts[:i0], [float(s.span[0]) for s in fragments], starts[i1:]))
+        ends = numpy.concatenate(
+            (ends[:i0], [float(s.span[1]) for s in fragments], ends[i1:]))
+        self._index[key] = (starts, ends, numpy.maximum.accumulate(ends))
+
+    def _overlap_indices(self, key, segment):
+        """Return the indices of fragments that intersect a segment
+        """
+        starts, ends, maxends = self._get_index(key)
+        start, end = float(segment[0]), float(segment[1])
+        i0 = maxends.searchsorted(start, side='right')
+        i1 = starts.searchsorted(end, side='left')
+        return [i for i in xrange(i0, i1) if ends[i] > start]
+
+    # -------------------------------------------------------------------------
+    # queries
+
+    @synchronized
+    def search(self, key, segment):
+        """Return the list of fragments that intersect the given segment
+
+        Parameters
+        ----------
+        key : `str`
+            name of data set to search
+        segment : `~gwpy.segments.Segment`
+            ``[start, end)`` GPS interval of interest
+
+        Returns
+        -------
+        fragments : `list`
+            the stored fragments, in time order, that overlap ``segment``
+        """
+        if key not in self:
+            return []
+        self._resolve(key, [segment])
+        fragments = self._load(key)
+        return [fragments[i] for i in self._overlap_indices(key, segment)]
+
+    @synchronized
+    def segments(self, key):
+        """Return the `SegmentList` covered by data for the given key
+        """
+        if key not in self:
+            return SegmentList()
+        starts, ends = self._get_index(key)[:2]
+        out = SegmentList(Segment(s, e) for (s, e) in zip(starts, ends))
+        out.extend(self._lazy_segments(key))
+        return out.coalesce()
+
+    @synchronized
+    def coverage(self, key, segments):
+        """Return the parts of the given segments covered by stored data
+        """
+        out = SegmentList()
+        if key not in self:
+            return out
+        starts, ends = self._get_index(key)[:2]
+        for seg in segments:
+            for i in self._overlap_indices(key, seg):
+                out.append(Segment(max(starts[i], float(seg[0])),
+                                   min(ends[i], float(seg[1]))))
+        out.extend(self._lazy_segments(key) & SegmentList(segments))
+        return out.coalesce()
+
+    def missing(self, key, segments):
+        """Return the parts of the given segments not covered by stored data
+        """
+        segments = SegmentList(segments).coalesce()
+        return segments - self.coverage(key, segments)
+
+    def covers(self, key, segment):
+        """Returns `True` if the given segment is fully covered for a key
+        """
+        return abs(self.missing(key, [segment])) == 0
+
+    @synchronized
+    def crop(self, key, segments, listclass=None, copy=False):
+        """Return the stored data for a key restricted to some segments
+
+        By default each returned fragment is a view onto the stored array,
+        rather than a copy.
+
+        Parameters
+        ----------
+        key : `str`
+            name of data set to crop
+        segments : `~gwpy.segments.SegmentList`
+            list of segments of interest
+        listclass : `type`, optional
+            type of list to return, defaults to the type of the stored list
+        copy : `bool`, default: `False`
+            return copies of the data, rather than views
+
+        Returns
+        -------
+        data : `list`
+            coalesced list of fragments cropped to the given segments
+        """
+        if listclass is None:
+            listclass = type(self.get_loaded(key))
+        out = listclass()
+        for seg in segments:
+            for series in self.search(key, seg):
+                if abs(seg) == 0 or abs(seg) < series.dt.value:
+                    continue
+                common = map(float, series.span & seg)
+                cropped = series.crop(*common, copy=copy)
+                if cropped.size:
+                    out.append(cropped)
+        return out.coalesce()
+
+    @synchronized
+    def share(self, key, segments):
+        """Return the fragments for a key ready to send to another process
+
+        Each fragment larger than :attr:`DataStore.share_threshold` bytes
+        is moved into a shared file, and replaced in this store by a view
+        of that file, so that the data are only held in memory once. The
+        fragment is returned as a `SharedSeries` descriptor, so that only
+        the metadata are pickled. Descriptors are reused until the data
+        for this key are modified.
+
+        Parameters
+        ----------
+        key : `str`
+            name of data set to share
+        segments : `~gwpy.segments.SegmentList`
+            GPS segments of interest, only data for these segments are
+            read from any lazy sources
+
+        Returns
+        -------
+        listclass : `type`
+            the type of list holding the data for this key
+        fragments : `list`
+            the fragments (or `SharedSeries` descriptors) that overlap
+            ``segments``, in time order
+        """
+        if key not in self:
+            return list, []
+        segments = SegmentList(segments).coalesce()
+        self._resolve(key, segments)
+        held = self._load(key)
+        shared = self._shared.setdefault(key, {})
+        indices = set()
+        for seg in segments:
+            indices.update(self._overlap_indices(key, seg))
+        out = []
+        for i in sorted(indices):
+            series = held[i]
+            if series.nbytes < self.share_threshold:
+                out.append(series)
+                continue
+            try:
+                view, descriptor = shared[id(series)]
+            except KeyError:
+                view = None
+            if view is not series:
+                descriptor = SharedSeries(series)
+                # replace the stored array with a view of the shared file
+                held[i] = view = descriptor.load(mode='r+')
+                shared[id(view)] = (view, descriptor)
+                self._dirty.add(key)
+            out.append(descriptor)
+        return type(held), out
+
+    @synchronized
+    def checksum(self, key, segments):
+        """Return a checksum of the data for a key within some segments
+
+        The checksum is calculated from the data of every fragment that
+        overlaps the given segments, reading any lazy sources as needed,
+        and is cached until the data for this key are modified.
+
+        Parameters
+        ----------
+        key : `str`
+            name of data set to check
+        segments : `~gwpy.segments.SegmentList`
+            GPS segments of interest
+
+        Returns
+        -------
+        checksum : `str`
+            hex digest of the data
+        """
+        segments = SegmentList(segments).coalesce()
+        try:
+            return self._checksums[key][str(segments)]
+        except KeyError:
+            pass
+        md5 = hashlib.md5()
+        for seg in segments:
+            for series in self.search(key, seg):
+                md5.update(str(series.span))
+                md5.update(numpy.ascontiguousarray(series.value))
+        out = self._checksums.setdefault(key, {})[str(segments)] = (
+            md5.hexdigest())
+        return out
+
+    # -------------------------------------------------------------------------
+    # modifiers
+
+    @synchronized
+    def append(self, key, series, coalesce=True):
+        """Add a new `Series` fragment to the store
+
+        Parameters
+        ----------
+        key : `str`
+            name under which to store the data
+        series : `~gwpy.data.Series`
+            new data to add
+        coalesce : `bool`, default: `True`
+            merge the new data with any contiguous fragments already held
+        """
+        fragments = self.setdefault(key, self.list_class(series)())
+        starts, ends, maxends = self._get_index(key)
+        start, end = map(float, series.span)
+        if coalesce:
+            i0 = maxends.searchsorted(start, side='left')
+            i1 = starts.searchsorted(end, side='right')
+            new = type(fragments)()
+            # fragments viewing a shared file cannot be resized in place
+            new.extend(s.copy() if isinstance(s.base, numpy.memmap) else s
+                       for s in fragments[i0:i1])
+            new.append(series)
+            new.coalesce()
+        else:
+            i0 = i1 = starts.searchsorted(start, side='right')
+            new = [series]
+        self._splice(key, i0, i1, new)
+        self._updated(key)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Duncan Macleod (2013)
+#
+# This file is part of GWSumm.
+#
+# GWSumm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GWSumm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GWSumm.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Persistent on-disk cache of datafind query results
+
+The cache is an SQLite database recording, for each
+``(ifo, frametype, urltype)``, the GPS spans already queried and the
+frame URLs found, so that repeated queries only go to the datafind
+server for the parts of a span not already covered.
+"""
+
+import os
+import fcntl
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from glue.lal import (Cache, CacheEntry)
+
+from gwpy.segments import (Segment, SegmentList)
+
+from . import version
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+__version__ = version.version
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS spans (ifo TEXT, frametype TEXT, '
+    'urltype TEXT, start INTEGER, end INTEGER)',
+    'CREATE TABLE IF NOT EXISTS frames (ifo TEXT, frametype TEXT, '
+    'urltype TEXT, start INTEGER, end INTEGER, url TEXT, '
+    'UNIQUE (ifo, frametype, urltype, url))',
+    'CREATE INDEX IF NOT EXISTS frames_start ON frames '
+    '(ifo, frametype, urltype, start)',
+]
+
+_CACHES = {}
+
+
+class FrameCache(object):
+    """SQLite-backed record of frame files found by datafind queries
+
+    The database may be shared between concurrent processes; all reads
+    and writes are serialised with an exclusive lock on a companion
+    ``<path>.lock`` file. The lock is not held while querying the
+    datafind server, so concurrent processes may query the same span,
+    with the results merged when recorded.
+
+    Parameters
+    ----------
+    path : `str`
+        path of SQLite database file
+    recent : `float`, optional
+        number of seconds before 'now' for which queried spans are only
+        recorded as far as the last frame found, default: 3600
+    """
+    def __init__(self, path, recent=3600):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.lockfile = '%s.lock' % self.path
+        self.recent = recent
+        self._local = threading.local()
+        dir_ = os.path.dirname(self.path)
+        if not os.path.isdir(dir_):
+            os.makedirs(dir_)
+
+    @property
+    def connection(self):
+        """Connection to the database for this thread
+        """
+        try:
+            return self._local.connection
+        except AttributeError:
+            conn = sqlite3.connect(self.path, timeout=60)
+            with conn:
+                for statement in SCHEMA:
+                    conn.execute(statement)
+            self._local.connection = conn
+            return conn
+
+    @contextmanager
+    def lock(self):
+        """Hold an exclusive lock on this cache
+        """
+        with open(self.lockfile, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get_segments(self, ifo, frametype, urltype):
+        """Return the `SegmentList` of spans already queried
+        """
+        rows = self.connection.execute(
+            'SELECT start, end FROM spans WHERE ifo=? AND frametype=? AND '
+            'urltype=?', (ifo, frametype, urltype))
+        return SegmentList(Segment(*row) for row in rows).coalesce()
+
+    def add(self, ifo, frametype, urltype, segment, cache, now):
+        """Record the result of a datafind query over a segment
+
+        Parameters
+        ----------
+        ifo : `str`
+            observatory prefix
+        frametype : `str`
+            frame type queried
+        urltype : `str`
+            URL scheme queried
+        segment : `~gwpy.segments.Segment`
+            GPS ``[start, end)`` span queried
+        cache : :class:`~glue.lal.Cache`
+            the frames found
+        now : `int`
+            current GPS time
+        """
+        # only trust recent results as far as the frames that were found
+        start, end = int(segment[0]), int(segment[1])
+        if end > now - self.recent:
+            end = min(end, max([int(e.segment[1]) for e in cache] or
+                               [start]))
+        key = (ifo, frametype, urltype)
+        with self.connection as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO frames VALUES (?, ?, ?, ?, ?, ?)',
+                [key + (int(e.segment[0]), int(e.segment[1]), e.url) for
+                 e in cache])
+            if end > start:
+                segs = (self.get_segments(*key) |
+                        SegmentList([Segment(start, end)])).coalesce()
+                conn.execute('DELETE FROM spans WHERE ifo=? AND '
+                             'frametype=? AND urltype=?', key)
+                conn.executemany('INSERT INTO spans VALUES (?, ?, ?, ?, ?)',
+                                 [key + (int(s[0]), int(s[1])) for s in segs])
+
+    def get_cache(self, ifo, frametype, urltype, start, end):
+        """Return the :class:`~glue.lal.Cache` of frames overlapping a span
+        """
+        rows = self.connection.execute(
+            'SELECT url FROM frames WHERE ifo=? AND frametype=? AND '
+            'urltype=? AND start<? AND end>? ORDER BY start',
+            (ifo, frametype, urltype, end, start))
+        return Cache(CacheEntry.from_T050017(row[0]) for row in rows)
+
+    def find(self, ifo, frametype, urltype, start, end, query, now):
+        """Find frames for the given span, querying only for new times
+
+        Parameters
+        ----------
+        ifo : `str`
+            observatory prefix
+        frametype : `str`
+            frame type to find
+        urltype : `str`
+            URL scheme to find
+        start : `int`
+            GPS start time of query
+        end : `int`
+            GPS end time of query
+        query : `callable`
+            method to query the datafind server, taking ``(start, end)``
+            and returning a :class:`~glue.lal.Cache`
+        now : `int`
+            current GPS time
+
+        Returns
+        -------
+        cache : :class:`~glue.lal.Cache`
+            the cache of frames overlapping ``[start, end)``
+        """
+        key = (ifo, frametype, urltype)
+        with self.lock():
+            new = (SegmentList([Segment(start, end)]) -
+                   self.get_segments(*key))
+        # don't hold the lock while querying, so that other processes
+        # aren't kept waiting on the datafind server
+        results = []
+        for seg in new:
+            found, _ = query(int(seg[0]), int(seg[1])).checkfilesexist()
+            results.append((seg, found))
+        with self.lock():
+            for seg, found in results:
+                self.add(ifo, frametype, urltype, seg, found, now)
+            return self.get_cache(ifo, frametype, urltype, start, end)
+
+
+def get_frame_cache(path, recent=3600):
+    """Return the `FrameCache` for the given database path
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    try:
+        return _CACHES[path]
+    except KeyError:
+        _CACHES[path] = FrameCache(path, recent=recent)
+        return _CACHES[path]
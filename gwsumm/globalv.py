@@ -26,13 +26,17 @@ from gwpy.time import tconvert
 from gwpy.segments import DataQualityDict
 from gwpy.detector import ChannelList
 
+from .datastore import (DataStore, MemoryManager)
+
 CHANNELS = ChannelList()
 STATES = {}
 
-DATA = {}
-SPECTROGRAMS = {}
-SPECTRUM = {}
+MEMORY = MemoryManager()
+DATA = DataStore(memory=MEMORY)
+SPECTROGRAMS = DataStore(memory=MEMORY)
+SPECTRUM = DataStore(memory=MEMORY)
 SEGMENTS = DataQualityDict()
+QUERIED_SEGMENTS = {}
 TRIGGERS = {}
 
 VERBOSE = False
@@ -42,6 +46,7 @@ START = time.time()
 # run time variables
 MODE = 4
 WRITTEN_PLOTS = []
+INCREMENTAL = False
 NOW = tconvert('now').seconds
 HTMLONLY = False
 
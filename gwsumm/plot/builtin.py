@@ -25,6 +25,7 @@ import hashlib
 import warnings
 from itertools import cycle
 
+from matplotlib import rcParams
 from matplotlib.pyplot import subplots
 
 from astropy.units import Quantity
@@ -36,10 +37,12 @@ from gwpy.plotter.tex import label_to_latex
 from .. import (globalv, mode, version)
 from ..utils import (re_quote, re_cchar, split_channels)
 from ..data import (get_channel, get_timeseries, get_spectrogram, get_spectrum,
-                    add_timeseries)
+                    add_timeseries, find_pyramid_keys,
+                    get_timeseries_pyramid, get_pyramid_statistic)
 from ..state import ALLSTATE
 from .registry import (get_plot, register_plot)
 from .mixins import *
+from .utils import decimate_minmax
 
 __author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
 __version__ = version.version
@@ -60,6 +63,54 @@ class TimeSeriesDataPlot(DataLabelSvgMixin, DataPlot):
         super(TimeSeriesDataPlot, self).__init__(*args, **kwargs)
         for c in self.channels:
             c._timeseries = True
+        # reduce data to one min/max pair per pixel column before drawing
+        self.decimate = self.pargs.pop('decimate', True)
+
+    @property
+    def use_trends(self):
+        """`True` if this plot is drawn from pre-computed trends
+
+        Trends are only used for pages spanning many days, shorter pages
+        are drawn from the full data, whether or not trends are held.
+        """
+        return mode.MODE_NAME[mode.get_mode()] in ['WEEK', 'MONTH', 'YEAR']
+
+    @property
+    def resolution(self):
+        """Time (seconds) spanned by one pixel column of this plot
+        """
+        figsize = self.pargs.get('figsize', [12, 6])
+        return abs(self.span) / (figsize[0] * rcParams['figure.dpi'])
+
+    def get_pyramid_keys(self):
+        """Return the keys of the trends drawn in place of full data.
+
+        For pages spanning many days, each channel is drawn from the
+        coarsest trend that resolves a single pixel, where available.
+        Sub-classes that read the full data in their own `process` method
+        should override this to return an empty `dict`.
+        """
+        if not self.use_trends:
+            return {}
+        out = {}
+        for c in self.channels:
+            keys = find_pyramid_keys(c, self._get_valid_segments(c),
+                                     self.resolution)
+            if keys is not None:
+                out[c.ndsname] = keys
+        return out
+
+    def _get_valid_segments(self, channel):
+        """Return the segments for which to draw data for a channel
+        """
+        # pad data request to over-fill plots (no gaps at the end)
+        if self.state and not self.all_data:
+            return self.state.active
+        elif channel.sample_rate:
+            return SegmentList([self.span.protract(
+                1/channel.sample_rate.value)])
+        else:
+            return SegmentList([self.span])
 
     def add_state_segments(self, ax, **kwargs):
         """Add an `Axes` below the given ``ax`` displaying the `SummaryState`
@@ -117,6 +168,10 @@ class TimeSeriesDataPlot(DataLabelSvgMixin, DataPlot):
     def process(self, outputfile=None):
         """Read in all necessary data, and generate the figure.
         """
+        # time (seconds) spanned by one pixel, used to pick trend data
+        resolution = self.resolution
+        usetrends = self.use_trends
+
         (plot, axes) = self.init_plot()
         ax = axes[0]
 
@@ -126,17 +181,17 @@ class TimeSeriesDataPlot(DataLabelSvgMixin, DataPlot):
         # add data
         channels, groups = zip(*self.get_channel_groups())
         for clist, pargs in zip(groups, plotargs):
-            # pad data request to over-fill plots (no gaps at the end)
-            if self.state and not self.all_data:
-                valid = self.state.active
-            elif clist[0].sample_rate:
-                valid = SegmentList([self.span.protract(
-                    1/clist[0].sample_rate.value)])
-            else:
-                valid = SegmentList([self.span])
-            # get data
-            data = [get_timeseries(c, valid, query=False)
-                    for c in clist]
+            valid = self._get_valid_segments(clist[0])
+            # get data, using pre-computed trends for long spans
+            data = []
+            for c in clist:
+                if usetrends:
+                    tsl = get_timeseries_pyramid(c, valid, resolution)
+                else:
+                    tsl = None
+                if tsl is None:
+                    tsl = get_timeseries(c, valid, query=False)
+                data.append(tsl)
             if len(clist) > 1:
                 data = [tsl.join(gap='pad', pad=numpy.nan) for tsl in data]
             flatdata = [ts for tsl in data for ts in tsl]
@@ -149,6 +204,18 @@ class TimeSeriesDataPlot(DataLabelSvgMixin, DataPlot):
                 # double-check log scales
                 if self.pargs.get('logy', False):
                     ts.value[ts.value == 0] = 1e-100
+            # reduce each series to its envelope at the plot resolution,
+            # or to its per-pixel extreme for min and max trends
+            if self.decimate and len(clist) > 1:
+                data = [decimate_minmax(ts, resolution,
+                                        get_pyramid_statistic(c))
+                        for c, ts in zip(clist, data)]
+            elif self.decimate:
+                stat = get_pyramid_statistic(clist[0])
+                tsl = type(data[0])()
+                tsl.extend(decimate_minmax(ts, resolution, stat)
+                           for ts in data[0])
+                data[0] = tsl
             # set label
             try:
                 label = pargs.pop('label')
@@ -248,6 +315,11 @@ class SpectrogramDataPlot(TimeSeriesDataPlot):
     def pid(self):
         del self._pid
 
+    def get_pyramid_keys(self):
+        """This plot is drawn from the full data, never from trends
+        """
+        return {}
+
     def process(self):
         # initialise
         (plot, axes) = self.init_plot()
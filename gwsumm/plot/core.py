@@ -25,29 +25,49 @@ import hashlib
 import os.path
 import re
 import warnings
+from bisect import bisect_left
 from math import (floor, ceil)
 from urlparse import urlparse
 
+import numpy
+
 try:
     from collections import OrderedDict
 except ImportError:
     from astropy.utils import OrderedDict
 
-from gwpy.segments import Segment
+from gwpy.segments import (Segment, SegmentList)
 from gwpy.detector import (Channel, ChannelList)
 from gwpy.plotter.utils import rUNDERSCORE
 
 from . import rcParams
 from .registry import register_plot
-from .. import globalv
+from .. import (globalv, version)
 from ..channels import get_channel
-from ..utils import (vprint, split_channels)
+from ..data import re_pyramid
+from ..utils import (vprint, split_channels, re_flagdiv)
 
 __all__ = ['SummaryPlot', 'DataPlot']
 
 re_cchar = re.compile("[\W\s_]+")
 
 
+def index_store_keys():
+    """Index the keys of all stored data
+
+    Returns
+    -------
+    index : `dict`
+        ``(names, keys)`` pair for each store in :mod:`gwsumm.globalv`,
+        giving each key, and its string form, sorted by that string
+    """
+    out = {}
+    for name in ('DATA', 'SPECTROGRAMS', 'SPECTRUM', 'TRIGGERS'):
+        keys = sorted(getattr(globalv, name).keys(), key=str)
+        out[name] = (map(str, keys), keys)
+    return out
+
+
 class SummaryPlot(object):
     """An image to displayed in GWSumm HTML output.
 
@@ -336,9 +356,223 @@ class DataPlot(SummaryPlot):
     def href(self, url):
         self._href = url and os.path.normpath(url) or None
 
+    @property
+    def digestfile(self):
+        """File recording the digest of the input data for this plot.
+        """
+        return '%s.md5' % os.path.splitext(self.outputfile)[0]
+
     # ------------------------------------------------------------------------
     # TabSummaryPlot methods
 
+    def get_input_channels(self):
+        """Return the channels whose data are read by this plot.
+
+        Plots that read data for channels other than those they are
+        configured with should extend this list, so that those data
+        are passed to a :class:`~gwsumm.plot.pool.PlotPool` worker.
+
+        Returns
+        -------
+        channels : `list`
+            the plot channels, and any other channels read by this plot
+        """
+        return list(self.channels + self.allchannels)
+
+    def get_input_keys(self, storekeys=None):
+        """Return the keys of stored data that are inputs to this plot.
+
+        A key is an input if it is the NDS name of one of the
+        :meth:`input channels <DataPlot.get_input_channels>`, or begins
+        with that name followed by a comma or an underscore.
+
+        Parameters
+        ----------
+        storekeys : `dict`, optional
+            index of all stored keys, as returned by
+            :func:`index_store_keys`; give this when finding the inputs of
+            many plots, so that the stores are only scanned once
+
+        Returns
+        -------
+        keys : `dict`
+            `dict` of sorted key lists, keyed by the name of each store in
+            :mod:`gwsumm.globalv`
+        """
+        if storekeys is None:
+            storekeys = index_store_keys()
+        names = set(c.ndsname for c in self.get_input_channels())
+        out = {}
+        for store, (strkeys, keys) in storekeys.iteritems():
+            found = set()
+            for name in names:
+                for lo, hi in [(name, name + '\x00'),
+                               (name + ',', name + '-'),
+                               (name + '_', name + '`')]:
+                    found.update(keys[bisect_left(strkeys, lo):
+                                      bisect_left(strkeys, hi)])
+            out[store] = sorted(found, key=str)
+        # keep only those trends of the plot channels that are drawn,
+        # in place of the full data
+        trends = self.get_pyramid_keys()
+        keep = []
+        for key in out['DATA']:
+            match = re_pyramid.search(str(key))
+            if match and str(key)[:match.start()] in names:
+                if key in trends.get(str(key)[:match.start()], []):
+                    keep.append(key)
+            elif not trends.get(str(key)):
+                keep.append(key)
+        out['DATA'] = keep
+        return out
+
+    def get_input_segments(self):
+        """Return the segments for which this plot reads data.
+
+        Returns
+        -------
+        segments : `~gwpy.segments.SegmentList`
+            the active segments of this plot's state within its span,
+            or the full span for 'all-data' plots
+        """
+        span = SegmentList([self.span])
+        if self.state is not None and not self.all_data:
+            return self.state.active & span
+        return span
+
+    def get_pyramid_keys(self):
+        """Return the keys of the trends drawn in place of full data.
+
+        Returns
+        -------
+        keys : `dict`
+            `list` of trend keys for each channel (by NDS name) drawn
+            from trends, all other channels are drawn from their full data;
+            `DataPlot` draws no trends, so this is always empty
+        """
+        return {}
+
+    def get_input_digest(self, storekeys=None):
+        """Return a digest of the input data and parameters for this plot.
+
+        The digest records the coverage and a checksum of the contents of
+        all stored data for the plot channels, the segments for the plot
+        flags, and the plot parameters, so that two plots with the same
+        digest are drawn from identical input, even if the data for the
+        same times have been rewritten.
+
+        Parameters
+        ----------
+        storekeys : `dict`, optional
+            index of all stored keys, see :meth:`DataPlot.get_input_keys`
+
+        Returns
+        -------
+        digest : `str`
+            hex digest of the input data for this plot, or `None` if
+            this plot has channels, but no stored data were found for
+            them, so that its input cannot be recorded
+        """
+        inputkeys = self.get_input_keys(storekeys)
+        if len(self.channels) and not any(inputkeys.values()):
+            warnings.warn("No stored data found for %s plot channels %s, "
+                          "cannot record digest of input"
+                          % (self.type, ', '.join(map(str, self.channels))))
+            return None
+        span = SegmentList([self.span])
+        md5 = hashlib.md5()
+        md5.update(repr((version.version, self.type, self.outputfile,
+                         sorted(self.pargs.items()))))
+        if self.state is not None:
+            md5.update(str(self.state.active & span))
+        # data coverage for all channels
+        segments = self.get_input_segments()
+        for name in ('DATA', 'SPECTROGRAMS'):
+            store = getattr(globalv, name)
+            for key in inputkeys[name]:
+                md5.update(str(key))
+                md5.update(str(store.coverage(key, span)))
+                md5.update(store.checksum(key, segments))
+        for key in inputkeys['TRIGGERS']:
+            table = globalv.TRIGGERS[key]
+            md5.update('%s%d' % (key, len(table)))
+            md5.update(str(getattr(table, 'segments', '')))
+            if isinstance(getattr(table, 'data', None), numpy.ndarray):
+                md5.update(numpy.ascontiguousarray(table.data))
+        # segments for all flags
+        for flag in getattr(self, 'flags', []):
+            for f in re_flagdiv.split(str(flag))[::2]:
+                if f in globalv.SEGMENTS:
+                    md5.update(f)
+                    md5.update(str(globalv.SEGMENTS[f].known & span))
+                    md5.update(str(globalv.SEGMENTS[f].active & span))
+        return md5.hexdigest()
+
+    def get_inputs(self, storekeys=None):
+        """Return the stored data required to process this plot.
+
+        This allows the plot to be processed in a separate process that
+        does not share the global memory of this one, see
+        :mod:`gwsumm.plot.pool`.
+
+        Parameters
+        ----------
+        storekeys : `dict`, optional
+            index of all stored keys, see :meth:`DataPlot.get_input_keys`
+
+        Returns
+        -------
+        inputs : `dict`
+            `dict` of ``(name, data)`` pairs, where ``name`` is the name
+            of a store in :mod:`gwsumm.globalv`, and ``data`` is a `dict`
+            of the held data for this plot's channels (or flags), limited
+            to those fragments overlapping the segments given by
+            :meth:`DataPlot.get_input_segments`, and to the trends chosen
+            by :meth:`DataPlot.get_pyramid_keys`; time-series
+            and spectrogram data are given as returned by
+            :meth:`~gwsumm.datastore.DataStore.share`
+        """
+        inputkeys = self.get_input_keys(storekeys)
+        segments = self.get_input_segments()
+        inputs = {'CHANNELS': self.get_input_channels()}
+        for name in ('DATA', 'SPECTROGRAMS'):
+            store = getattr(globalv, name)
+            inputs[name] = dict((key, store.share(key, segments)) for
+                                key in inputkeys[name])
+        inputs['SPECTRUM'] = dict(
+            (key, globalv.SPECTRUM.get_loaded(key)) for
+            key in inputkeys['SPECTRUM'])
+        inputs['TRIGGERS'] = dict(
+            (key, globalv.TRIGGERS[key].select(SegmentList([self.span]))) for
+            key in inputkeys['TRIGGERS'])
+        inputs['SEGMENTS'] = {}
+        for flag in getattr(self, 'flags', []):
+            for f in re_flagdiv.split(str(flag))[::2]:
+                if f in globalv.SEGMENTS:
+                    inputs['SEGMENTS'][f] = globalv.SEGMENTS[f]
+        return inputs
+
+    def is_current(self, storekeys=None):
+        """Returns `True` if the output file was made from the current input
+
+        The digest of the input data is compared to that recorded in the
+        :attr:`~DataPlot.digestfile` when the output file was last written.
+        A plot with channels for which no data are stored is never current.
+
+        Parameters
+        ----------
+        storekeys : `dict`, optional
+            index of all stored keys, see :meth:`DataPlot.get_input_keys`
+        """
+        self._digest = self.get_input_digest(storekeys)
+        if self._digest is None or not os.path.isfile(self.outputfile):
+            return False
+        try:
+            with open(self.digestfile, 'r') as f:
+                return f.read().strip() == self._digest
+        except IOError:
+            return False
+
     def parse_legend_kwargs(self, **defaults):
         """Pop the legend arguments from the `pargs` for this Plot
         """
@@ -515,6 +749,16 @@ class DataPlot(SummaryPlot):
                          % (type(e).__name__, str(e)))
             self.plot.save(outputfile, **savekwargs)
         vprint("        %s written\n" % self.outputfile)
+        # record digest of input data for incremental processing
+        digest = getattr(self, '_digest', None)
+        if digest is None and globalv.INCREMENTAL:
+            digest = self.get_input_digest()
+        if outputfile == self.outputfile and digest is not None:
+            with open(self.digestfile, 'w') as f:
+                f.write(digest)
+        elif outputfile == self.outputfile and os.path.isfile(
+                self.digestfile):
+            os.remove(self.digestfile)
         if close:
             self.plot.close()
         return outputfile
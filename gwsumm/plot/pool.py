@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Duncan Macleod (2013)
+#
+# This file is part of GWSumm.
+#
+# GWSumm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GWSumm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GWSumm.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Pool of processes for rendering plots
+
+A single `PlotPool` is started once per run by ``gw_summary``, and is
+shared by all tabs and states, being passed to each tab as the
+``plotpool`` argument. Tabs processed without a shared pool start their
+own, and wait for it to finish before returning.
+
+Each plot is sent to the pool along with the stored data it needs
+(see :meth:`~gwsumm.plot.DataPlot.get_inputs`), so the pool can be
+started before any data are read, and plots are rendered while the
+next tab or state is being processed. Large data arrays are not copied
+to the workers, but are mapped from shared files, see
+:class:`~gwsumm.datastore.SharedSeries`.
+
+Queued plots are dispatched longest-job-first, based on an estimate of
+the time each will take to render. The estimates are drawn from the
+recorded rendering times for each plot, or plot type, in previous runs
+(see `PlotTiming`), so the pool is not left waiting on an expensive plot
+started last. Each tab holds its plots back from the workers until all
+of its states have been processed (see :meth:`PlotPool.submit`), so that
+every plot for that tab is ordered together, rather than dispatching
+the cheap plots of the first state before the expensive plots of the
+last.
+"""
+
+import os
+import json
+import fcntl
+import heapq
+import tempfile
+import threading
+import time
+import traceback
+import warnings
+from itertools import count
+from multiprocessing import Pool
+
+from .. import (globalv, version)
+from ..datastore import SharedSeries
+from ..utils import (vprint, count_free_cores)
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+__version__ = version.version
+
+_POOL = None
+
+# relative rendering cost of each plot type per channel-day, used to
+# estimate the cost of plots that have not been timed
+PLOT_COSTS = {
+    'spectrogram': 20,
+    'rayleigh-spectrogram': 20,
+    'variance': 10,
+    'histogram2d': 10,
+    'spectrum': 5,
+    'rayleigh-spectrum': 5,
+    'triggers': 5,
+    'trigger-histogram': 3,
+    'timeseries': 2,
+    'trigger-timeseries': 2,
+    'statevector': 2,
+    'odc': 2,
+}
+
+
+def _init_worker():
+    """Prepare a new worker process for rendering
+    """
+    # import the plotting backend once, rather than once per plot
+    from matplotlib import pyplot
+    pyplot.close('all')
+
+
+def _install_inputs(inputs):
+    """Replace the contents of the global stores with the given inputs
+    """
+    for name in ('DATA', 'SPECTROGRAMS'):
+        store = getattr(globalv, name)
+        store.clear()
+        for key, (listclass, fragments) in inputs.get(name, {}).iteritems():
+            data = listclass()
+            for series in fragments:
+                if isinstance(series, SharedSeries):
+                    series = series.load()
+                data.append(series)
+            store[key] = data
+    globalv.SPECTRUM.clear()
+    for key, data in inputs.get('SPECTRUM', {}).iteritems():
+        globalv.SPECTRUM[key] = data
+    globalv.TRIGGERS.clear()
+    globalv.TRIGGERS.update(inputs.get('TRIGGERS', {}))
+    globalv.SEGMENTS.clear()
+    globalv.SEGMENTS.update(inputs.get('SEGMENTS', {}))
+    for channel in inputs.get('CHANNELS', []):
+        if not len(globalv.CHANNELS.sieve(name=channel.name, type=channel.type,
+                                          exact_match=True)):
+            globalv.CHANNELS.append(channel)
+
+
+def _process_plot(jobid, plot, inputs):
+    """Render a plot in a worker process
+
+    Returns
+    -------
+    jobid : `int`
+        the input job ID
+    error : `str`, `None`
+        the formatted traceback of any exception raised in processing
+        the plot, otherwise `None`
+    duration : `float`
+        the time taken to render the plot, in seconds
+    """
+    start = time.time()
+    try:
+        _install_inputs(inputs)
+        plot.process()
+    except Exception:
+        return jobid, traceback.format_exc(), time.time() - start
+    finally:
+        _install_inputs({})
+    return jobid, None, time.time() - start
+
+
+class PlotTiming(object):
+    """Record of the time taken to render plots
+
+    Times are recorded for each plot, identified by its tag and
+    duration, and in total for each plot type, along with the total
+    number of channel-days rendered for that type.
+
+    Parameters
+    ----------
+    path : `str`, optional
+        path of JSON file in which to persist these times between runs,
+        if not given the times are kept in memory only
+    """
+    # weight given to the latest measurement for each plot
+    decay = 0.5
+
+    def __init__(self, path=None):
+        if path is not None:
+            path = os.path.abspath(os.path.expanduser(path))
+        self.path = path
+        self.plots = {}
+        self.types = {}
+        self._updated = set()
+        self._increments = {}
+        if path is not None:
+            self.plots, self.types = self._read()
+
+    @staticmethod
+    def get_key(plot):
+        """Return the key identifying a plot between runs
+        """
+        return '%s-%d' % (plot.tag, abs(plot.span))
+
+    @staticmethod
+    def get_size(plot):
+        """Return the size of a plot, in channel-days
+        """
+        return max(len(plot.channels), 1) * max(abs(plot.span), 1) / 86400.
+
+    def estimate(self, plot):
+        """Estimate the time taken to render a plot
+
+        The recorded time for this plot is used if available, otherwise
+        the mean time per channel-day for plots of the same type, or
+        the relative cost from `PLOT_COSTS`, converted to seconds by
+        :meth:`PlotTiming.get_cost_scale`.
+
+        Returns
+        -------
+        cost : `float`
+            the estimated time (seconds) taken to render this plot
+        """
+        try:
+            return self.plots[self.get_key(plot)]
+        except KeyError:
+            pass
+        size = self.get_size(plot)
+        try:
+            seconds, total = self.types[plot.type]
+        except KeyError:
+            return PLOT_COSTS.get(plot.type, 1) * size * self.get_cost_scale()
+        else:
+            return seconds / total * size
+
+    def get_cost_scale(self):
+        """Return the mean time (seconds) per unit of `PLOT_COSTS`
+
+        This is the ratio of the total recorded time for all plot types
+        to the total cost of the same plots given by `PLOT_COSTS`, or
+        one if no times have been recorded.
+        """
+        seconds = sum(s for (s, _) in self.types.itervalues())
+        cost = sum(PLOT_COSTS.get(type_, 1) * total for
+                   type_, (_, total) in self.types.iteritems())
+        if seconds and cost:
+            return seconds / cost
+        return 1.
+
+    def record(self, plot, duration):
+        """Record the time taken to render a plot
+        """
+        key = self.get_key(plot)
+        try:
+            old = self.plots[key]
+        except KeyError:
+            self.plots[key] = duration
+        else:
+            self.plots[key] = self.decay * duration + (1 - self.decay) * old
+        size = self.get_size(plot)
+        for types in (self.types, self._increments):
+            seconds, total = types.get(plot.type, (0, 0))
+            types[plot.type] = (seconds + duration, total + size)
+        self._updated.add(key)
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+            return (dict(stored['plots']),
+                    dict((t, tuple(v)) for t, v in stored['types'].items()))
+        except (IOError, ValueError, KeyError, TypeError):
+            return {}, {}
+
+    def write(self):
+        """Write the recorded times to the file
+
+        The file is locked for the duration, and times stored by other
+        processes since this one started are kept; the per-type totals
+        recorded by this process are added to those stored.
+        """
+        if self.path is None or not self._updated:
+            return
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open('%s.lock' % self.path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                plots, types = self._read()
+                for key in self._updated:
+                    plots[key] = self.plots[key]
+                for type_, (seconds, total) in self._increments.iteritems():
+                    old = types.get(type_, (0, 0))
+                    types[type_] = (old[0] + seconds, old[1] + total)
+                fd, tmp = tempfile.mkstemp(suffix='.json', dir=directory)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({'plots': plots, 'types': types}, f)
+                os.rename(tmp, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        self.plots, self.types = plots, types
+        self._updated = set()
+        self._increments = {}
+
+
+class PlotPool(object):
+    """Pool of processes for rendering `DataPlot` objects
+
+    Submitted plots are held in a queue, ordered by their estimated
+    cost, and no more plots are handed to the workers than there are
+    workers, so that the most expensive plot queued is always the next
+    to be rendered.
+
+    Parameters
+    ----------
+    nproc : `int`, `True`
+        number of worker processes, or `True` to use all free cores
+    timing : `PlotTiming`, optional
+        record of previous rendering times, used to estimate the cost of
+        each plot
+    """
+    def __init__(self, nproc, timing=None):
+        if nproc is True:
+            nproc = count_free_cores()
+        self.nproc = nproc
+        if timing is None:
+            timing = PlotTiming()
+        self.timing = timing
+        self._pool = Pool(nproc, initializer=_init_worker)
+        self._queue = []
+        self._held = []
+        self._running = {}
+        self._counter = count()
+        self._lock = threading.RLock()
+
+    def submit(self, plot, storekeys=None, hold=False):
+        """Queue a plot for rendering, returning immediately
+
+        Parameters
+        ----------
+        plot : `~gwsumm.plot.DataPlot`
+            the plot to process, all of the data it needs must already
+            be held in memory
+        storekeys : `dict`, optional
+            index of all stored keys, see
+            :meth:`~gwsumm.plot.DataPlot.get_input_keys`
+        hold : `bool`, default: `False`
+            hold this plot back from the workers until :meth:`release`
+            is called, so that it is ordered along with the plots
+            submitted after it
+        """
+        cost = self.timing.estimate(plot)
+        inputs = plot.get_inputs(storekeys)
+        job = (-cost, next(self._counter), plot, inputs)
+        with self._lock:
+            if hold:
+                self._held.append(job)
+                return
+            heapq.heappush(self._queue, job)
+        self._dispatch()
+
+    def release(self):
+        """Queue all held plots for rendering, in order of their cost
+        """
+        with self._lock:
+            for job in self._held:
+                heapq.heappush(self._queue, job)
+            self._held = []
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand the most expensive queued plots to any idle workers
+        """
+        with self._lock:
+            # catch jobs that failed before the worker could run them
+            for jobid, (plot, result, _) in self._running.items():
+                if result.ready() and not result.successful():
+                    try:
+                        result.get()
+                    except Exception as e:
+                        self._report(plot, '%s: %s' % (type(e).__name__,
+                                                       str(e)))
+                    self._running.pop(jobid)
+            while self._queue and len(self._running) < self.nproc:
+                _, jobid, plot, inputs = heapq.heappop(self._queue)
+                # the inputs are held until the plot is done, so that
+                # any shared files are not removed before they are read
+                self._running[jobid] = (plot, self._pool.apply_async(
+                    _process_plot, (jobid, plot, inputs),
+                    callback=self._finished), inputs)
+
+    def _finished(self, output):
+        """Record a rendered plot, and dispatch the next
+        """
+        jobid, error, duration = output
+        with self._lock:
+            plot = self._running.pop(jobid)[0]
+            if error:
+                self._report(plot, error)
+            else:
+                self.timing.record(plot, duration)
+        self._dispatch()
+
+    @staticmethod
+    def _report(plot, error):
+        warnings.warn("Failed to process %s:\n%s" % (plot.outputfile, error))
+
+    def collect(self, wait=False):
+        """Dispatch queued plots, and report on those that have finished
+
+        Parameters
+        ----------
+        wait : `bool`, default: `False`
+            wait for all submitted plots to finish
+
+        Returns
+        -------
+        npending : `int`
+            the number of plots that have not yet finished
+        """
+        while True:
+            self._dispatch()
+            with self._lock:
+                npending = len(self._queue) + len(self._running)
+                running = [job[1] for job in self._running.values()]
+            if not wait or not npending:
+                return npending
+            if running:
+                running[0].wait(1)
+
+    def close(self):
+        """Wait for all plots to finish rendering, and stop the pool
+
+        Any held plots are released first. The rendering times are then
+        written to the timing file, if one was given.
+        """
+        self.release()
+        npending = self.collect()
+        if npending:
+            vprint("Waiting for %d plots to finish rendering... " % npending)
+        self.collect(wait=True)
+        self._pool.close()
+        self._pool.join()
+        if npending:
+            vprint("Done.\n")
+        self.timing.write()
+
+
+def get_plot_pool(nproc=None, timing=None):
+    """Return the `PlotPool` for this run, starting it if required
+
+    Parameters
+    ----------
+    nproc : `int`, `bool`, optional
+        number of processes to start, or `True` to use all free cores,
+        only used the first time this function is called
+    timing : `str`, optional
+        path of file recording the time taken to render each plot,
+        only used the first time this function is called
+
+    Returns
+    -------
+    pool : `PlotPool`, `None`
+        the running pool, or `None` if no pool was started and ``nproc``
+        is not given
+    """
+    global _POOL
+    if _POOL is None and nproc:
+        _POOL = PlotPool(nproc, timing=PlotTiming(timing))
+    return _POOL
+
+
+def close_plot_pool():
+    """Wait for all queued plots to be rendered, and stop the pool
+    """
+    global _POOL
+    if _POOL is not None:
+        _POOL.close()
+        _POOL = None
@@ -24,16 +24,21 @@ from __future__ import division
 import re
 import hashlib
 from math import pi
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
 
 import numpy
 
-from gwpy.segments import (Segment, SegmentList)
+from gwpy.segments import SegmentList
 from gwpy.timeseries import TimeSeries
 
 from .. import (globalv, version)
 from .registry import (get_plot, register_plot)
-from ..data import (get_range_channel, get_range, get_timeseries)
+from ..data import (get_range_channel, get_ranges, get_timeseries)
 from ..segments import get_segments
+from ..segmentarray import (SegmentArray, cumulative_livetime)
 from ..utils import split_channels
 
 __author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
@@ -64,24 +69,42 @@ class RangePlotMixin(object):
                 value = [value]*len(self.channels)
             self.rangeparams[key] = value
 
+    def get_pyramid_keys(self):
+        """This plot is drawn from the full data, never from trends
+        """
+        return {}
+
     def process(self):
         """Read in all necessary data, and generate the figure.
         """
-        # generate data
-        keys = []
+        # group range requests by channel and spectrogram parameters
+        if self.state and not self.all_data:
+            valid = self.state.active
+        else:
+            valid = SegmentList([self.span])
+        groups = OrderedDict()
         for i, channel in enumerate(self.channels):
             kwargs = dict((key, self.rangeparams[key][i]) for
                           key in self.rangeparams if
                           self.rangeparams[key][i] is not None)
-            if self.state and not self.all_data:
-                valid = self.state.active
-            else:
-                valid = SegmentList([self.span])
-            rlist = get_range(channel, valid, query=self.read, **kwargs)
-            try:
-                keys.append(rlist[0].channel)
-            except IndexError:
-                keys.append(get_range_channel(channel, **kwargs))
+            sgparams = tuple((key, kwargs.pop(key, None)) for
+                             key in ['stride', 'fftlength', 'overlap'])
+            groups.setdefault((str(channel), sgparams), []).append(
+                (i, kwargs))
+
+        # generate data, all ranges for one channel in a single pass
+        keys = [None] * len(self.channels)
+        for (channel, sgparams), requests in groups.iteritems():
+            rangekwargs = [kwargs for (_, kwargs) in requests]
+            ranges = get_ranges(channel, valid, rangekwargs=rangekwargs,
+                                query=self.read, **dict(sgparams))
+            # identical requests share a single key in the output
+            for i, kwargs in requests:
+                key = get_range_channel(channel, **kwargs)
+                try:
+                    keys[i] = ranges[key][0].channel
+                except IndexError:
+                    keys[i] = key
 
         # reset channel lists and generate time-series plot
         channels = self.channels
@@ -158,15 +181,12 @@ class SimpleTimeVolumeDataPlot(get_plot('segments')):
         ts = TimeSeries(numpy.zeros(range.size), xindex=range.times, unit='s')
         dx = range.dx.value
 
-        # use float, not LIGOTimeGPS for speed
-        segments = type(segments)([type(s)(float(s[0]), float(s[1])) for
-                                  s in segments])
-
-        def livetime_(t):
-            return float(abs(SegmentList([Segment(t, t+dx)]) & segments))
-
-        livetime = numpy.vectorize(livetime_, otypes=[float])
-        ts[:] = livetime(ts.times.value) * ts.unit
+        # livetime in [t, t+dx) for each sample
+        segments = SegmentArray.from_segmentlist(segments)
+        times = ts.times.value
+        livetime = (cumulative_livetime(segments, times + dx) -
+                    cumulative_livetime(segments, times))
+        ts[:] = livetime * ts.unit
         return (4/3. * pi * ts * range ** 3).to('Mpc^3 year')
 
     def process(self, outputfile=None):
@@ -43,6 +43,7 @@ from ..config import NoOptionError
 from ..utils import (re_quote, get_odc_bitmask, re_flagdiv)
 from ..data import (get_channel, get_timeseries)
 from ..segments import (get_segments, format_padding)
+from ..segmentarray import (SegmentArray, binned_livetime)
 from ..state import ALLSTATE
 from .core import (BarPlot, PiePlot)
 from .registry import (get_plot, register_plot)
@@ -192,6 +193,11 @@ class SegmentDataPlot(SegmentLabelSvgMixin, TimeSeriesDataPlot):
             else:
                 return GREEN, 'red'
 
+    def get_pyramid_keys(self):
+        """This plot is drawn from the full data, never from trends
+        """
+        return {}
+
     def process(self):
         # get labelsize
         _labelsize = rcParams['ytick.labelsize']
@@ -340,6 +346,11 @@ class StateVectorDataPlot(TimeSeriesDataPlot):
             labels.append(None)
         return labels
 
+    def get_pyramid_keys(self):
+        """This plot is drawn from the full data, never from trends
+        """
+        return {}
+
     def process(self):
         # make font size smaller
         _labelsize = rcParams['ytick.labelsize']
@@ -521,20 +532,17 @@ class DutyDataPlot(SegmentDataPlot):
             normalized = 100.
         else:
             normalized = float(normalized)
-        if not bins:
+        if bins is None or not len(bins):
             bins = self.get_bins()
+        bins = numpy.asarray(bins, dtype=float)
         if isinstance(segments, DataQualityFlag):
-            segments = segments.known & segments.active
-        duty = numpy.zeros(len(bins))
-        mean = numpy.zeros(len(bins))
-        for i in range(len(bins)):
-            bin = SegmentList([Segment(self.start + sum(bins[:i]),
-                                       self.start + sum(bins[:i+1]))])
-            d = float(abs(segments & bin))
-            if normalized:
-                d *= normalized / float(bins[i])
-            duty[i] = d
-            mean[i] = duty[:i+1].mean()
+            segments = (SegmentArray.from_segmentlist(segments.known) &
+                        SegmentArray.from_segmentlist(segments.active))
+        edges = float(self.start) + numpy.concatenate(([0.], bins.cumsum()))
+        duty = binned_livetime(segments, edges)
+        if normalized:
+            duty *= normalized / bins
+        mean = duty.cumsum() / numpy.arange(1, duty.size + 1)
         if cumulative:
             duty = duty.cumsum()
         return duty, mean
@@ -743,6 +751,10 @@ class ODCDataPlot(SegmentLabelSvgMixin, StateVectorDataPlot):
     def get_bitmask_channels(self):
         return type(self.channels)(list(map(get_channel, self.bitmask)))
 
+    def get_input_channels(self):
+        return (super(ODCDataPlot, self).get_input_channels() +
+                list(self.get_bitmask_channels()))
+
     @property
     def pid(self):
         try:
@@ -832,12 +844,15 @@ class ODCDataPlot(SegmentLabelSvgMixin, StateVectorDataPlot):
                     nflags += 2
                 # plot masks and separate masked/not masked
                 else:
+                    amask = SegmentArray.from_segmentlist(mask)
+                    aknown = SegmentArray.from_segmentlist(segs.known)
+                    aactive = SegmentArray.from_segmentlist(segs.active)
                     maskon = segs.copy()
-                    maskon.known &= mask
-                    maskon.active &= mask
+                    maskon.known = (aknown & amask).to_segmentlist()
+                    maskon.active = (aactive & amask).to_segmentlist()
                     maskoff = segs.copy()
-                    maskoff.known -= mask
-                    maskoff.active -= mask
+                    maskoff.known = (aknown - amask).to_segmentlist()
+                    maskoff.active = (aactive - amask).to_segmentlist()
                     # plot mask
                     ax.plot(mask, y=-nflags, facecolor=inmaskcolor,
                             edgecolor='none', height=1., label=None,
@@ -959,8 +974,10 @@ class SegmentPiePlot(PiePlot, SegmentDataPlot):
             else:
                 valid = SegmentList([self.span])
             segs = get_segments(flag, validity=valid, query=False,
-                                padding=self.padding).coalesce()
-            data.append(float(abs(segs.active)))
+                                padding=self.padding)
+            known = SegmentArray.from_segmentlist(segs.known)
+            active = SegmentArray.from_segmentlist(segs.active) & known
+            data.append(float(binned_livetime(active, self.span)[0]))
         if future:
             total = sum(data)
             alltime = abs(self.span)
@@ -1091,11 +1108,12 @@ class NetworkDutyPiePlot(SegmentPiePlot):
         networkflags = []
         colors = []
         labels = []
-        exclude = DataQualityFlag()
+        exclude = SegmentArray()
         for i in list(range(len(flags)+1))[::-1]:
             name = self.NETWORK_NAME[i]
             flag = '%s:%s' % (network, name)
-            networksegs = DataQualityFlag(flag, known=valid)
+            known = SegmentArray.from_segmentlist(valid)
+            active = SegmentArray()
             for ifoset in itertools.combinations(flags, i):
                 if not ifoset:
                     compound = '!%s' % '!'.join(flags.values())
@@ -1103,9 +1121,12 @@ class NetworkDutyPiePlot(SegmentPiePlot):
                     compound = '&'.join(flags[ifo] for ifo in ifoset)
                 segs = get_segments(compound, validity=valid, query=False,
                                     padding=self.padding).coalesce()
-                networksegs += segs
-            globalv.SEGMENTS[flag] = networksegs - exclude
-            exclude = networksegs
+                known |= SegmentArray.from_segmentlist(segs.known)
+                active |= SegmentArray.from_segmentlist(segs.active)
+            globalv.SEGMENTS[flag] = DataQualityFlag(
+                flag, known=known.to_segmentlist(),
+                active=(active - exclude).to_segmentlist())
+            exclude = active
             networkflags.append(flag)
             labels.append('%s interferometer' % name.title())
             colors.append(self.NETWORK_COLOR.get(name))
@@ -1190,10 +1211,13 @@ class SegmentBarPlot(BarPlot, SegmentDataPlot):
             else:
                 valid = SegmentList([self.span])
             segs = get_segments(flag, validity=valid, query=False,
-                                padding=self.padding).coalesce()
-            livetime = float(abs(segs.active))
+                                padding=self.padding)
+            known = SegmentArray.from_segmentlist(segs.known)
+            active = SegmentArray.from_segmentlist(segs.active) & known
+            livetime = float(binned_livetime(active, self.span)[0])
             if scale == 'percent':
-                data.append(100 * livetime / float(abs(segs.known)))
+                data.append(100 * livetime /
+                            float(binned_livetime(known, self.span)[0]))
             elif isinstance(scale, (float, int)):
                 data.append(livetime / scale)
 
@@ -28,17 +28,18 @@ from numpy import isinf
 from astropy.units import Quantity
 
 from gwpy.detector import (Channel, ChannelList)
+from gwpy.segments import (Segment, SegmentList)
 from gwpy.plotter import *
 from gwpy.plotter.table import get_column_string
 from gwpy.plotter.utils import (color_cycle, marker_cycle)
-from gwpy.table.rate import (event_rate, binned_event_rates)
 from gwpy.table.utils import get_table_column
 
 from .. import (globalv, version)
 from ..utils import re_cchar
-from ..data import (get_channel, get_timeseries, add_timeseries)
-from ..triggers import get_triggers
+from ..data import (get_channel, get_timeseries, get_pyramid_statistic)
+from ..triggers import (get_triggers, get_trigger_rates)
 from .registry import (get_plot, register_plot)
+from .utils import decimate_minmax
 
 __author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
 __version__ = version.version
@@ -132,6 +133,11 @@ class TriggerDataPlot(TriggerPlotMixin, TimeSeriesDataPlot):
             return super(TimeSeriesDataPlot, self).finalize(
                        outputfile=outputfile, close=close, **savekwargs)
 
+    def get_pyramid_keys(self):
+        """This plot is drawn from the full data, never from trends
+        """
+        return {}
+
     def process(self):
         # get columns
         xcolumn, ycolumn, ccolumn = self.columns
@@ -272,10 +278,9 @@ class TriggerDataPlot(TriggerPlotMixin, TimeSeriesDataPlot):
             plot.add_colorbar(ax=ax, visible=False)
 
         if len(self.channels) == 1 and len(table) and not no_loudest:
-            if ccolumn is None:
-                ax.add_loudest(table, ycolumn, xcolumn, ycolumn)
-            else:
-                ax.add_loudest(table, ccolumn, xcolumn, ycolumn)
+            rank = ccolumn is None and ycolumn or ccolumn
+            loudest = table[[get_table_column(table, rank).argmax()]]
+            ax.add_loudest(loudest.to_table(), rank, xcolumn, ycolumn)
 
         if len(self.channels) > 1:
             plot.add_legend(ax=ax, **legendargs)
@@ -297,12 +302,20 @@ class TriggerTimeSeriesDataPlot(TimeSeriesDataPlot):
     type = 'trigger-timeseries'
     data = 'triggers'
 
+    def get_pyramid_keys(self):
+        """This plot is drawn from the full data, never from trends
+        """
+        return {}
+
     def process(self):
         """Read in all necessary data, and generate the figure.
         """
         (plot, axes) = self.init_plot()
         ax = axes[0]
 
+        # time (seconds) spanned by one pixel
+        resolution = abs(self.span) / (plot.get_figwidth() * plot.dpi)
+
         # work out labels
         labels = self.pargs.pop('labels', self.channels)
         if isinstance(labels, (unicode, str)):
@@ -317,6 +330,7 @@ class TriggerTimeSeriesDataPlot(TimeSeriesDataPlot):
             else:
                 valid = SegmentList([self.span])
             data = get_timeseries(channel, valid, query=False)
+            stat = get_pyramid_statistic(channel)
             # handle no timeseries
             if not len(data):
                 ax.plot([0], [0], visible=False, label=label)
@@ -327,6 +341,8 @@ class TriggerTimeSeriesDataPlot(TimeSeriesDataPlot):
                 # double-check log scales
                 if self.pargs['logy']:
                     ts.value[ts.value == 0] = 1e-100
+                if self.decimate:
+                    ts = decimate_minmax(ts, resolution, stat)
                 if color is None:
                     line = ax.plot_timeseries(ts, label=label)[0]
                     color = line.get_color()
@@ -492,6 +508,11 @@ register_plot(TriggerHistogramPlot)
 
 class TriggerRateDataPlot(TimeSeriesDataPlot):
     """TimeSeriesDataPlot of trigger rate.
+
+    The rate in each stride is the number of triggers in the state of
+    this plot (or all triggers, for an ``all_data`` plot) divided by the
+    stride, so strides at the edges of the state, or of the plot, show
+    a proportionally lower rate.
     """
     type = 'trigger-rate'
     data = 'triggers'
@@ -511,6 +532,13 @@ class TriggerRateDataPlot(TimeSeriesDataPlot):
         super(TriggerRateDataPlot, self).__init__(*args, **kwargs)
         self.etg = self.pargs.pop('etg')
         self.column = self.pargs.pop('column')
+        self.stride = self.pargs.pop('stride')
+        if self.column:
+            self.bins = self.pargs.pop('bins')
+            self.operator = self.pargs.pop('operator', '>=')
+        else:
+            self.bins = ['_']
+            self.operator = '>='
 
     @property
     def pid(self):
@@ -527,18 +555,64 @@ class TriggerRateDataPlot(TimeSeriesDataPlot):
     def pid(self, id_):
         self._pid = str(id_)
 
+    def get_trigger_key(self, channel):
+        """Return the name under which triggers for a channel are stored
+        """
+        if '#' in str(channel) or '@' in str(channel):
+            return '%s,%s' % (str(channel),
+                              self.state and str(self.state) or 'All')
+        return str(channel)
+
+    def get_rates(self):
+        """Calculate the trigger rates for this plot
+
+        Rates are only calculated once for each channel, state, column,
+        bin and stride, and stored in `globalv.DATA`, see
+        :func:`~gwsumm.triggers.get_trigger_rates` for details
+
+        Returns
+        -------
+        keys : `list` of `str`
+            the `globalv.DATA` key of the rate `TimeSeries` for each
+            channel and bin
+        """
+        if self.state and not self.all_data:
+            state = self.state
+        else:
+            state = None
+        keys = []
+        for channel in self.channels:
+            keys.extend(get_trigger_rates(
+                self.get_trigger_key(channel), self.etg, self.stride,
+                self.span, state=state, column=self.column, bins=self.bins,
+                operator=self.operator))
+        return keys
+
+    def has_rates(self):
+        """Returns `True` if the rates for this plot are already held
+
+        Rates are held if they are stored for the whole span of the plot,
+        up to the current time, allowing for a final incomplete stride
+        """
+        end = min(self.end, globalv.NOW)
+        if end <= self.start:
+            return True
+        span = SegmentList([Segment(self.start, end)])
+        return all(abs(globalv.DATA.missing(key, span)) < self.stride for
+                   key in self.get_rates())
+
+    def get_pyramid_keys(self):
+        """This plot is drawn from the full data, never from trends
+        """
+        return {}
+
     def process(self):
         """Read in all necessary data, and generate the figure.
         """
-
-        # get rate arguments
-        stride = self.pargs.pop('stride')
         if self.column:
             cname = get_column_string(self.column)
-            bins = self.pargs.pop('bins')
-            operator = self.pargs.pop('operator', '>=')
-        else:
-            bins = ['_']
+        bins = self.bins
+        operator = self.operator
 
         # work out labels
         labels = self.pargs.pop('labels', None)
@@ -557,30 +631,7 @@ class TriggerRateDataPlot(TimeSeriesDataPlot):
         self.pargs['labels'] = map(lambda s: str(s).strip('\n '), labels)
 
         # generate data
-        keys = []
-        for channel in self.channels:
-            if self.state and not self.all_data:
-                valid = self.state.active
-            else:
-                valid = SegmentList([self.span])
-            if '#' in str(channel) or '@' in str(channel):
-                key = '%s,%s' % (str(channel), state and str(state) or 'All')
-            else:
-                key = str(channel)
-            table_ = get_triggers(key, self.etg, valid, query=False)
-            if self.column:
-                rates = binned_event_rates(
-                    table_, stride, self.column, bins, operator, self.start,
-                    self.end).values()
-            else:
-                rates = [event_rate(table_, stride, self.start, self.end)]
-            for bin, rate in zip(bins, rates):
-                rate.channel = channel
-                keys.append('%s_%s_EVENT_RATE_%s_%s'
-                            % (str(channel), str(self.etg),
-                               str(self.column), bin))
-                if keys[-1] not in globalv.DATA:
-                    add_timeseries(rate, keys[-1])
+        keys = self.get_rates()
 
         # reset channel lists and generate time-series plot
         channels = self.channels
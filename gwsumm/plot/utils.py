@@ -19,6 +19,8 @@
 """Utilies for GWSumm plotting
 """
 
+import numpy
+
 from gwpy.plotter.table import get_column_string
 
 from .. import version
@@ -44,3 +46,56 @@ def get_column_label(column):
         return COLUMN_LABEL.get(column)
     except KeyError:
         return get_column_string(column)
+
+
+def decimate_minmax(series, resolution, statistic=None):
+    """Reduce a `TimeSeries` to its min/max envelope for rendering
+
+    Each block of samples spanning one pixel column is replaced by two
+    samples, the minimum and maximum of that block, so that a line drawn
+    through the output covers the same pixels as one drawn through the
+    input. Blocks containing only NaN give NaN, so that gaps in the
+    data are kept.
+
+    Minimum and maximum trends are instead reduced to a single sample
+    per block, the minimum or maximum respectively, so that the
+    decimated trend still bounds the data from below or above.
+
+    Parameters
+    ----------
+    series : `~gwpy.timeseries.TimeSeries`
+        the data to decimate
+    resolution : `float`
+        time (seconds) spanned by one pixel column
+    statistic : `str`, optional
+        the trend statistic of the data, ``'min'`` or ``'max'`` to
+        keep only that extreme of each block, anything else (by default)
+        gives the full envelope
+
+    Returns
+    -------
+    envelope : `~gwpy.timeseries.TimeSeries`
+        the decimated data, or the input if it has no more than two
+        samples per pixel column (or one sample, for a min or max trend)
+    """
+    dt = float(series.dt.value)
+    width = int(resolution / dt)
+    if statistic in ('min', 'max'):
+        nout = 1
+        reducers = [statistic == 'min' and numpy.fmin or numpy.fmax]
+    else:
+        nout = 2
+        reducers = [numpy.fmin, numpy.fmax]
+    if width <= nout or series.size <= nout * width:
+        return series
+    nblocks = (series.size - 1) // width + 1
+    values = numpy.empty(nblocks * width, dtype=float)
+    values[:series.size] = series.value
+    values[series.size:] = numpy.nan
+    values = values.reshape(nblocks, width)
+    envelope = numpy.empty((nblocks, nout), dtype=float)
+    for i, reducer in enumerate(reducers):
+        envelope[:, i] = reducer.reduce(values, axis=1)
+    return type(series)(envelope.ravel(), epoch=series.x0.value,
+                        sample_rate=nout / (width * dt), unit=series.unit,
+                        name=series.name, channel=series.channel)
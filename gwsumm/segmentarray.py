@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Duncan Macleod (2013)
+#
+# This file is part of GWSumm.
+#
+# GWSumm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GWSumm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GWSumm.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Array-backed segment lists for fast segment algebra
+
+A `SegmentArray` holds a coalesced list of ``[start, end)`` segments as
+two sorted `numpy` arrays, so that union, intersection, difference and
+padding of lists with many thousands of segments are computed in a few
+vectorised operations, rather than one segment at a time.
+"""
+
+import operator
+
+import numpy
+
+from gwpy.segments import (Segment, SegmentList)
+
+from . import version
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+__version__ = version.version
+
+
+class SegmentArray(object):
+    """A coalesced list of ``[start, end)`` segments stored as arrays
+
+    Parameters
+    ----------
+    starts : `array-like`
+        GPS start times of segments
+    ends : `array-like`
+        GPS end times of segments
+    coalesced : `bool`, default: `False`
+        `True` if the input is already sorted and coalesced, to skip
+        that step
+    """
+    def __init__(self, starts=(), ends=(), coalesced=False):
+        starts = numpy.asarray(starts, dtype=float).ravel()
+        ends = numpy.asarray(ends, dtype=float).ravel()
+        if starts.shape != ends.shape:
+            raise ValueError("Cannot build SegmentArray from %d starts and "
+                             "%d ends" % (starts.size, ends.size))
+        if not coalesced:
+            starts, ends = self._coalesce(starts, ends)
+        self.starts = starts
+        self.ends = ends
+
+    @staticmethod
+    def _coalesce(starts, ends):
+        """Sort and merge overlapping or touching segments
+        """
+        keep = ends > starts
+        starts = starts[keep]
+        ends = ends[keep]
+        if starts.size < 2:
+            return starts, ends
+        order = numpy.argsort(starts, kind='mergesort')
+        starts = starts[order]
+        ends = numpy.maximum.accumulate(ends[order])
+        breaks = starts[1:] > ends[:-1]
+        return (starts[numpy.concatenate(([True], breaks))],
+                ends[numpy.concatenate((breaks, [True]))])
+
+    # -------------------------------------------------------------------------
+    # conversions
+
+    @classmethod
+    def from_segmentlist(cls, segments):
+        """Build a new `SegmentArray` from a list of segments
+        """
+        if isinstance(segments, cls):
+            return segments
+        segs = numpy.array([(float(s[0]), float(s[1])) for s in segments],
+                           dtype=float).reshape(-1, 2)
+        return cls(segs[:, 0], segs[:, 1])
+
+    def to_segmentlist(self):
+        """Return this `SegmentArray` as a `~gwpy.segments.SegmentList`
+        """
+        return SegmentList(Segment(s, e) for (s, e) in
+                           zip(self.starts.tolist(), self.ends.tolist()))
+
+    # -------------------------------------------------------------------------
+    # properties
+
+    def __len__(self):
+        return self.starts.size
+
+    def __nonzero__(self):
+        return bool(self.starts.size)
+
+    def __abs__(self):
+        return float((self.ends - self.starts).sum())
+
+    def __repr__(self):
+        return '<SegmentArray(%d segments)>' % len(self)
+
+    def extent(self):
+        """Return the single `Segment` enclosing all of these segments
+        """
+        if not len(self):
+            raise ValueError("empty list")
+        return Segment(self.starts[0], self.ends[-1])
+
+    def contains(self, times):
+        """Determine which times fall inside any of these segments
+
+        Parameters
+        ----------
+        times : `array-like`
+            GPS times to test
+
+        Returns
+        -------
+        mask : `numpy.ndarray`
+            boolean array, `True` for those times inside a segment
+        """
+        times = numpy.asarray(times, dtype=float)
+        idx = self.starts.searchsorted(times, side='right') - 1
+        inside = idx >= 0
+        inside[inside] = times[inside] < self.ends[idx[inside]]
+        return inside
+
+    # -------------------------------------------------------------------------
+    # algebra
+
+    def _combine(self, other, op):
+        """Combine this list with another using a boolean operator
+
+        The union of all segment boundaries splits time into elementary
+        intervals; each is tested for membership of either list, and
+        those passing ``op`` are joined into the output.
+        """
+        other = self.from_segmentlist(other)
+        edges = numpy.unique(numpy.concatenate(
+            (self.starts, self.ends, other.starts, other.ends)))
+        if edges.size < 2:
+            return type(self)()
+        left = edges[:-1]
+        mask = op(self.contains(left), other.contains(left))
+        return type(self)(left[mask], edges[1:][mask])
+
+    def __and__(self, other):
+        return self._combine(other, operator.and_)
+
+    def __or__(self, other):
+        other = self.from_segmentlist(other)
+        return type(self)(numpy.concatenate((self.starts, other.starts)),
+                          numpy.concatenate((self.ends, other.ends)))
+
+    def __sub__(self, other):
+        return self._combine(other, lambda a, b: a & ~b)
+
+    def __xor__(self, other):
+        return self._combine(other, operator.xor)
+
+    def __invert__(self):
+        return type(self)(numpy.concatenate(([-numpy.inf], self.ends)),
+                          numpy.concatenate((self.starts, [numpy.inf])))
+
+    def pad(self, start, end):
+        """Pad each segment, positive values pad forward in time
+
+        Parameters
+        ----------
+        start : `float`
+            padding to apply to the start of each segment
+        end : `float`
+            padding to apply to the end of each segment
+
+        Returns
+        -------
+        padded : `SegmentArray`
+            a new list of padded, coalesced, segments
+        """
+        return type(self)(self.starts + start, self.ends + end)
+
+
+# -----------------------------------------------------------------------------
+# livetime kernels
+
+def cumulative_livetime(segments, times):
+    """Calculate the total livetime of some segments before each time
+
+    Parameters
+    ----------
+    segments : `SegmentArray`, `~gwpy.segments.SegmentList`
+        segments whose livetime to count
+    times : `array-like`
+        GPS times at which to evaluate the cumulative livetime
+
+    Returns
+    -------
+    livetime : `numpy.ndarray`
+        the livetime (seconds) of ``segments`` in ``(-inf, t)`` for each
+        ``t`` in ``times``
+    """
+    segments = SegmentArray.from_segmentlist(segments)
+    times = numpy.asarray(times, dtype=float)
+    if not len(segments):
+        return numpy.zeros(times.shape)
+    cumdur = numpy.concatenate(([0.], numpy.cumsum(segments.ends -
+                                                   segments.starts)))
+    # number of segments starting before each time
+    idx = segments.starts.searchsorted(times, side='right')
+    # remove the part of the last segment after each time
+    last = numpy.maximum(idx - 1, 0)
+    overrun = numpy.clip(segments.ends[last] - times, 0, None)
+    return cumdur[idx] - numpy.where(idx > 0, overrun, 0.)
+
+
+def binned_livetime(segments, edges):
+    """Calculate the livetime of some segments in each of a set of bins
+
+    Parameters
+    ----------
+    segments : `SegmentArray`, `~gwpy.segments.SegmentList`
+        segments whose livetime to count
+    edges : `array-like`
+        GPS boundaries of ``N`` contiguous bins, of length ``N + 1``
+
+    Returns
+    -------
+    livetime : `numpy.ndarray`
+        the livetime (seconds) of ``segments`` inside each bin
+    """
+    return numpy.diff(cumulative_livetime(segments, edges))
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Duncan Macleod (2013)
+#
+# This file is part of GWSumm.
+#
+# GWSumm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GWSumm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GWSumm.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Persistent on-disk cache of segment-database query results
+
+The cache holds one JSON file per flag, in a sub-directory per segment
+database URL, recording the GPS spans already queried for that flag,
+and the known and active segments found.
+"""
+
+import os
+import json
+import fcntl
+import tempfile
+from contextlib import contextmanager
+from urllib import quote
+
+from gwpy.segments import (DataQualityFlag, DataQualityDict,
+                           Segment, SegmentList)
+
+from . import version
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+__version__ = version.version
+
+_CACHES = {}
+
+
+def _to_segmentlist(pairs):
+    return SegmentList(Segment(*pair) for pair in pairs).coalesce()
+
+
+def _from_segmentlist(segments):
+    return [[float(seg[0]), float(seg[1])] for seg in segments]
+
+
+class SegmentCache(object):
+    """Record of segments downloaded from a segment database
+
+    Each flag file may be shared between concurrent processes; all reads
+    and writes are serialised with an exclusive lock on a companion
+    ``<file>.lock`` file.
+
+    Parameters
+    ----------
+    directory : `str`
+        path of the cache directory
+    url : `str`, optional
+        URL of the segment database, defaults to the configured server
+    recent : `float`, optional
+        number of seconds before 'now' for which queried segments may
+        still change, these are always queried again, default: 3600
+    """
+    def __init__(self, directory, url=None, recent=3600):
+        self.url = url
+        self.recent = recent
+        self.directory = os.path.join(
+            os.path.abspath(os.path.expanduser(directory)),
+            quote(url or 'default', safe=''))
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:  # created by another process
+                if not os.path.isdir(self.directory):
+                    raise
+
+    def get_path(self, flag):
+        """Return the path of the cache file for the given flag
+        """
+        return os.path.join(self.directory,
+                            '%s.json' % quote(str(flag), safe=''))
+
+    @contextmanager
+    def lock(self, flag):
+        """Hold an exclusive lock on the cache file for a flag
+        """
+        with open('%s.lock' % self.get_path(flag), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read(self, flag):
+        try:
+            with open(self.get_path(flag), 'r') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return None
+        for key in ['queried', 'known', 'active']:
+            data[key] = _to_segmentlist(data.get(key, []))
+        return data
+
+    def _write(self, flag, data):
+        path = self.get_path(flag)
+        fd, tmp = tempfile.mkstemp(suffix='.json', dir=self.directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'flag': str(flag),
+                'description': data.get('description'),
+                'queried': _from_segmentlist(data['queried']),
+                'known': _from_segmentlist(data['known']),
+                'active': _from_segmentlist(data['active']),
+            }, f)
+        os.rename(tmp, path)
+
+    def read(self, flags, segments):
+        """Read the cached segments for some flags
+
+        Parameters
+        ----------
+        flags : `list` of `str`
+            the flags to read
+        segments : `~gwpy.segments.SegmentList`
+            the segments of interest
+
+        Returns
+        -------
+        cached : `~gwpy.segments.DataQualityDict`
+            the cached segments for each flag, restricted to ``segments``
+        covered : `~gwpy.segments.SegmentList`
+            the parts of ``segments`` already queried for all flags
+        """
+        segments = SegmentList(segments).coalesce()
+        out = DataQualityDict()
+        covered = segments
+        for flag in flags:
+            with self.lock(flag):
+                data = self._read(flag)
+            if data is None:
+                covered = SegmentList()
+                continue
+            covered = covered & data['queried']
+            out[flag] = DataQualityFlag(flag, known=data['known'] & segments,
+                                        active=data['active'] & segments)
+            out[flag].description = data.get('description')
+        return out, covered
+
+    def write(self, flags, segments, now):
+        """Record the result of a segment-database query
+
+        Parameters
+        ----------
+        flags : `~gwpy.segments.DataQualityDict`
+            the segments returned by the query
+        segments : `~gwpy.segments.SegmentList`
+            the segments queried
+        now : `int`
+            current GPS time, segments inside the recent window are stored
+            but not recorded as queried
+        """
+        segments = SegmentList(segments).coalesce()
+        final = segments - SegmentList([Segment(now - self.recent,
+                                                float('inf'))])
+        for name, flag in flags.iteritems():
+            with self.lock(name):
+                data = self._read(name) or {'queried': SegmentList(),
+                                            'known': SegmentList(),
+                                            'active': SegmentList()}
+                data['known'] = ((data['known'] - segments) |
+                                 (flag.known & segments)).coalesce()
+                data['active'] = ((data['active'] - segments) |
+                                  (flag.active & segments)).coalesce()
+                data['queried'] = (data['queried'] | final).coalesce()
+                if flag.description:
+                    data['description'] = str(flag.description)
+                self._write(name, data)
+
+
+def get_segment_cache(directory, url=None, recent=3600):
+    """Return the `SegmentCache` for the given directory and server
+    """
+    key = (os.path.abspath(os.path.expanduser(directory)), url)
+    try:
+        return _CACHES[key]
+    except KeyError:
+        _CACHES[key] = SegmentCache(directory, url=url, recent=recent)
+        return _CACHES[key]
@@ -21,6 +21,9 @@
 
 from __future__ import (division, print_function)
 import sys
+from math import ceil
+from threading import Lock
+from multiprocessing.pool import ThreadPool
 
 try:
     from configparser import (ConfigParser, NoSectionError, NoOptionError)
@@ -35,6 +38,8 @@ from gwpy.segments import (DataQualityFlag, DataQualityDict,
 
 from . import (globalv, version)
 from .config import DEFAULTSECT
+from .segmentarray import SegmentArray
+from .segmentcache import get_segment_cache
 from .utils import *
 
 __author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
@@ -46,6 +51,9 @@ SEGDB_URLS = [
     'https://geosegdb.atlas.aei.uni-hannover.de',
 ]
 
+# lock on recording new segments, queries may run in multiple threads
+_SEGMENTS_LOCK = Lock()
+
 
 def get_segments(flag, validity=None, config=ConfigParser(), cache=None,
                  query=True, return_=True, coalesce=True, padding=None,
@@ -102,11 +110,13 @@ def get_segments(flag, validity=None, config=ConfigParser(), cache=None,
     for f in allflags:
         globalv.SEGMENTS.setdefault(f, DataQualityFlag(f))
 
-    # read segments from global memory and get the union of needed times
+    # read segments from global memory and get the union of needed times,
+    # including those times already queried for which segments are unknown
     try:
-        old = reduce(operator.and_, (globalv.SEGMENTS.get(
-                                        f, DataQualityFlag(f)).known
-                                    for f in flags))
+        old = reduce(operator.and_, (
+            globalv.SEGMENTS.get(f, DataQualityFlag(f)).known |
+            globalv.QUERIED_SEGMENTS.get(f, SegmentList())
+            for f in allflags))
     except TypeError:
         old = SegmentList()
     newsegs = validity - old
@@ -116,6 +126,7 @@ def get_segments(flag, validity=None, config=ConfigParser(), cache=None,
     if cache is not None:
         query &= len(cache) != 0
     if query:
+        queried = True
         if cache is not None:
             try:
                 new = DataQualityDict.read(cache, list(allflags))
@@ -135,10 +146,6 @@ def get_segments(flag, validity=None, config=ConfigParser(), cache=None,
                        % (len(new[f].active), f,
                           float(abs(new[f].known))/float(abs(newsegs))*100))
         else:
-            if len(newsegs) >= 10:
-                qsegs = span
-            else:
-                qsegs = newsegs
             # parse configuration for query
             kwargs = {}
             if url is not None:
@@ -152,10 +159,29 @@ def get_segments(flag, validity=None, config=ConfigParser(), cache=None,
                 query_func = DataQualityDict.query_segdb
             else:
                 query_func = DataQualityDict.query_dqsegdb
+            # read segments already cached on disk
+            segcache = get_cache(config, url=kwargs.get('url', None))
+            if segcache is None:
+                cached = DataQualityDict()
+                todo = newsegs
+            else:
+                cached, covered = segcache.read(allflags, newsegs)
+                todo = newsegs - covered
+            if len(todo) >= 10 and segcache is None:
+                qsegs = span
+            elif len(todo) >= 10:
+                qsegs = SegmentList([todo.extent()])
+            else:
+                qsegs = todo
             try:
-                new = query_func(allflags, qsegs, on_error=segdb_error,
-                                 **kwargs)
+                if abs(qsegs):
+                    new = query_func(allflags, qsegs, on_error=segdb_error,
+                                     **kwargs)
+                else:
+                    new = DataQualityDict()
+                queried = True
             except Exception as e:
+                queried = False
                 # ignore error from SegDB
                 if segdb_error in ['ignore', None]:
                     pass
@@ -169,6 +195,19 @@ def get_segments(flag, validity=None, config=ConfigParser(), cache=None,
                 else:
                     raise
                 new = DataQualityDict()
+            # only cache those flags whose query succeeded, with
+            # on_error='warn' failed flags are returned with no known
+            # segments, and must be queried again next time
+            if segcache is not None and queried and abs(qsegs):
+                segcache.write(DataQualityDict(
+                    (f, new[f]) for f in new if
+                    abs(new[f].known & qsegs)), qsegs, globalv.NOW)
+            for f in cached:
+                if f in new:
+                    new[f].known |= cached[f].known
+                    new[f].active |= cached[f].active
+                else:
+                    new[f] = cached[f]
             for f in new:
                 new[f].known &= newsegs
                 new[f].active &= newsegs
@@ -178,43 +217,154 @@ def get_segments(flag, validity=None, config=ConfigParser(), cache=None,
                        % (len(new[f].active), f,
                           float(abs(new[f].known))/float(abs(newsegs))*100))
         # record new segments
-        globalv.SEGMENTS += new
-        for f in new:
-            globalv.SEGMENTS[f].description = str(new[f].description)
+        with _SEGMENTS_LOCK:
+            globalv.SEGMENTS += new
+            for f in new:
+                globalv.SEGMENTS[f].description = str(new[f].description)
+            if queried:
+                for f in allflags:
+                    globalv.QUERIED_SEGMENTS[f] = (
+                        globalv.QUERIED_SEGMENTS.get(f, SegmentList()) |
+                        newsegs).coalesce()
 
     # return what was asked for
     if return_:
+        valid = SegmentArray.from_segmentlist(validity)
         for compound in flags:
             union, intersection, exclude, notequal = split_compound_flag(
                 compound)
             if len(union + intersection) == 1:
+                f = (union + intersection)[0]
                 out[compound].description = globalv.SEGMENTS[f].description
                 out[compound].padding = padding.get(f, (0, 0))
+            # evaluate the compound flag using array-backed segment lists
+            known = active = valid
             for flist, op in zip([exclude, intersection, union, notequal],
-                                 [operator.sub, operator.and_, operator.or_,
-                                  not_equal]):
+                                 ['sub', 'and', 'or', 'ne']):
                 for f in flist:
+                    fknown = SegmentArray.from_segmentlist(
+                        globalv.SEGMENTS[f].known)
+                    factive = SegmentArray.from_segmentlist(
+                        globalv.SEGMENTS[f].active)
                     pad = padding.get(f, (0, 0))
-                    segs = globalv.SEGMENTS[f].copy()
                     if isinstance(pad, (float, int)):
-                        segs = segs.pad(pad, pad)
-                    elif pad is not None:
-                        segs = segs.pad(*pad)
+                        pad = (pad, pad)
+                    if pad is not None and tuple(pad) != (0, 0):
+                        fknown = fknown.pad(*pad)
+                        factive = factive.pad(*pad)
                     if coalesce:
-                        segs = segs.coalesce()
-                    out[compound] = op(out[compound], segs)
-                    out[compound].known &= segs.known
-                    out[compound].active &= segs.known
-            out[compound].known &= validity
-            out[compound].active &= validity
+                        factive &= fknown
+                    if op == 'sub':
+                        active -= factive
+                    elif op == 'and':
+                        known &= fknown
+                        active &= factive
+                    elif op == 'or':
+                        known |= fknown
+                        active |= factive
+                    else:
+                        known |= fknown
+                        active ^= factive
+                    known &= fknown
+                    active &= fknown
+            known &= valid
+            active &= valid
             if coalesce:
-                out[compound].coalesce()
+                active &= known
+            out[compound].known = known.to_segmentlist()
+            out[compound].active = active.to_segmentlist()
         if isinstance(flag, basestring):
             return out[flag]
         else:
             return out
 
 
+def prefetch_segments(requests, config=ConfigParser(), segdb_error='raise',
+                      nproc=None, **kwargs):
+    """Query segments for many flags in as few requests as possible
+
+    For each segment database, a single query is made for all flags,
+    covering the union of the validity segments requested for each. The
+    results are recorded in global memory, so that subsequent calls to
+    :func:`get_segments` need not query again.
+
+    Parameters
+    ----------
+    requests : `dict`
+        a (url, `dict`) pair for each segment database to query, giving
+        the (flag, validity `SegmentList`) to query from that server, use
+        `None` as the url for the server given in the configuration
+    config : `~gwsumm.config.GWSummConfigParser`, optional
+        job configuration
+    segdb_error : `str`, optional
+        how to handle errors from the segment database, see
+        :func:`get_segments`
+    nproc : `int`, optional
+        number of queries to run concurrently, defaults to the
+        ``[segment-database] concurrency`` option, or 1, flags for a
+        single server are split into separate queries to fill the available
+        concurrency
+    **kwargs
+        other keyword arguments are passed to :func:`get_segments`
+    """
+    if nproc is None:
+        try:
+            nproc = config.getint('segment-database', 'concurrency')
+        except (NoSectionError, NoOptionError):
+            nproc = 1
+    requests = dict((url, flags) for url, flags in requests.iteritems() if
+                    flags)
+    if not requests:
+        return
+    nsplit = max(int(ceil(nproc / len(requests))), 1)
+    jobs = []
+    for url, flags in requests.iteritems():
+        validity = reduce(operator.or_, flags.values()).coalesce()
+        flags = sorted(flags)
+        for i in range(min(nsplit, len(flags))):
+            jobs.append((flags[i::nsplit], validity, url))
+    vprint("Querying segments for %d flags in %d requests...\n"
+           % (sum(len(j[0]) for j in jobs), len(jobs)))
+
+    def _query(job):
+        flags, validity, url = job
+        get_segments(flags, validity, config=config, url=url,
+                     segdb_error=segdb_error, return_=False, **kwargs)
+
+    if nproc > 1 and len(jobs) > 1:
+        pool = ThreadPool(min(nproc, len(jobs)))
+        try:
+            pool.map(_query, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        map(_query, jobs)
+
+
+def get_cache(config=ConfigParser(), url=None):
+    """Return the on-disk segment cache configured for this job
+
+    The cache is configured via the ``cache-directory`` and
+    ``cache-recent-window`` options of the ``[segment-database]`` section.
+
+    Returns
+    -------
+    cache : `~gwsumm.segmentcache.SegmentCache`, `None`
+        the cache for the given segment database, or `None` if no cache
+        is configured
+    """
+    try:
+        directory = config.get('segment-database', 'cache-directory')
+    except (NoSectionError, NoOptionError):
+        return None
+    try:
+        recent = config.getfloat('segment-database', 'cache-recent-window')
+    except (NoSectionError, NoOptionError):
+        recent = 3600
+    return get_segment_cache(directory, url=url, recent=recent)
+
+
 def not_equal(a, b, f):
     diff1 = a - b
     diff2 = b - a
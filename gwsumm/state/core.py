@@ -31,8 +31,9 @@ from gwpy.time import (to_gps, from_gps)
 
 from .. import globalv
 from ..config import (GWSummConfigParser, NoOptionError, DEFAULTSECT)
-from ..utils import re_cchar
+from ..utils import (re_cchar, re_flagdiv)
 from ..segments import get_segments
+from ..segmentarray import SegmentArray
 from ..data import get_timeseries
 
 MATHOPS = {
@@ -243,6 +244,21 @@ class SummaryState(DataQualityFlag):
         else:
             return cls(name, known=[(start, end)], hours=hours, **params)
 
+    def get_segment_flags(self):
+        """Return the list of flags to query to define this state
+
+        Returns
+        -------
+        flags : `list` of `str`
+            the data-quality flags in the definition of this state, or an
+            empty list if this state is ready, or is not defined by
+            segments from the segment database
+        """
+        if (self.ready or not self.definition or self.filename or
+                re.search('(%s)' % '|'.join(MATHOPS.keys()), self.definition)):
+            return []
+        return [f for f in re_flagdiv.split(self.definition)[::2] if f]
+
     def _fetch_segments(self, config=GWSummConfigParser(), **kwargs):
         kwargs.setdefault('url', self.url)
         segs = get_segments([self.definition], self.known, config=config,
@@ -270,8 +286,11 @@ class SummaryState(DataQualityFlag):
         if segs.active and not segs.known:
             segs.known = type(segs.active)(segs.active)
         if self.known:
-            self.known = self.known & segs.known
-            self.active = self.known & segs.active
+            known = (SegmentArray.from_segmentlist(self.known) &
+                     SegmentArray.from_segmentlist(segs.known))
+            self.known = known.to_segmentlist()
+            self.active = (known & SegmentArray.from_segmentlist(
+                segs.active)).to_segmentlist()
         else:
             self.known = segs.known
             self.active = segs.active
@@ -324,8 +343,11 @@ class SummaryState(DataQualityFlag):
                     segs_.append(Segment(t + h0 * 3600, t + h1*3600))
                 # increment and return
                 d += datetime.timedelta(1)
-            self.known &= segs_
-            self.active &= segs_
+            segs_ = SegmentArray.from_segmentlist(segs_)
+            self.known = (SegmentArray.from_segmentlist(self.known) &
+                          segs_).to_segmentlist()
+            self.active = (SegmentArray.from_segmentlist(self.active) &
+                           segs_).to_segmentlist()
         # FIXME
         self.ready = True
         return self
@@ -27,9 +27,6 @@ import getpass
 import re
 
 from copy import copy
-from multiprocessing import (Process, Queue)
-from multiprocessing.queues import Empty
-from time import sleep
 from StringIO import StringIO
 from datetime import timedelta
 
@@ -37,7 +34,7 @@ from numpy import isclose
 
 from astropy.time import Time
 
-from gwpy.segments import DataQualityFlag
+from gwpy.segments import (DataQualityFlag, Segment, SegmentList)
 
 from .. import (version, globalv, html)
 from ..config import *
@@ -45,10 +42,12 @@ from ..mode import (get_mode, MODE_ENUM)
 from ..data import (get_channel, get_timeseries_dict, get_spectrograms,
                     get_spectrum)
 from ..plot import get_plot
-from ..segments import get_segments
+from ..plot.core import index_store_keys
+from ..plot.pool import PlotPool
+from ..segments import (get_segments, prefetch_segments)
 from ..state import (generate_all_state, ALLSTATE, SummaryState, get_state)
 from ..triggers import get_triggers
-from ..utils import (re_cchar, re_channel, re_flagdiv, vprint, count_free_cores)
+from ..utils import (re_cchar, re_channel, re_flagdiv, vprint)
 
 from .registry import (get_tab, register_tab)
 
@@ -340,38 +339,53 @@ class DataTab(DataTabBase):
         except ValueError:
             allstate = generate_all_state(self.start, self.end)
         allstate.fetch(config=config)
-        # shortcut segment query for each state
-        #alldefs = {}
-        #for state in self.states:
-        #    if state.name == ALLSTATE or state.ready or not state.definition:
-        #        continue
-        #    try:
-        #        alldefs[state.url].append(state)
-        #    except KeyError:
-        #        alldefs[state.url] = [state]
-        #for url,states_ in alldefs.iteritems():
-        #    allvalid = reduce(operator.or_,
-        #                      [state.known for state in states_])
-        #    defs = [s.definition for s in states_]
-        #    get_segments(defs, allvalid, config=config, url=url#,
-        #                 segdb_error=segdb_error, return_=False, **kwargs)
+        # shortcut segment query for all states
+        prefetch_segments(self.get_segment_requests(flags=False),
+                          config=config, segdb_error=segdb_error)
         # individually double-check, set ready condition
         for state in self.states:
             state.fetch(config=config, segdb_error=segdb_error, **kwargs)
 
-    def process(self, config=ConfigParser(), multiprocess=True, **stateargs):
+    def process(self, config=ConfigParser(), multiprocess=True,
+                plotpool=None, **stateargs):
         """Process data for this `StateTab`.
 
         Parameters
         ----------
         config : `ConfigParser.ConfigParser`, optional
             job configuration to pass to :math:`~StateTab.finalize_states`
+        multiprocess : `bool`, `int`, optional
+            use multiple processes to read data and make plots. If `True`
+            use all cores on host, otherwise give an `int` to manually
+            select the number of cores to use.
+        plotpool : `~gwsumm.plot.pool.PlotPool`, optional
+            pool in which to render plots, shared with other tabs, this
+            method returns before these plots are finished. If not given
+            and ``multiprocess`` is set, a new pool is started for this
+            tab, and all plots are finished before this method returns
         **stateargs
             all other keyword arguments are passed directly onto the
             :meth:`~StateTab.process_state` method.
         """
         if self.ismeta:
             return
+        if (plotpool is None and multiprocess and not self.noplots and
+                any(p.new for p in self.plots + self.subplots)):
+            ownpool = plotpool = PlotPool(multiprocess)
+        else:
+            ownpool = None
+        try:
+            self._process(config=config, multiprocess=multiprocess,
+                          plotpool=plotpool, **stateargs)
+        finally:
+            if ownpool is not None:
+                ownpool.close()
+            elif plotpool is not None:
+                plotpool.release()
+
+    def _process(self, config=ConfigParser(), **stateargs):
+        """Process data for each state of this `StateTab`
+        """
         config = GWSummConfigParser.from_configparser(config)
         # load state segments
         self.finalize_states(
@@ -382,8 +396,7 @@ class DataTab(DataTabBase):
         # pre-process requests for 'all-data' plots
         all_data = any([(p.all_data & p.new) for p in self.plots])
         if all_data:
-            self.process_state(None, config=config, multiprocess=multiprocess,
-                               **stateargs)
+            self.process_state(None, config=config, **stateargs)
         # process each state
         for state in sorted(self.states, key=lambda s: abs(s.active),
                             reverse=True):
@@ -391,14 +404,14 @@ class DataTab(DataTabBase):
                 vprint("Processing '%s' state\n" % state.name)
             else:
                 vprint("Pre-processing all-data requests\n")
-            self.process_state(state, config=config, multiprocess=multiprocess,
-                               **stateargs)
+            self.process_state(state, config=config, **stateargs)
 
 
     def process_state(self, state, nds='guess', multiprocess=True,
                       config=GWSummConfigParser(), datacache=None,
                       trigcache=None, segmentcache=None,
-                      segdb_error='raise', datafind_error='raise'):
+                      segdb_error='raise', datafind_error='raise',
+                      plotpool=None):
         """Process data for this tab in a given state
 
         Parameters
@@ -426,6 +439,12 @@ class DataTab(DataTabBase):
             if ``'raise'``: raise exceptions when the segment database
             reports exceptions, if ``'warn''`, print warnings but continue,
             otherwise ``'ignore'`` them completely and carry on.
+        plotpool : `~gwsumm.plot.pool.PlotPool`, optional
+            pool in which to render plots, these are held back from the
+            workers until :meth:`~gwsumm.plot.pool.PlotPool.release` is
+            called. If not given and ``multiprocess`` is set, a new pool
+            is started, and all plots are finished before this method
+            returns
         """
         if state:
             all_data = False
@@ -529,13 +548,17 @@ class DataTab(DataTabBase):
         # --------------------------------------------------------------------
         # process triggers
 
-        for etg, channel in self.get_triggers('triggers',
-                                              'trigger-timeseries',
-                                              'trigger-rate',
-                                              'trigger-histogram',
-                                              all_data=all_data):
+        # rate plots need no triggers if their rates are already held,
+        # e.g. read from archives
+        trigs = set(self.get_triggers('triggers', 'trigger-timeseries',
+                                      'trigger-histogram', all_data=all_data))
+        for plot in self.plots:
+            if (plot.type == 'trigger-rate' and plot.new and
+                    plot.all_data == all_data and not plot.has_rates()):
+                trigs.update((plot.etg, c) for c in plot.channels)
+        for etg, channel in sorted(trigs, key=lambda ch: ch[1].name):
             get_triggers(channel, etg, state.active, config=config,
-                         cache=trigcache)
+                         cache=trigcache, multiprocess=multiprocess)
 
         # --------------------------------------------------------------------
         # make plots
@@ -550,22 +573,21 @@ class DataTab(DataTabBase):
         new_plots = [p for p in self.plots + self.subplots if
                      p.new and (p.state is None or p.state.name == state.name)]
 
-        # setup plotting queue
-        if multiprocess:
-            queue = Queue()
+        # threadsafe plots are rendered by the given pool, while the
+        # next state (or tab) is processed
+        if plotpool is not None:
+            pool = plotpool
+        elif multiprocess:
+            pool = PlotPool(multiprocess)
         else:
-            queue = None
+            pool = None
+
+        # index the stored data once, to find the inputs of each plot
+        if globalv.INCREMENTAL or pool is not None:
+            storekeys = index_store_keys()
+        else:
+            storekeys = None
 
-        # setup plotting processes
-        if queue:
-            def process_image(q):
-                while True:
-                    try:
-                        plot = q.get(block=False)
-                    except Empty:
-                        break
-                    else:
-                        plot.process()
         # process each one
         nproc = 0
         for plot in sorted(new_plots, key=lambda p: p._threadsafe and 1 or 2):
@@ -573,34 +595,26 @@ class DataTab(DataTabBase):
             if plot.outputfile in globalv.WRITTEN_PLOTS:
                 continue
             globalv.WRITTEN_PLOTS.append(plot.outputfile)
-            # queue plot for multiprocessing
-            if queue and plot._threadsafe:
-                queue.put(plot)
+            # skip plots whose input data haven't changed since last written
+            if globalv.INCREMENTAL and plot.is_current(storekeys):
+                vprint("        %s unchanged\n" % plot.outputfile)
+                continue
+            # send plot to the pool
+            if pool is not None and plot._threadsafe:
+                pool.submit(plot, storekeys, hold=True)
                 nproc += 1
             # process plot now
             else:
                 plot.process()
 
-        # if a single multi-processed figure, just run it in this process
-        if nproc == 1:
-            queue.get().process()
-        # otherwise execute all processes and wait
-        elif nproc > 1:
-            # actually execute all processes
-            procs = []
-            for i in range(min(nproc, multiprocess)):
-                procs.append(Process(target=process_image, args=(queue,)))
-                procs[-1].daemon = True
-                procs[-1].start()
-            vprint("        %d plot processes executed in %d processes.\n"
-                   % (nproc, len(procs)))
-            vprint("        Waiting for plotting to complete... ")
-            queue.close()
-            sleep(2)
-            # wait for children to finish
-            for p in procs:
-                p.join()
-            vprint("Done.\n")
+        if nproc:
+            vprint("        %d plots queued for processing in %d processes.\n"
+                   % (nproc, pool.nproc))
+        # wait for the plots from our own pool
+        if pool is not None and plotpool is None:
+            pool.close()
+        elif pool is not None:
+            pool.collect()
 
     # -------------------------------------------------------------------------
     # HTML operations
@@ -842,6 +856,8 @@ class DataTab(DataTabBase):
             `list` of plot data type strings whose channel sets to return
         new : `bool`, default: `True`
             only include plots whose 'new' attribute is True
+        all_types : `bool`, default: `False`
+            return channels for plots of all types, ignoring ``types``
 
         Returns
         -------
@@ -849,9 +865,10 @@ class DataTab(DataTabBase):
             an alphabetically-sorted `list` of channels
         """
         isnew = kwargs.pop('new', True)
+        alltypes = kwargs.pop('all_types', False)
         out = set()
         for plot in self.plots:
-            if not plot.data in types:
+            if not alltypes and not plot.data in types:
                 continue
             if isnew and not plot.new:
                 continue
@@ -903,6 +920,39 @@ class DataTab(DataTabBase):
                 out.update(plot.flags)
         return sorted(out, key=lambda dqf: str(dqf))
 
+    def get_segment_requests(self, states=True, flags=True):
+        """Return the segment-database queries needed to process this tab
+
+        Parameters
+        ----------
+        states : `bool`, default: `True`
+            include the flags defining each state
+        flags : `bool`, default: `True`
+            include the flags required for plots
+
+        Returns
+        -------
+        requests : `dict`
+            a (url, `dict`) pair for each segment database, giving the
+            (flag, validity `SegmentList`) to query from that server,
+            suitable for :func:`~gwsumm.segments.prefetch_segments`
+        """
+        out = {}
+        if states:
+            for state in self.states:
+                for flag in state.get_segment_flags():
+                    out.setdefault(state.url, {}).setdefault(
+                        flag, SegmentList()).extend(state.known)
+        if flags:
+            span = SegmentList([Segment(self.start, self.end)])
+            for flag in set(self.get_flags('segments') +
+                            self.get_flags('timeseries', type='time-volume') +
+                            self.get_flags('spectrogram',
+                                           type='strain-time-volume')):
+                out.setdefault(None, {}).setdefault(
+                    flag, SegmentList()).extend(span)
+        return out
+
     def get_triggers(self, *types, **kwargs):
         """Return the `set` of data-quality flags required for plots of the
         given ``types``.
@@ -34,6 +34,7 @@ from ..config import NoOptionError
 from ..data import get_channel
 from ..state import (get_state, ALLSTATE)
 from ..triggers import (get_etg_table, get_triggers, register_etg_table)
+from ..triggerarray import find_loudest
 from ..utils import re_quote
 from ..mode import (get_mode, MODE_ENUM)
 from .registry import (get_tab, register_tab)
@@ -323,25 +324,20 @@ class EventTriggerTab(get_tab('default')):
                     date = True
                 else:
                     date = False
+                # find loudest events for all rank columns at once
+                ranks = [get_table_column(table, rank) for
+                         rank in self.loudest['rank']]
+                loudidx = find_loudest(table.get_time(), ranks,
+                                       self.loudest['N'], self.loudest['dt'])
                 # loop over rank columns
-                for rank in self.loudest['rank']:
+                for rank, idx in zip(self.loudest['rank'], loudidx):
                     try:
                         rankstr = self.loudest['labels'][
                             self.loudest['columns'].index(rank)]
                     except ValueError:
                         rankstr = repr(rank)
                     page.h3('Loudest events by %s' % rankstr)
-                    rank = get_table_column(table, rank).argsort()[::-1]
-                    loudest = []
-                    i = 0
-                    while len(loudest) < self.loudest['N'] and i < rank.size:
-                        t = table[rank[i]]
-                        if i == 0 or all([
-                                abs(float(get_row_value(t, 'time')) -
-                                    float(get_row_value(t2, 'time'))) >=
-                                self.loudest['dt'] for t2 in loudest]):
-                            loudest.append(t)
-                        i += 1
+                    loudest = table[idx].to_table()
                     data = []
                     for row in loudest:
                         data.append([])
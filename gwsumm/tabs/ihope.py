@@ -35,8 +35,9 @@ from gwpy.plotter.table import (get_table_column, get_row_value)
 
 from .. import (version, html, globalv)
 from ..config import (GWSummConfigParser, NoOptionError, DEFAULTSECT)
-from ..data import find_cache_segments
+from ..data import (find_cache_segments, add_timeseries)
 from ..triggers import (get_triggers, register_etg_table)
+from ..triggerarray import find_loudest
 from ..utils import re_quote
 from ..state import SummaryState
 from ..mode import (get_mode, MODE_ENUM)
@@ -159,20 +160,14 @@ class DailyAhopeTab(base):
             if rangedata:
                 dt = float(abs(segcache[0].segment))
                 epoch = segcache[0].segment[0] + dt/2.
-                globalv.DATA[rangechannel].append(
-                    TimeSeries(rangedata, sample_rate=1/dt, epoch=epoch,
-                               name=rangechannel))
-                try:
-                    globalv.DATA[rangechannel].coalesce()
-                except ValueError:
-                    pass
-                globalv.DATA[sizechannel].append(
-                    TimeSeries(sizedata, sample_rate=1/dt, epoch=epoch,
-                               name=sizechannel))
-                try:
-                    globalv.DATA[sizechannel].coalesce()
-                except ValueError:
-                    pass
+                for key, data in [(rangechannel, rangedata),
+                                  (sizechannel, sizedata)]:
+                    ts = TimeSeries(data, sample_rate=1/dt, epoch=epoch,
+                                    name=key)
+                    try:
+                        add_timeseries(ts, key=key)
+                    except ValueError:
+                        add_timeseries(ts, key=key, coalesce=False)
 
     def process(self, *args, **kwargs):
         # read the segment files
@@ -220,14 +215,15 @@ class DailyAhopeTab(base):
 
     def process_state(self, state, nds='guess', multiprocess=False,
                       config=GWSummConfigParser(),
-                      segdb_error='raise', trigcache=None, datacache=None):
+                      segdb_error='raise', trigcache=None, datacache=None,
+                      plotpool=None):
         if trigcache is None:
             trigcache = self.inspiralcache
         if datacache is None:
             datacache = Cache()
         super(DailyAhopeTab, self).process_state(
             state, nds=nds, multiprocess=multiprocess, config=config,
-            datacache=datacache, trigcache=trigcache)
+            datacache=datacache, trigcache=trigcache, plotpool=plotpool)
 
     def write_state_html(self, state):
         """Write the '#main' HTML content for this `DailyAhopeTab`.
@@ -282,17 +278,11 @@ class DailyAhopeTab(base):
             if self.loudest:
                 table = get_triggers(self.channel, self.plots[0].etg, state,
                                      query=False)
-                rank = get_table_column(
-                    table, self.loudest['rank']).argsort()[::-1]
-                loudest = []
-                i = 0
-                while len(loudest) < self.loudest['N'] and i < rank.size:
-                    t = table[rank[i]]
-                    if i == 0 or all([abs(float(t.get_end()) -
-                                          float(t2.get_end())) >=
-                                      self.loudest['dt'] for t2 in loudest]):
-                        loudest.append(t)
-                    i += 1
+                idx = find_loudest(table.get_time(),
+                                   get_table_column(table,
+                                                    self.loudest['rank']),
+                                   self.loudest['N'], self.loudest['dt'])
+                loudest = table[idx].to_table()
                 page.h1('Loudest events')
                 page.p('The following table displays the %d loudest events as '
                        'recorded by Daily Ahope (with at least %s-second '
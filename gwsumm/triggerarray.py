@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Duncan Macleod (2013)
+#
+# This file is part of GWSumm.
+#
+# GWSumm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GWSumm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GWSumm.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Columnar storage of event triggers
+
+A `TriggerArray` holds the events for a single channel and ETG as one
+`numpy` structured array, sorted by time, so that selecting the events
+inside a list of segments is a handful of binary searches rather than
+a loop over LIGO_LW row objects. A LIGO_LW table is only built on
+request, via :meth:`TriggerArray.to_table`, for those plotting methods
+that need one.
+"""
+
+import operator as _operator
+
+import numpy
+
+from glue.ligolw.types import ToNumPyType
+
+from gwpy.segments import SegmentList
+from gwpy.table import lsctables
+from gwpy.table.utils import (TIME_COLUMN, get_table_column)
+
+from . import version
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+__version__ = version.version
+
+OPERATORS = {'<': _operator.lt, '<=': _operator.le, '=': _operator.eq,
+             '>=': _operator.ge, '>': _operator.gt, '==': _operator.eq,
+             '!=': _operator.ne}
+
+
+def get_column_dtype(tableclass, columns=None):
+    """Build the `numpy.dtype` used to store columns of the given table
+
+    Parameters
+    ----------
+    tableclass : `type`
+        the LIGO_LW table class
+    columns : `list` of `str`, optional
+        the columns to store, defaults to all valid columns of the table
+
+    Returns
+    -------
+    dtype : `numpy.dtype`
+        a structured dtype with one field per column; columns without a
+        numerical LIGO_LW type are stored as objects
+    """
+    if columns is None:
+        columns = tableclass.validcolumns.keys()
+    fields = []
+    for column in columns:
+        column = str(column)
+        if column in [f[0] for f in fields]:
+            continue
+        ltype = tableclass.validcolumns.get(column, None)
+        fields.append((column, ToNumPyType.get(ltype, object)))
+    return numpy.dtype(fields)
+
+
+def get_time_columns(tableclass):
+    """Return the ``(seconds, nanoseconds)`` columns giving event times
+
+    Returns `None` if the times for this table cannot be given by
+    two columns
+    """
+    return TIME_COLUMN.get(tableclass.tableName, None)
+
+
+class TriggerArray(object):
+    """A time-sorted, columnar array of event triggers
+
+    Parameters
+    ----------
+    tableclass : `type`
+        the LIGO_LW table class these triggers were read as
+    columns : `list` of `str`, optional
+        the columns to store, defaults to all valid columns of the table
+    data : `numpy.ndarray`, optional
+        structured array of column data, must be sorted by time
+    times : `numpy.ndarray`, optional
+        array of event times matching ``data``
+    segments : `~gwpy.segments.SegmentList`, optional
+        the segments over which these triggers were read
+
+    Notes
+    -----
+    Columns other than those stored, for example the ``peak`` time of a
+    ``sngl_burst`` event, or those given by a ``get_<column>`` method of
+    the table class, are computed on first access by
+    :meth:`~TriggerArray.get_column` and cached for later calls.
+    """
+    def __init__(self, tableclass, columns=None, data=None, times=None,
+                 segments=None):
+        self.tableclass = tableclass
+        if data is None:
+            data = numpy.zeros(0, dtype=get_column_dtype(tableclass, columns))
+        if times is None:
+            times = numpy.zeros(len(data), dtype=float)
+        self.data = data
+        self.times = times
+        self.segments = SegmentList(segments or [])
+        self.channel = None
+        self.etg = None
+        self._columns = {}
+
+    # -------------------------------------------------------------------------
+    # conversions
+
+    @classmethod
+    def from_table(cls, table, columns=None):
+        """Build a new `TriggerArray` from a LIGO_LW table
+
+        Parameters
+        ----------
+        table : :class:`~glue.ligolw.table.Table`
+            the table of events to convert
+        columns : `list` of `str`, optional
+            the columns to store, defaults to all columns in the table
+
+        Returns
+        -------
+        array : `TriggerArray`
+            a new array of events sorted by time
+        """
+        tableclass = type(table)
+        if columns is None:
+            columns = table.columnnames
+        dtype = get_column_dtype(tableclass, columns)
+        data = numpy.zeros(len(table), dtype=dtype)
+        for column in dtype.names:
+            if column not in table.columnnames:
+                continue
+            values = list(table.getColumnByName(column))
+            try:
+                data[column] = values
+            except (TypeError, ValueError):
+                data[column] = numpy.array(values, dtype=object)
+        times = cls._get_times(tableclass, data)
+        if times is None:
+            times = get_table_column(table, 'time').astype(float)
+        order = numpy.argsort(times, kind='mergesort')
+        out = cls(tableclass, data=data[order], times=times[order],
+                  segments=getattr(table, 'segments', None))
+        out.channel = getattr(table, 'channel', None)
+        out.etg = getattr(table, 'etg', None)
+        return out
+
+    @staticmethod
+    def _get_times(tableclass, data):
+        """Calculate event times from the stored columns, if possible
+        """
+        tcols = get_time_columns(tableclass)
+        if tcols is None or not all(c in data.dtype.names for c in tcols):
+            return None
+        return (data[tcols[0]].astype(float) +
+                data[tcols[1]].astype(float) * 1e-9)
+
+    def to_table(self):
+        """Return these triggers as a LIGO_LW table
+
+        Returns
+        -------
+        table : :class:`~glue.ligolw.table.Table`
+            a new table of the same type as was read, containing the
+            stored columns only
+        """
+        names = list(self.data.dtype.names)
+        out = lsctables.New(self.tableclass, columns=names)
+        RowType = out.RowType
+        append = out.append
+        columns = [(name, self.data[name].tolist()) for name in names]
+        for i in xrange(len(self)):
+            row = RowType()
+            for name, values in columns:
+                setattr(row, name, values[i])
+            append(row)
+        out.segments = SegmentList(self.segments)
+        out.channel = self.channel
+        out.etg = self.etg
+        return out
+
+    # -------------------------------------------------------------------------
+    # properties
+
+    @property
+    def tableName(self):
+        return self.tableclass.tableName
+
+    @property
+    def columnnames(self):
+        """List of stored column names
+        """
+        return list(self.data.dtype.names)
+
+    def __len__(self):
+        return self.data.size
+
+    def __repr__(self):
+        return '<TriggerArray(%d events, %s)>' % (len(self),
+                                                  self.tableclass.__name__)
+
+    def __iter__(self):
+        return iter(self.to_table())
+
+    def __getitem__(self, item):
+        """Return a single row, or a new `TriggerArray` of many rows
+
+        An integer index returns a LIGO_LW row object, anything else
+        (slice, index array or boolean mask) returns a `TriggerArray`
+        """
+        if isinstance(item, (int, long, numpy.integer)):
+            if item < 0:
+                item += len(self)
+            return self[item:item+1].to_table()[0]
+        out = type(self)(self.tableclass, data=self.data[item],
+                         times=self.times[item], segments=self.segments)
+        out.channel = self.channel
+        out.etg = self.etg
+        for key, column in self._columns.iteritems():
+            out._columns[key] = column[item]
+        return out
+
+    def copy(self):
+        """Return a copy of this `TriggerArray`
+        """
+        return self[numpy.arange(len(self))]
+
+    # -------------------------------------------------------------------------
+    # column access
+
+    def get_time(self):
+        """Return the array of event times
+        """
+        return self.times
+
+    def get_column(self, column):
+        """Return the array of data for the given column
+
+        Parameters
+        ----------
+        column : `str`
+            name of column, either stored, or of the form ``'peak'``
+            where ``'peak_time'`` and ``'peak_time_ns'`` are stored
+
+        Returns
+        -------
+        array : `numpy.ndarray`
+            the column data for these triggers
+
+        Raises
+        ------
+        KeyError
+            if the column cannot be found or calculated
+        """
+        column = str(column).lower()
+        if column == 'time':
+            return self.times
+        if column in self.data.dtype.names:
+            return self.data[column]
+        try:
+            return self._columns[column]
+        except KeyError:
+            sec = '%s_time' % column
+            nsec = '%s_time_ns' % column
+            names = self.data.dtype.names
+            if sec in names and nsec in names:
+                self._columns[column] = (self.data[sec].astype(float) +
+                                         self.data[nsec].astype(float) * 1e-9)
+            elif hasattr(self.tableclass, 'get_%s' % column):
+                table = self.to_table()
+                self._columns[column] = numpy.asarray(
+                    getattr(table, 'get_%s' % column)())
+            else:
+                raise KeyError("No column %r stored for these triggers"
+                               % column)
+            return self._columns[column]
+
+    # -------------------------------------------------------------------------
+    # selection
+
+    def select(self, segments):
+        """Return those triggers whose times lie within the segments
+
+        Parameters
+        ----------
+        segments : `~gwpy.segments.SegmentList`
+            list of ``[start, end)`` segments to select
+
+        Returns
+        -------
+        triggers : `TriggerArray`
+            a new array of triggers, with ``segments`` set to the
+            intersection of the input and those already read
+        """
+        segments = SegmentList(segments).coalesce()
+        bounds = numpy.array([(float(s[0]), float(s[1])) for s in segments],
+                             dtype=float).reshape(-1, 2)
+        idx = self.times.searchsorted(bounds.ravel(), side='left')
+        if idx.size == 2:
+            out = self[idx[0]:idx[1]]
+        else:
+            out = self[numpy.concatenate(
+                [numpy.arange(a, b) for (a, b) in idx.reshape(-1, 2)] or
+                [numpy.zeros(0, dtype=int)])]
+        out.segments = segments & self.segments
+        return out
+
+    def extend(self, other):
+        """Add the events from other sets of triggers
+
+        Parameters
+        ----------
+        other : `TriggerArray`, :class:`~glue.ligolw.table.Table`, `list`
+            the events to add, or a list of sets of events, which are
+            all added in a single operation; tables are converted first
+
+        Notes
+        -----
+        The ``segments`` of this array are not modified
+        """
+        if hasattr(other, 'tableName'):
+            other = [other]
+        datas = [self.data]
+        times = [self.times]
+        for trigs in other:
+            if not isinstance(trigs, TriggerArray):
+                trigs = type(self).from_table(trigs, columns=self.columnnames)
+            if not len(trigs):
+                continue
+            data = trigs.data
+            if data.dtype != self.data.dtype:
+                data = numpy.zeros(len(trigs), dtype=self.data.dtype)
+                for name in self.data.dtype.names:
+                    if name in trigs.data.dtype.names:
+                        data[name] = trigs.data[name]
+            datas.append(data)
+            times.append(trigs.times)
+        if len(datas) == 1:
+            return
+        self.data = numpy.concatenate(datas)
+        self.times = numpy.concatenate(times)
+        if (numpy.diff(self.times) < 0).any():
+            order = numpy.argsort(self.times, kind='mergesort')
+            self.data = self.data[order]
+            self.times = self.times[order]
+        self._columns = {}
+
+
+# -----------------------------------------------------------------------------
+# kernels
+
+def event_counts(times, edges, values=None, bins=None, operator='>='):
+    """Count events in time bins, for each of a set of column bins
+
+    All column bins are counted in a single pass over the events, using
+    one `numpy.bincount` over the combined (column bin, time bin) index.
+
+    Parameters
+    ----------
+    times : `numpy.ndarray`
+        array of event times
+    edges : `numpy.ndarray`
+        sorted array of time-bin edges
+    values : `numpy.ndarray`, optional
+        array of column values for each event, required if ``bins``
+        are given
+    bins : `list`, optional
+        a list of thresholds, compared to ``values`` with the given
+        ``operator``, or a list of ``(low, high)`` `tuples <tuple>`,
+        defaults to counting all events
+    operator : `str`, `callable`, optional
+        one of ``'<'``, ``'<='``, ``'>'``, ``'>='``, ``'=='``, ``'!='``,
+        ``'in'`` to use ``bins`` as the edges of contiguous column bins,
+        or a callable comparing an array of values to a single bin value;
+        ignored if ``bins`` is a list of tuples
+
+    Returns
+    -------
+    counts : `numpy.ndarray`
+        2-D array of counts, with one row per column bin, and one column
+        per time bin
+    """
+    times = numpy.asarray(times, dtype=float)
+    edges = numpy.asarray(edges, dtype=float)
+    ntime = edges.size - 1
+    tidx = edges.searchsorted(times, side='right') - 1
+    keep = (tidx >= 0) & (tidx < ntime)
+    tidx = tidx[keep]
+    if not bins:
+        return numpy.bincount(tidx, minlength=ntime)[None, :ntime]
+    values = numpy.asarray(values)[keep]
+
+    # contiguous column bins
+    if operator == 'in' and not isinstance(bins[0], tuple):
+        bins = zip(bins[:-1], bins[1:])
+    if isinstance(bins[0], tuple):
+        low, high = map(numpy.asarray, zip(*bins))
+        if (numpy.diff(low) > 0).all() and (low[1:] >= high[:-1]).all():
+            cidx = low.searchsorted(values, side='right') - 1
+            inside = cidx >= 0
+            inside[inside] = values[inside] < high[cidx[inside]]
+            counts = numpy.bincount(cidx[inside] * ntime + tidx[inside],
+                                    minlength=low.size * ntime)
+            return counts[:low.size * ntime].reshape(low.size, ntime)
+        return numpy.vstack([
+            numpy.bincount(tidx[(values >= lo) & (values < hi)],
+                           minlength=ntime)[:ntime] for (lo, hi) in bins])
+
+    # thresholds, count the number passed by each event in one go
+    if operator in ['>=', '>', '<=', '<']:
+        thresholds = numpy.asarray(bins, dtype=float)
+        order = thresholds.argsort(kind='mergesort')
+        side = operator in ['>=', '<'] and 'right' or 'left'
+        cidx = thresholds[order].searchsorted(values, side=side)
+        nthresh = thresholds.size
+        hist = numpy.bincount(cidx * ntime + tidx,
+                              minlength=(nthresh + 1) * ntime)
+        hist = hist[:(nthresh + 1) * ntime].reshape(nthresh + 1, ntime)
+        if operator.startswith('>'):
+            counts = hist[::-1].cumsum(axis=0)[::-1][1:]
+        else:
+            counts = hist.cumsum(axis=0)[:-1]
+        out = numpy.empty_like(counts)
+        out[order] = counts
+        return out
+
+    # anything else
+    if not callable(operator):
+        operator = OPERATORS[operator]
+    return numpy.vstack([numpy.bincount(tidx[operator(values, bin_)],
+                                        minlength=ntime)[:ntime]
+                         for bin_ in bins])
+
+
+def find_loudest(times, ranks, number, dt=0, minimum=None):
+    """Find the loudest events, separated by a minimum time interval
+
+    Events are selected in order of rank, excluding any event within
+    ``dt`` seconds of an event already selected. Any number of rank
+    columns are handled together, each iteration selects the next
+    loudest event for all columns at once.
+
+    Parameters
+    ----------
+    times : `numpy.ndarray`
+        array of event times
+    ranks : `numpy.ndarray`
+        array of event ranks, or 2-D array with one row per rank column
+    number : `int`
+        maximum number of events to select
+    dt : `float`, optional
+        minimum separation (seconds) between selected events, default: 0
+    minimum : `float`, optional
+        minimum rank of selected events
+
+    Returns
+    -------
+    indices : `numpy.ndarray`, `list` of `numpy.ndarray`
+        the indices of the selected events, in order of descending rank,
+        or a list of such arrays if ``ranks`` was 2-D
+    """
+    times = numpy.asarray(times, dtype=float)
+    ranks = numpy.asarray(ranks, dtype=float)
+    flat = ranks.ndim == 1
+    ranks = numpy.atleast_2d(ranks)
+
+    # sort by time, so that exclusion windows are contiguous
+    order = times.argsort(kind='mergesort')
+    times = times[order]
+    remaining = ranks[:, order]
+    remaining[numpy.isnan(remaining)] = -numpy.inf
+    if minimum is not None:
+        remaining[remaining < minimum] = -numpy.inf
+
+    rows = numpy.arange(remaining.shape[0])
+    found = [[] for _ in rows]
+    for _ in range(min(number, times.size)):
+        idx = remaining.argmax(axis=1)
+        active = remaining[rows, idx] > -numpy.inf
+        if not active.any():
+            break
+        lows = times.searchsorted(times[idx] - dt, side='right')
+        highs = times.searchsorted(times[idx] + dt, side='left')
+        for row in rows[active]:
+            found[row].append(order[idx[row]])
+            remaining[row, min(lows[row], idx[row]):
+                      max(highs[row], idx[row] + 1)] = -numpy.inf
+    found = [numpy.array(f, dtype=int) for f in found]
+    if flat:
+        return found[0]
+    return found
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Duncan Macleod (2013)
+#
+# This file is part of GWSumm.
+#
+# GWSumm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GWSumm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GWSumm.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Persistent on-disk cache of parsed event trigger files
+
+The first time a trigger file is parsed, the requested columns are
+written to a compressed `numpy` ``.npz`` sidecar file, named by a hash
+of the file path, modification time and size, the table type, the
+columns, and the read options. Later reads of the same file load the
+sidecar, rather than parsing the original again.
+"""
+
+import os
+import hashlib
+import tempfile
+
+import numpy
+
+from glue.ligolw import ilwd
+
+from . import version
+from .triggerarray import (TriggerArray, get_column_dtype)
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+__version__ = version.version
+
+_CACHES = {}
+
+
+class TriggerCache(object):
+    """Store of column arrays for parsed trigger files
+
+    Parameters
+    ----------
+    directory : `str`
+        path of the cache directory
+    """
+    def __init__(self, directory):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+
+    def get_key(self, path, tableclass, columns=None, **kwargs):
+        """Return the hash identifying a parsed trigger file
+
+        Parameters
+        ----------
+        path : `str`
+            path of trigger file
+        tableclass : `type`
+            the LIGO_LW table class the file is read as
+        columns : `list` of `str`, optional
+            the columns read
+        **kwargs
+            other options used when reading the file
+
+        Returns
+        -------
+        key : `str`
+            the hex digest identifying this version of this file, read
+            with these options; any ``contenthandler`` is ignored, files
+            read with a custom content handler should not be cached
+
+        Raises
+        ------
+        OSError
+            if the file cannot be found
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        kwargs.pop('contenthandler', None)
+        md5 = hashlib.md5()
+        md5.update(repr((path, stat.st_mtime, stat.st_size,
+                         tableclass.tableName,
+                         columns is not None and sorted(map(str, columns)),
+                         sorted(kwargs.items()))))
+        return md5.hexdigest()
+
+    def get_path(self, key):
+        """Return the path of the sidecar file for the given key
+        """
+        return os.path.join(self.directory, key[:2], '%s.npz' % key)
+
+    def read(self, path, tableclass, columns=None, **kwargs):
+        """Read the cached triggers for a file
+
+        Returns
+        -------
+        triggers : `~gwsumm.triggerarray.TriggerArray`, `None`
+            the cached triggers, or `None` if this file, as it is now,
+            has not been cached
+        """
+        try:
+            sidecar = self.get_path(
+                self.get_key(path, tableclass, columns=columns, **kwargs))
+            npz = numpy.load(sidecar)
+        except (IOError, OSError, ValueError):
+            return None
+        try:
+            names = [str(n) for n in npz['columns']]
+            dtype = get_column_dtype(tableclass, names)
+            times = npz['times']
+            data = numpy.zeros(times.size, dtype=dtype)
+            for i, name in enumerate(names):
+                values = npz['column%d' % i]
+                if tableclass.validcolumns.get(name) == 'ilwd:char':
+                    values = [ilwd.ilwdchar(v) for v in values.tolist()]
+                elif dtype[name] == numpy.dtype(object):
+                    values = values.tolist()
+                data[name] = values
+        except (KeyError, ValueError):
+            return None
+        finally:
+            npz.close()
+        return TriggerArray(tableclass, data=data, times=times)
+
+    def write(self, path, triggers, columns=None, **kwargs):
+        """Record the triggers parsed from a file
+
+        Columns stored as objects are written as strings, and ``ilwd:char``
+        IDs are restored when read. Triggers with any other objects
+        (including missing values) are not recorded, since they could not
+        be read back as they are.
+        """
+        try:
+            sidecar = self.get_path(self.get_key(
+                path, triggers.tableclass, columns=columns, **kwargs))
+        except OSError:
+            return
+        directory = os.path.dirname(sidecar)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # created by another process
+                if not os.path.isdir(directory):
+                    raise
+        arrays = {'times': triggers.times,
+                  'columns': numpy.array(triggers.columnnames)}
+        for i, name in enumerate(triggers.columnnames):
+            values = triggers.data[name]
+            if values.dtype == numpy.dtype(object):
+                if not all(isinstance(v, (str, ilwd.ilwdchar))
+                           for v in values):
+                    return
+                values = numpy.array(map(str, values))
+            arrays['column%d' % i] = values
+        fd, tmp = tempfile.mkstemp(suffix='.npz', dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            numpy.savez_compressed(f, **arrays)
+        os.rename(tmp, sidecar)
+
+
+def get_trigger_cache(directory):
+    """Return the `TriggerCache` for the given directory
+    """
+    directory = os.path.abspath(os.path.expanduser(directory))
+    try:
+        return _CACHES[directory]
+    except KeyError:
+        _CACHES[directory] = TriggerCache(directory)
+        return _CACHES[directory]
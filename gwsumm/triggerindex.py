@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Duncan Macleod (2013)
+#
+# This file is part of GWSumm.
+#
+# GWSumm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GWSumm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GWSumm.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Index of trigger files on disk
+
+Trigger files written by the DMT (e.g. Omega and KleineWelle) are
+stored in one directory per 100000 seconds, with
+`LIGO-T050017 <https://dcc.ligo.org/LIGO-T050017/public>`_ file names
+giving the GPS span of each file. The `TriggerFileIndex` lists each
+directory once, recording the ``(start, duration, name)`` of each
+matching file, and only lists it again when the directory's
+modification time changes. The index can be persisted to a JSON file
+so that discovery is shared between runs.
+"""
+
+import os
+import glob
+import json
+import fcntl
+import tempfile
+from contextlib import contextmanager
+
+import numpy
+
+from glue.lal import (Cache, CacheEntry)
+
+from . import version
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+__version__ = version.version
+
+_INDEXES = {}
+
+
+def _parse_name(filename):
+    """Parse the GPS ``(start, duration)`` from a T050017 file name
+
+    Returns `None` if the name cannot be parsed
+    """
+    base = os.path.basename(filename).split('.', 1)[0]
+    try:
+        _, start, duration = base.rsplit('-', 2)
+        return float(start), float(duration)
+    except ValueError:
+        return None
+
+
+class TriggerFileIndex(object):
+    """Record of the trigger files in a set of directories
+
+    Parameters
+    ----------
+    path : `str`, optional
+        path of JSON file in which to persist this index, if not given
+        the index is kept in memory only
+    """
+    def __init__(self, path=None):
+        if path is not None:
+            path = os.path.abspath(os.path.expanduser(path))
+        self.path = path
+        self._entries = {}
+        self._changed = set()
+        self._loaded = False
+
+    # -------------------------------------------------------------------------
+    # persistence
+
+    @contextmanager
+    def lock(self):
+        """Hold an exclusive lock on the index file
+        """
+        if self.path is None:
+            yield
+            return
+        with open('%s.lock' % self.path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read(self):
+        """Read the stored index, returning a `dict` of entries
+        """
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        out = {}
+        for directory, patterns in stored.iteritems():
+            for pattern, entry in patterns.iteritems():
+                out[(directory, pattern)] = (
+                    entry['mtime'],
+                    numpy.array(entry['starts'], dtype=float),
+                    numpy.array(entry['durations'], dtype=float),
+                    list(entry['names']))
+        return out
+
+    def _write(self):
+        stored = {}
+        for (directory, pattern), entry in self._entries.iteritems():
+            stored.setdefault(directory, {})[pattern] = {
+                'mtime': entry[0],
+                'starts': entry[1].tolist(),
+                'durations': entry[2].tolist(),
+                'names': entry[3],
+            }
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(suffix='.json', dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(stored, f)
+        os.rename(tmp, self.path)
+
+    # -------------------------------------------------------------------------
+    # scanning
+
+    def _scan(self, directory, pattern):
+        """List the files in a directory matching a glob pattern
+
+        Returns
+        -------
+        entry : `tuple`
+            ``(mtime, starts, durations, names)`` for this directory,
+            sorted by name, or `None` if the directory does not exist
+        """
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            return None
+        key = (directory, pattern)
+        try:
+            entry = self._entries[key]
+        except KeyError:
+            pass
+        else:
+            if entry[0] == mtime:
+                return entry
+        starts = []
+        durations = []
+        names = []
+        for f in sorted(glob.glob(os.path.join(directory, pattern))):
+            span = _parse_name(f)
+            if span is None:
+                continue
+            starts.append(span[0])
+            durations.append(span[1])
+            names.append(os.path.basename(f))
+        self._entries[key] = entry = (
+            mtime, numpy.array(starts, dtype=float),
+            numpy.array(durations, dtype=float), names)
+        self._changed.add(key)
+        return entry
+
+    def _merge(self):
+        """Merge the entries scanned by this index into the stored index
+
+        Each entry is only written if it is newer than that stored, so
+        that a directory listed more recently by another process is kept,
+        and all other stored entries are loaded into this index.
+        """
+        stored = self._read()
+        for key in self._changed:
+            entry = self._entries[key]
+            if key not in stored or stored[key][0] < entry[0]:
+                stored[key] = entry
+        self._entries = stored
+        self._changed = set()
+
+    def find(self, directories, pattern, start, end):
+        """Find files matching a pattern overlapping a GPS span
+
+        Parameters
+        ----------
+        directories : `list` of `str`
+            the directories to search
+        pattern : `str`
+            glob pattern for file names in each directory
+        start : `float`
+            GPS start time of span
+        end : `float`
+            GPS end time of span
+
+        Returns
+        -------
+        cache : :class:`~glue.lal.Cache`
+            the cache of files overlapping ``[start, end)``, sorted
+            by path
+        """
+        start = float(start)
+        end = float(end)
+        with self.lock():
+            if self.path is not None and not self._loaded:
+                self._entries.update(self._read())
+                self._loaded = True
+            found = []
+            for directory in directories:
+                entry = self._scan(directory, pattern)
+                if entry is None:
+                    continue
+                _, starts, durations, names = entry
+                overlap = ((starts < end) & (starts + durations > start))
+                found.extend(os.path.join(directory, names[i]) for i in
+                             overlap.nonzero()[0])
+            if self.path is not None and self._changed:
+                self._merge()
+                self._write()
+        found.sort()
+        return Cache(map(CacheEntry.from_T050017, found))
+
+
+def get_trigger_file_index(path=None):
+    """Return the `TriggerFileIndex` persisted to the given path
+
+    If ``path`` is `None`, the in-memory index for this process is
+    returned
+    """
+    if path is not None:
+        path = os.path.abspath(os.path.expanduser(path))
+    try:
+        return _INDEXES[path]
+    except KeyError:
+        _INDEXES[path] = TriggerFileIndex(path)
+        return _INDEXES[path]
@@ -20,14 +20,18 @@
 """
 
 import os.path
-import glob
 import re
+import operator as operator_
+from math import (ceil, floor)
+from multiprocessing import Pool
+
+import numpy
 try:
     from configparser import (ConfigParser, NoSectionError, NoOptionError)
 except ImportError:
     from ConfigParser import (ConfigParser, NoSectionError, NoOptionError)
 
-from glue.lal import (Cache, CacheEntry)
+from glue.lal import Cache
 from glue.ligolw.table import (StripTableName as strip_table_name,
                                CompareTableNames as compare_table_names)
 from glue.ligolw.ligolw import PartialLIGOLWContentHandler
@@ -36,13 +40,19 @@ from gwpy.io.cache import cache_segments
 from gwpy.table import lsctables
 from gwpy.table.io import trigfind
 from gwpy.time import to_gps
+from gwpy.timeseries import TimeSeries
+from gwpy.plotter.table import get_column_string
 
-from gwpy.table.utils import (get_table_column, get_row_value)
 from gwpy.segments import (DataQualityFlag, SegmentList, Segment)
 
 from . import globalv
-from .utils import (re_cchar, vprint)
+from .utils import (re_cchar, vprint, count_free_cores)
 from .channels import get_channel
+from .data import add_timeseries
+from .segmentarray import binned_livetime
+from .triggerarray import (TriggerArray, get_time_columns, event_counts)
+from .triggercache import get_trigger_cache
+from .triggerindex import get_trigger_file_index
 
 ETG_TABLE = lsctables.TableByName.copy()
 ETG_TABLE.update({
@@ -145,10 +155,117 @@ def get_partial_contenthandler(table):
     return _ContentHandler
 
 
+def get_cache(config=ConfigParser()):
+    """Return the on-disk cache of parsed trigger files for this job
+
+    The cache is configured via the ``cache-directory`` option of the
+    ``[triggers]`` section.
+
+    Returns
+    -------
+    cache : `~gwsumm.triggercache.TriggerCache`, `None`
+        the cache of parsed files, or `None` if no cache is configured
+    """
+    try:
+        directory = config.get('triggers', 'cache-directory')
+    except (NoSectionError, NoOptionError):
+        return None
+    return get_trigger_cache(directory)
+
+
+def read_triggers(TableClass, files, columns=None, sidecar=None, **kwargs):
+    """Read triggers from files, using the sidecar cache where possible
+
+    Parameters
+    ----------
+    TableClass : `type`
+        the LIGO_LW table class to read
+    files : `list`, :class:`~glue.lal.Cache`
+        the files to read
+    columns : `list` of `str`, optional
+        the columns to read, defaults to all columns
+    sidecar : `~gwsumm.triggercache.TriggerCache`, optional
+        the cache of previously parsed files, default: `None`, not used
+        if a custom ``contenthandler`` is given
+    **kwargs
+        other keyword arguments to pass to ``TableClass.read``
+
+    Returns
+    -------
+    triggers : `~gwsumm.triggerarray.TriggerArray`
+        the events read from all files
+    """
+    # files read with a custom content handler are not cached
+    if kwargs.get('contenthandler', None) is not None:
+        sidecar = None
+    if kwargs.get('format', None) == 'ligolw':
+        if kwargs.get('contenthandler', None) is None:
+            kwargs['contenthandler'] = get_partial_contenthandler(TableClass)
+        lsctables.use_in(kwargs['contenthandler'])
+    if sidecar is None:
+        table = TableClass.read(files, columns=columns, **kwargs)
+        return TriggerArray.from_table(table, columns=columns)
+    parts = []
+    for f in files:
+        path = getattr(f, 'path', f)
+        trigs = sidecar.read(path, TableClass, columns=columns, **kwargs)
+        if trigs is None:
+            table = TableClass.read(path, columns=columns, **kwargs)
+            trigs = TriggerArray.from_table(table, columns=columns)
+            sidecar.write(path, trigs, columns=columns, **kwargs)
+        parts.append(trigs)
+    if parts:
+        out = parts.pop(0)
+    else:
+        out = TriggerArray(TableClass, columns=columns)
+    out.extend(parts)
+    return out
+
+
+def _read_triggers(task):
+    """Read the triggers from a set of files over a single segment
+
+    This method is the target for `get_triggers` when reading in
+    parallel, returning only the compact column arrays for those events
+    inside the segment.
+
+    Parameters
+    ----------
+    task : `tuple`
+        ``(TableClass, files, segment, channel, sidecar, kwargs)`` tuple,
+        where ``channel`` is the name to match in the ``channel`` column,
+        or `None` to accept all events
+
+    Returns
+    -------
+    triggers : `~gwsumm.triggerarray.TriggerArray`
+        the events read from the given files
+    """
+    TableClass, files, segment, channel, sidecar, kwargs = task
+    trigs = read_triggers(TableClass, files, sidecar=sidecar, **kwargs)
+    keep = (trigs.times >= segment[0]) & (trigs.times < segment[1])
+    if channel is not None and 'channel' in trigs.columnnames:
+        keep &= trigs.get_column('channel') == channel
+    return trigs[keep]
+
+
 def get_triggers(channel, etg, segments, config=ConfigParser(), cache=None,
                  query=True, multiprocess=False, tablename=None,
                  columns=None, contenthandler=None, return_=True):
     """Read a table of transient event triggers for a given channel.
+
+    Triggers are stored in `globalv.TRIGGERS` as a time-sorted
+    `~gwsumm.triggerarray.TriggerArray`, use
+    :meth:`~gwsumm.triggerarray.TriggerArray.to_table` on the output
+    to recover a LIGO_LW table.
+
+    If ``multiprocess`` is `True`, or an `int` greater than 1, the
+    trigger files are read in parallel, in groups split by file and by
+    segment.
+
+    If the ``[triggers]`` section of the configuration gives a
+    ``cache-directory``, the columns parsed from each file are cached
+    there, and read back by later calls, see :func:`read_triggers`.
     """
     key = '%s,%s' % (str(channel), etg.lower())
     if isinstance(segments, DataQualityFlag):
@@ -160,7 +277,7 @@ def get_triggers(channel, etg, segments, config=ConfigParser(), cache=None,
         TableClass = lsctables.TableByName[tablename]
         register_etg_table(etg, TableClass, force=True)
     elif key in globalv.TRIGGERS:
-        TableClass = type(globalv.TRIGGERS[key])
+        TableClass = globalv.TRIGGERS[key].tableclass
     else:
         TableClass = get_etg_table(etg)
 
@@ -174,7 +291,8 @@ def get_triggers(channel, etg, segments, config=ConfigParser(), cache=None,
             else:
                 columns = TableClass.validcolumns.keys()
     if columns is not None:
-        for col in ['process_id', 'search', 'channel']:
+        for col in ['process_id', 'search', 'channel'] + list(
+                get_time_columns(TableClass) or []):
             if col not in columns:
                 columns.append(col)
 
@@ -183,39 +301,42 @@ def get_triggers(channel, etg, segments, config=ConfigParser(), cache=None,
         havesegs = globalv.TRIGGERS[key].segments
     except KeyError:
         new = segments
-        globalv.TRIGGERS.setdefault(
-            key, lsctables.New(TableClass, columns=columns))
-        globalv.TRIGGERS[key].segments = type(segments)()
+        globalv.TRIGGERS[key] = TriggerArray(TableClass, columns=columns)
     else:
         new = segments - havesegs
 
     # read new triggers
     query &= (abs(new) != 0)
     if query:
-        # store read kwargs
-        kwargs = {'columns': columns}
-
-        # set content handler
-        if contenthandler is None:
-            contenthandler = get_partial_contenthandler(TableClass)
-        lsctables.use_in(contenthandler)
+        # get processes
+        if multiprocess is True:
+            nproc = count_free_cores()
+        elif multiprocess is False:
+            nproc = 1
+        else:
+            nproc = multiprocess
 
+        # find trigger files and build read tasks
+        sidecar = get_cache(config)
+        tasks = []
+        readsegs = SegmentList()
         for segment in new:
-            kwargs['filt'] = (
-                lambda t: float(get_row_value(t, 'time')) in segment)
+            # store read kwargs
+            kwargs = {'columns': columns}
+            chanfilt = None
             # find trigger files
             if cache is None and etg.lower() == 'hacr':
                 raise NotImplementedError("HACR parsing has not been "
                                           "implemented.")
             if cache is None and re.match('dmt(.*)omega', etg.lower()):
-                segcache = find_dmt_omega(channel, segment[0], segment[1])
+                segcache = find_dmt_omega(channel, segment[0], segment[1],
+                                          index=get_file_index(config))
                 kwargs['format'] = 'ligolw'
             elif cache is None and etg.lower() in ['kw', 'kleinewelle']:
-                segcache = find_kw(channel, segment[0], segment[1])
+                segcache = find_kw(channel, segment[0], segment[1],
+                                   index=get_file_index(config))
                 kwargs['format'] = 'ligolw'
-                kwargs['filt'] = lambda t: (
-                    float(get_row_value(t, 'time')) in segment and
-                    t.channel == str(channel))
+                chanfilt = str(channel)
             elif cache is None:
                 segcache = trigfind.find_trigger_urls(str(channel), etg,
                                                       segment[0],
@@ -232,45 +353,254 @@ def get_triggers(channel, etg, segments, config=ConfigParser(), cache=None,
             if (issubclass(TableClass, lsctables.SnglBurstTable) and
                     etg.lower().startswith('cwb')):
                 kwargs['ifo'] = get_channel(channel).ifo
-            # read triggers and store
             if len(segcache) == 0:
                 continue
-            if kwargs.get('format', None) == 'ligolw':
+            if (kwargs.get('format', None) == 'ligolw' and
+                    contenthandler is not None):
                 kwargs['contenthandler'] = contenthandler
-            table = TableClass.read(segcache, **kwargs)
-            globalv.TRIGGERS[key].extend(table)
+            # split files into one group per process
+            step = int(ceil(len(segcache) / float(nproc)))
+            for i in range(0, len(segcache), step):
+                tasks.append((TableClass, type(segcache)(segcache[i:i+step]),
+                              (float(segment[0]), float(segment[1])),
+                              chanfilt, sidecar, kwargs))
+            # events are only kept inside the segment
             try:
-                csegs = cache_segments(segcache)
+                readsegs.extend(cache_segments(segcache) &
+                                SegmentList([segment]))
             except AttributeError:
-                csegs = SegmentList()
+                pass
+
+        # read triggers and store
+        if nproc > 1 and len(tasks) > 1 and contenthandler is None:
+            pool = Pool(min(nproc, len(tasks)))
             try:
-                globalv.TRIGGERS[key].segments.extend(csegs)
-            except AttributeError:
-                globalv.TRIGGERS[key].segments = csegs
+                triggers = pool.map(_read_triggers, tasks)
             finally:
-                globalv.TRIGGERS[key].segments.coalesce()
-            vprint('\r')
+                pool.close()
+                pool.join()
+        else:
+            triggers = map(_read_triggers, tasks)
+        globalv.TRIGGERS[key].extend(triggers)
+        globalv.TRIGGERS[key].segments.extend(readsegs)
+        globalv.TRIGGERS[key].segments.coalesce()
+        vprint('\r')
 
-    # work out time function
+    # return correct triggers
     if return_:
-        times = get_table_column(globalv.TRIGGERS[key], 'time').astype(float)
-
-        # return correct triggers
-        out = lsctables.New(TableClass, columns=columns)
+        out = globalv.TRIGGERS[key].select(segments)
         out.channel = str(channel)
         out.etg = str(etg)
-        out.extend(t for (i, t) in enumerate(globalv.TRIGGERS[key]) if
-                   times[i] in segments)
-        out.segments = segments & globalv.TRIGGERS[key].segments
         return out
     else:
         return
 
 
-def find_dmt_omega(channel, start, end, base=None):
+def get_rate_key(channel, etg, column=None, bin_='_', stride=1, state=None):
+    """Return the `globalv.DATA` key for a trigger rate `TimeSeries`
+    """
+    state = re_cchar.sub('_', state is not None and str(state) or 'All')
+    return '%s_%s_%s_EVENT_RATE_%s_%s_STRIDE_%g' % (
+        str(channel), str(etg), state, str(column), str(bin_), stride)
+
+
+def _rate_series(values, start, stride, channel, name):
+    return TimeSeries(values, epoch=start, sample_rate=1/float(stride),
+                      unit='Hz', name=name, channel=channel)
+
+
+def _add_finer_rates(key, stride, span, segments):
+    """Build rates for a key by averaging stored rates with a finer stride
+
+    Returns the parts of ``segments`` filled in this way
+    """
+    prefix = key.rsplit('_STRIDE_', 1)[0]
+    filled = SegmentList()
+    for finekey in globalv.DATA.keys():
+        try:
+            fprefix, fstride = str(finekey).rsplit('_STRIDE_', 1)
+            fstride = float(fstride)
+        except ValueError:
+            continue
+        factor = stride / fstride
+        if (fprefix != prefix or fstride >= stride or
+                abs(factor - round(factor)) > 1e-6):
+            continue
+        factor = int(round(factor))
+        for ts in globalv.DATA.crop(finekey, segments - filled):
+            t0, t1 = map(float, ts.span)
+            c0 = span[0] + ceil((t0 - span[0]) / stride) * stride
+            i0 = (c0 - t0) / fstride
+            nbin = int(floor((t1 - c0) / stride))
+            if nbin < 1 or abs(i0 - round(i0)) > 1e-6:
+                continue
+            i0 = int(round(i0))
+            values = ts.value[i0:i0 + nbin * factor].reshape(nbin, factor)
+            add_timeseries(_rate_series(values.mean(axis=1), c0, stride,
+                                        ts.channel, ts.name), key=key)
+            filled.append(Segment(c0, c0 + nbin * stride))
+        filled.coalesce()
+    return filled
+
+
+def _add_counted_rates(keys, labels, channel, triggers, stride, span,
+                       state=None, column=None, bins=None, operator='>='):
+    """Build rates for some keys by counting triggers
+
+    Rates are only stored for complete strides, i.e. those for which the
+    state is known, and triggers have been read for all times in the
+    state
+    """
+    whole = SegmentList([Segment(*span)])
+    if state is None:
+        valid, known = whole, whole
+    else:
+        valid = state.active & whole
+        known = state.known & whole
+    known &= SegmentList([Segment(span[0], max(span[0], float(globalv.NOW)))])
+    nbin = int(ceil((span[1] - span[0]) / stride))
+    edges = span[0] + numpy.arange(nbin + 1) * stride
+
+    # find complete strides that are not yet stored
+    duration = binned_livetime(whole, edges)
+    complete = ((binned_livetime(known, edges) >= duration - 1e-6) &
+                (binned_livetime(valid, edges) - binned_livetime(
+                     valid & triggers.segments, edges) < 1e-6))
+    idx = numpy.flatnonzero(complete)
+    runs = numpy.split(idx, numpy.flatnonzero(numpy.diff(idx) != 1) + 1)
+    complete = SegmentList([Segment(edges[r[0]], edges[r[-1] + 1]) for
+                            r in runs if r.size])
+    if not abs(reduce(operator_.or_, (globalv.DATA.missing(key, complete) for
+                                      key in keys))):
+        return
+
+    # count triggers in the state for all strides in one pass
+    trigs = triggers.select(valid)
+    if column is None:
+        counts = event_counts(trigs.times, edges)
+    else:
+        counts = event_counts(trigs.times, edges, trigs.get_column(column),
+                              bins, operator)
+    for key, label, count in zip(keys, labels, counts):
+        rate = _rate_series(count / float(stride), span[0], stride,
+                            str(channel), label)
+        for m in globalv.DATA.missing(key, complete):
+            if abs(m) >= stride:
+                add_timeseries(rate.crop(*map(float, m)), key=key)
+
+
+def get_trigger_rates(channel, etg, stride, span, state=None, column=None,
+                      bins=None, operator='>=', return_=True):
+    """Calculate the event rate for some triggers, in one or more bins
+
+    Rates are calculated for all bins in a single pass over the
+    time-sorted triggers already read by :func:`get_triggers`, and are
+    stored in `globalv.DATA`, so that they are only calculated once, and
+    are archived with other time-series data. Rates for a stride that
+    is a multiple of the stride of stored rates for the same triggers,
+    state and bins (e.g. those read from the daily archives for a weekly
+    summary) are calculated by averaging the stored rates.
+
+    Parameters
+    ----------
+    channel : `str`
+        name of channel (as passed to :func:`get_triggers`)
+    etg : `str`
+        name of event trigger generator
+    stride : `float`
+        length (seconds) of each rate bin
+    span : `~gwpy.segments.Segment`
+        ``[start, end)`` interval of interest, rate bins are aligned
+        to the start of this span
+    state : `~gwsumm.state.SummaryState`, optional
+        state in which to count triggers, defaults to counting all
+        triggers in the span
+    column : `str`, optional
+        name of column by which to bin triggers
+    bins : `list`, optional
+        list of bins for ``column``, see
+        :func:`~gwsumm.triggerarray.event_counts` for details
+    operator : `str`, `callable`, optional
+        comparison between ``column`` value and each bin, default: ``'>='``
+    return_ : `bool`, optional
+        return the keys of the rate `TimeSeries`, default: `True`
+
+    Returns
+    -------
+    keys : `list` of `str`
+        the `globalv.DATA` keys of the rate `TimeSeries` for each bin
+
+    Notes
+    -----
+    As for a histogram of the triggers, each rate is the number of
+    triggers in the given state in a stride, divided by the stride, so
+    strides that are only partly in the state (or the span) give a
+    proportionally lower rate. Strides are only calculated once the
+    state is known for the whole stride, and triggers have been read for
+    all of it, so the final stride of a summary that is still running
+    is not shown.
+    """
+    if column is None or not bins:
+        column = None
+        bins = ['_']
+    keys = [get_rate_key(channel, etg, column, bin_, stride, state=state)
+            for bin_ in bins]
+    span = (float(span[0]), float(span[1]))
+    whole = SegmentList([Segment(*span)])
+
+    # use finer stored rates where possible
+    for key in keys:
+        _add_finer_rates(key, stride, span, globalv.DATA.missing(key, whole))
+
+    # otherwise, count triggers in one pass over all strides in the span
+    try:
+        triggers = globalv.TRIGGERS['%s,%s' % (str(channel), etg.lower())]
+    except KeyError:
+        pass
+    else:
+        if column is None:
+            labels = ['Event rate']
+        else:
+            colstr = get_column_string(column)
+            labels = ['%s $%s$ %s' % (colstr, operator, bin_) for
+                      bin_ in bins]
+        _add_counted_rates(keys, labels, channel, triggers, stride, span,
+                           state=state, column=column, bins=bins,
+                           operator=operator)
+    if return_:
+        return keys
+
+
+def get_file_index(config=ConfigParser()):
+    """Return the index of trigger files on disk for this job
+
+    The index is persisted to the file given by the ``file-index``
+    option of the ``[triggers]`` section, if given, otherwise it is
+    kept in memory for this process only.
+
+    Returns
+    -------
+    index : `~gwsumm.triggerindex.TriggerFileIndex`
+        the index of trigger files
+    """
+    try:
+        path = config.get('triggers', 'file-index')
+    except (NoSectionError, NoOptionError):
+        path = None
+    return get_trigger_file_index(path)
+
+
+def _gps_directories(base, start, end, format_='%d'):
+    """List the 5-digit GPS directories under a base path for a span
+    """
+    gps5 = int('%.5s' % start)
+    end5 = int('%.5s' % end)
+    return [os.path.join(base, format_ % d) for d in range(gps5, end5 + 1)]
+
+
+def find_dmt_omega(channel, start, end, base=None, index=None):
     """Find DMT-Omega trigger XML files
     """
-    span = Segment(to_gps(start), to_gps(end))
     channel = get_channel(channel)
     ifo = channel.ifo
     if base is None and channel.name.split(':', 1)[-1] == 'GDS-CALIB_STRAIN':
@@ -279,31 +609,21 @@ def find_dmt_omega(channel, start, end, base=None):
     elif base is None:
         raise NotImplementedError("This method doesn't know how to locate DMT "
                                   "Omega trigger files for %r" % str(channel))
-    gps5 = int('%.5s' % start)
-    end5 = int('%.5s' % end)
-    out = Cache()
-    append = out.append
-    while gps5 <= end5:
-        trigglob = os.path.join(
-            base, str(gps5),
-            '%s-%s_%s_%s_OmegaC-*-*.xml' % (
-                ifo, channel.system, channel.subsystem, channel.signal))
-        found = glob.glob(trigglob)
-        for f in found:
-            ce = CacheEntry.from_T050017(f)
-            if ce.segment.intersects(span):
-                append(ce)
-        gps5 += 1
-    out.sort(key=lambda e: e.path)
+    if index is None:
+        index = get_trigger_file_index()
+    out = index.find(_gps_directories(base, start, end),
+                     '%s-%s_%s_%s_OmegaC-*-*.xml' % (
+                         ifo, channel.system, channel.subsystem,
+                         channel.signal),
+                     to_gps(start), to_gps(end))
     vprint("    Found %d files for %s (DMT-Omega)\n"
            % (len(out), channel.ndsname))
     return out
 
 
-def find_kw(channel, start, end, base=None):
+def find_kw(channel, start, end, base=None, index=None):
     """Find KW trigger XML files
     """
-    span = Segment(to_gps(start), to_gps(end))
     channel = get_channel(channel)
     ifo = channel.ifo
     if base is None and channel.name.split(':', 1)[-1] == 'GDS-CALIB_STRAIN':
@@ -312,20 +632,10 @@ def find_kw(channel, start, end, base=None):
     elif base is None:
         tag = '%s-KW_TRIGGERS' % ifo[0].upper()
         base = '/gds-%s/dmt/triggers/%s' % (ifo.lower(), tag)
-    gps5 = int('%.5s' % start)
-    end5 = int('%.5s' % end)
-    out = Cache()
-    append = out.append
-    while gps5 <= end5:
-        trigglob = os.path.join(
-            base, '%s-%d' % (tag, gps5), '%s-*-*.xml' % tag)
-        found = glob.glob(trigglob)
-        for f in found:
-            ce = CacheEntry.from_T050017(f)
-            if ce.segment.intersects(span):
-                append(ce)
-        gps5 += 1
-    out.sort(key=lambda e: e.path)
+    if index is None:
+        index = get_trigger_file_index()
+    out = index.find(_gps_directories(base, start, end, '%s-%%d' % tag),
+                     '%s-*-*.xml' % tag, to_gps(start), to_gps(end))
     vprint("    Found %d files for %s (KW)\n"
            % (len(out), channel.ndsname))
     return out